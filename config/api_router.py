@@ -1,7 +1,7 @@
 from django.conf import settings
 from rest_framework.routers import DefaultRouter, SimpleRouter
 
-from threatr.core.api.generic import RequestView, TypesView, ModulesView, StatusView
+from threatr.core.api.generic import EntityView, RequestView, TypesView, ModulesView, StatusView
 
 if settings.DEBUG:
     router = DefaultRouter()
@@ -10,6 +10,7 @@ else:
 
 # router.register("users", UserViewSet)
 router.register("request", RequestView, basename='request')
+router.register("entity", EntityView, basename='entity')
 router.register("modules", ModulesView, basename='modules')
 router.register("status", StatusView, basename='status')
 router.register("types", TypesView, basename='types')
@@ -319,3 +319,61 @@ Q_CLUSTER = {
     "label": "Django Q",
     "redis": env("REDIS_URL"),
 }
+# Threatr
+# ------------------------------------------------------------------------------
+# Lifetime in seconds of the cached result documents, 0 disables the cache
+THREATR_RESULT_CACHE_TTL = env.int("THREATR_RESULT_CACHE_TTL", default=60 * 60)
+# Interval in minutes between two compactions of the overlapping events
+THREATR_EVENT_COMPACTION_INTERVAL = env.int("THREATR_EVENT_COMPACTION_INTERVAL", default=60)
+# Age in days after which requests are purged, and how many are deleted per statement
+THREATR_REQUEST_RETENTION_DAYS = env.int("THREATR_REQUEST_RETENTION_DAYS", default=30)
+THREATR_REQUEST_RETENTION_BATCH_SIZE = env.int("THREATR_REQUEST_RETENTION_BATCH_SIZE", default=1000)
+# Age in seconds after which a request still in flight is failed, beyond the time the workers may spend retrying it
+THREATR_REQUEST_STALE_AFTER = env.int("THREATR_REQUEST_STALE_AFTER", default=4 * 60 * 60)
+# Interval in seconds between two checks of the version of the entity types loaded by each process
+THREATR_TYPE_REGISTRY_CHECK_INTERVAL = env.int("THREATR_TYPE_REGISTRY_CHECK_INTERVAL", default=30)
+# Number of analysis modules run concurrently for a request and how long in seconds to wait for them to complete
+THREATR_MODULES_CONCURRENCY = env.int("THREATR_MODULES_CONCURRENCY", default=4)
+THREATR_MODULES_DEADLINE = env.int("THREATR_MODULES_DEADLINE", default=10 * 60)
+# Longest time in seconds a module waits for the rate limit of its vendor before being rescheduled
+THREATR_RATE_LIMIT_MAX_WAIT = env.int("THREATR_RATE_LIMIT_MAX_WAIT", default=30)
+# Directory of the archived vendor responses and the size in megabytes above which the oldest ones are evicted
+THREATR_ARCHIVE_ROOT = env("THREATR_ARCHIVE_ROOT", default=str(APPS_DIR / "archive"))
+THREATR_ARCHIVE_MAX_SIZE = env.int("THREATR_ARCHIVE_MAX_SIZE", default=1024)
+# Maximum number of values looked up by a single batch request
+THREATR_BATCH_MAX_SIZE = env.int("THREATR_BATCH_MAX_SIZE", default=5000)
+# Result documents are streamed in chunks of this many bytes, reading this many objects at once from the database
+THREATR_RESULT_STREAMING_BUFFER_SIZE = env.int("THREATR_RESULT_STREAMING_BUFFER_SIZE", default=64 * 1024)
+THREATR_RESULT_STREAMING_CHUNK_SIZE = env.int("THREATR_RESULT_STREAMING_CHUNK_SIZE", default=500)
+# Size in kilobytes of the largest result document kept in the cache
+THREATR_RESULT_CACHE_MAX_SIZE = env.int("THREATR_RESULT_CACHE_MAX_SIZE", default=1024)
+# Limits of the neighbourhood traversal: number of hops, neighbours followed from each entity and entities returned
+THREATR_NEIGHBOURHOOD_MAX_DEPTH = env.int("THREATR_NEIGHBOURHOOD_MAX_DEPTH", default=3)
+THREATR_NEIGHBOURHOOD_MAX_FAN_OUT = env.int("THREATR_NEIGHBOURHOOD_MAX_FAN_OUT", default=100)
+THREATR_NEIGHBOURHOOD_MAX_NODES = env.int("THREATR_NEIGHBOURHOOD_MAX_NODES", default=2000)
+# Pivoting: maximum number of hops and of module runs of a request, delay in seconds before the first pivot is
+# handled and between two pivots so that they never get ahead of the requests of the users
+THREATR_PIVOT_MAX_DEPTH = env.int("THREATR_PIVOT_MAX_DEPTH", default=2)
+THREATR_PIVOT_MAX_BUDGET = env.int("THREATR_PIVOT_MAX_BUDGET", default=100)
+THREATR_PIVOT_DELAY = env.int("THREATR_PIVOT_DELAY", default=60)
+THREATR_PIVOT_INTERVAL = env.int("THREATR_PIVOT_INTERVAL", default=5)
+# Freshness in hours of the data of each analysis module overriding its default, e.g. "shodan=24;vt=168", and how
+# long in minutes to wait before enqueuing the refresh of stale data again
+THREATR_MODULES_FRESHNESS = env.dict("THREATR_MODULES_FRESHNESS", cast={"value": int}, default={})
+THREATR_REFRESH_MIN_INTERVAL = env.int("THREATR_REFRESH_MIN_INTERVAL", default=60)
+# Redis instance through which the status of the requests is pushed to the websocket subscribers, empty to disable
+THREATR_NOTIFICATIONS_REDIS_URL = env("THREATR_NOTIFICATIONS_REDIS_URL", default=env("REDIS_URL"))
+# Lifetime in seconds of the cached server status
+THREATR_STATUS_CACHE_TTL = env.int("THREATR_STATUS_CACHE_TTL", default=10)
+# Analysis modules registered at startup, third-party modules can also be declared through the threatr.modules entry
+# point group of their package
+THREATR_ANALYSIS_MODULES = env.list(
+    "THREATR_ANALYSIS_MODULES",
+    default=[
+        "threatr.modules.misp_module.MISPModule",
+        "threatr.modules.otx_module.OTX",
+        "threatr.modules.scarletshark_module.ScarletShark",
+        "threatr.modules.shodan_module.ShodanModule",
+        "threatr.modules.vt_module.VirusTotal",
+    ],
+)
@@ -30,3 +30,5 @@ EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 TEMPLATES[0]["OPTIONS"]["debug"] = True  # type: ignore # noqa F405
 # Your stuff...
 # ------------------------------------------------------------------------------
+# No Redis instance to publish the status of the requests to
+THREATR_NOTIFICATIONS_REDIS_URL = ""
@@ -1,13 +1,133 @@
-async def websocket_application(scope, receive, send):
+"""
+Websocket endpoint pushing the status of the requests to the clients, so that they do not have to poll the API.
+
+Once connected, clients authenticate with their API token and subscribe to the requests they wait for:
+
+    {"action": "authenticate", "token": "<API token>"}
+    {"action": "subscribe", "request": "<request ID>"}
+    {"action": "unsubscribe", "request": "<request ID>"}
+
+The current status of a request is sent back on subscription, then each of its status changes until it completes.
+"""
+import asyncio
+import functools
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from rest_framework.authtoken.models import Token
+
+from threatr.core.models import Request
+from threatr.core.notifications import FINAL_STATUSES, get_request_event, request_events
+
+
+def _database_sync_to_async(func):
+    """
+    Run a function accessing the database in the thread of the connection, closing the connections which have expired
+    or failed before and after, as the request cycle does. A websocket outlives many of them.
+    """
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(functools.wraps(func)(wrapper))
+
+
+@_database_sync_to_async
+def _authenticate(token: str):
+    token = Token.objects.select_related("user").filter(key=str(token)).first()
+    if token and token.user.is_active:
+        return token.user
+    return None
+
+
+@_database_sync_to_async
+def _get_request_event(request_id: str) -> str | None:
+    request = Request.objects.filter(id=request_id).values("status", "modules_status").first()
+    if not request:
+        return None
+    return get_request_event(request_id, request["status"], request["modules_status"])
+
+
+async def _send(send, data: dict | str):
+    await send({"type": "websocket.send", "text": data if isinstance(data, str) else json.dumps(data)})
+
+
+async def _forward_events(send, queue: asyncio.Queue, subscriptions: set[str]):
     while True:
-        event = await receive()
+        event = await queue.get()
+        data = json.loads(event)
+        if data["status"] in FINAL_STATUSES and data["id"] in subscriptions:
+            subscriptions.discard(data["id"])
+            request_events.unsubscribe(data["id"], queue)
+        await _send(send, event)
+
+
+async def _subscribe(send, request_id, queue: asyncio.Queue, subscriptions: set[str]):
+    try:
+        request_id = str(uuid.UUID(str(request_id)))
+    except ValueError:
+        await _send(send, {"type": "error", "error": "Invalid request ID"})
+        return
+    # Subscribe before reading the current status so that no status change is missed
+    request_events.subscribe(request_id, queue)
+    subscriptions.add(request_id)
+    event = await _get_request_event(request_id)
+    if not event:
+        subscriptions.discard(request_id)
+        request_events.unsubscribe(request_id, queue)
+        await _send(send, {"type": "error", "error": "Unknown request", "id": request_id})
+        return
+    queue.put_nowait(event)
+
+
+async def websocket_application(scope, receive, send):
+    user = None
+    queue = asyncio.Queue()
+    subscriptions = set()
+    forwarder = None
+    try:
+        while True:
+            event = await receive()
 
-        if event["type"] == "websocket.connect":
-            await send({"type": "websocket.accept"})
+            if event["type"] == "websocket.connect":
+                await send({"type": "websocket.accept"})
+                forwarder = asyncio.create_task(_forward_events(send, queue, subscriptions))
 
-        if event["type"] == "websocket.disconnect":
-            break
+            if event["type"] == "websocket.disconnect":
+                break
 
-        if event["type"] == "websocket.receive":
-            if event["text"] == "ping":
-                await send({"type": "websocket.send", "text": "pong!"})
+            if event["type"] == "websocket.receive":
+                if event.get("text") == "ping":
+                    await send({"type": "websocket.send", "text": "pong!"})
+                    continue
+                try:
+                    message = json.loads(event.get("text") or "")
+                    action = message.get("action")
+                except (ValueError, AttributeError):
+                    await _send(send, {"type": "error", "error": "Invalid message"})
+                    continue
+                if action == "authenticate":
+                    user = await _authenticate(message.get("token"))
+                    await _send(
+                        send, {"type": "authenticated"} if user else {"type": "error", "error": "Invalid token"}
+                    )
+                elif not user:
+                    await _send(send, {"type": "error", "error": "Authentication required"})
+                elif action == "subscribe":
+                    await _subscribe(send, message.get("request"), queue, subscriptions)
+                elif action == "unsubscribe":
+                    request_id = str(message.get("request"))
+                    subscriptions.discard(request_id)
+                    request_events.unsubscribe(request_id, queue)
+                else:
+                    await _send(send, {"type": "error", "error": "Unknown action"})
+    finally:
+        for request_id in subscriptions:
+            request_events.unsubscribe(request_id, queue)
+        if forwarder:
+            forwarder.cancel()
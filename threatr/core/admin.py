@@ -8,6 +8,7 @@ from threatr.core.models import (
     Event,
     EntityRelation,
     VendorCredentials,
+    VendorResponse,
 )
 
 
@@ -60,8 +61,16 @@ admin.site.register(EntityType, EntityTypeAdmin)
 
 
 class VendorCredentialsAdmin(admin.ModelAdmin):
-    list_display = ("vendor",)
+    list_display = ("vendor", "last_usage", "usage_count", "cooldown")
     list_filter = ("vendor",)
 
 
 admin.site.register(VendorCredentials, VendorCredentialsAdmin)
+
+
+class VendorResponseAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "module", "request", "size", "raw_size")
+    list_filter = ("module",)
+
+
+admin.site.register(VendorResponse, VendorResponseAdmin)
@@ -1,10 +1,19 @@
-from datetime import timedelta, datetime
+import hashlib
+import json
+from datetime import datetime
+from itertools import chain
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
 
-import pytz
 from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
-from django.db.models import Q, QuerySet
-from django.http import JsonResponse, HttpResponse
+from django.db.models import Count
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from django_q.tasks import async_task
 from django_q.status import Stat
 from rest_framework import mixins, status
@@ -15,13 +24,19 @@ from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
 from threatr.core.api.models import AvailableModule, ServerStatus, WorkerStatus
+from threatr.core.api.pagination import RequestCursorPagination
 from threatr.core.api.serializers import (
     RequestSerializer,
     EntitySerializer,
     EventSerializer,
     EntityRelationSerializer,
     FullEntitySuperTypeSerializer, AvailableModuleSerializer, ServerStatusSerializer,
+    BatchItemSerializer,
+    NeighbourhoodQuerySerializer,
 )
+from threatr.core.cache import ResultCache
+from threatr.core.freshness import get_freshness
+from threatr.core.graph import get_neighbourhood
 from threatr.core.loader import ModulesLoader
 from threatr.core.models import (
     Request,
@@ -31,8 +46,92 @@ from threatr.core.models import (
     Event,
     EntityRelation, VendorCredentials,
 )
+from threatr.core.statistics import count_objects
 from threatr.core.tasks import handle_request
-from threatr.core.utils import merge_similar_events
+from threatr.core.type_registry import type_registry
+
+
+def _encode(data) -> str:
+    return json.dumps(data, cls=DjangoJSONEncoder)
+
+
+def _encode_list(queryset, serializer_class, extra=None) -> Iterator[str]:
+    """
+    Encode the objects of a queryset as a JSON list, reading them from a database cursor.
+    :param extra: function returning additional fields of the encoded object
+    """
+    yield "["
+    for i, obj in enumerate(queryset.iterator(chunk_size=settings.THREATR_RESULT_STREAMING_CHUNK_SIZE)):
+        data = serializer_class(obj).data
+        if extra:
+            data.update(extra(obj))
+        yield ("," if i else "") + _encode(data)
+    yield "]"
+
+
+def _buffer(pieces: Iterator[str]) -> Iterator[bytes]:
+    """
+    Group the encoded pieces of a document into chunks of THREATR_RESULT_STREAMING_BUFFER_SIZE bytes.
+    """
+    buffer = []
+    buffer_size = 0
+    for piece in pieces:
+        data = piece.encode()
+        buffer.append(data)
+        buffer_size += len(data)
+        if buffer_size >= settings.THREATR_RESULT_STREAMING_BUFFER_SIZE:
+            yield b"".join(buffer)
+            buffer, buffer_size = [], 0
+    yield b"".join(buffer)
+
+
+async def _read_async(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Read the chunks of a document one at a time in the thread of the request, where its database cursors live.
+    """
+    end = object()
+    while (chunk := await sync_to_async(next)(chunks, end)) is not end:
+        yield chunk
+
+
+def _streaming_response(request, chunks: Iterator[bytes], **kwargs) -> StreamingHttpResponse:
+    """
+    Stream a document under WSGI and ASGI. Django consumes a synchronous iterator in one go when served through ASGI,
+    the document would then be held in memory before its first byte is sent.
+    """
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        return StreamingHttpResponse(_read_async(iter(chunks)), **kwargs)
+    return StreamingHttpResponse(chunks, **kwargs)
+
+
+def _promote_pending(request_object: Request):
+    """
+    Enqueue a request still in the created status, e.g. a pivot waiting for its delay, since a caller is waiting for
+    it. Only the caller moving the request out of the created status enqueues it.
+    """
+    if request_object.status != Request.Status.CREATED:
+        return
+    if Request.objects.filter(id=request_object.id, status=Request.Status.CREATED).update(
+        status=Request.Status.ENQUEUED
+    ):
+        transaction.on_commit(lambda: async_task(handle_request, request_object.id))
+    request_object.status = Request.Status.ENQUEUED
+
+
+def _get_etag(*parts) -> str:
+    return quote_etag(hashlib.sha256("\x00".join(str(part) for part in parts).encode()).hexdigest())
+
+
+def _is_not_modified(request, etag: str, last_modified: datetime | None = None) -> bool:
+    """
+    Check the validators sent by the client. Unlike GET requests, the lookups made by POST requests are answered
+    with 304 as well, they do not modify the results.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        return if_none_match.strip() == "*" or etag in parse_etags(if_none_match)
+    if_modified_since = parse_http_date_safe(request.headers.get("If-Modified-Since"))
+    return bool(last_modified and if_modified_since) and int(last_modified.timestamp()) <= if_modified_since
 
 
 class TypesView(mixins.ListModelMixin, GenericViewSet):
@@ -72,17 +171,21 @@ class ModulesView(GenericViewSet, mixins.ListModelMixin,):
     @staticmethod
     def get_module_list():
         ml = ModulesLoader()
+        credentials = dict(
+            VendorCredentials.objects.order_by().values("vendor").annotate(count=Count("id")).values_list(
+                "vendor", "count"
+            )
+        )
         available_modules = []
         for module in ml.list_modules():
-            credentials = VendorCredentials.objects.filter(vendor=module.unique_identifier()).count()
             am = AvailableModule(**{
                 'id': module.unique_identifier(),
                 'vendor': module.vendor(),
-                'configured': credentials,
+                'configured': credentials.get(module.unique_identifier(), 0),
                 'description': module.description(),
                 # 'supported_types': module.supported_types().values()
             })
-            am.supported_types.extend(module.supported_types().values())
+            am.supported_types = list(module.supported_types().values())
             available_modules.append(am)
         return available_modules
 
@@ -97,19 +200,32 @@ class StatusView(GenericViewSet):
     queryset = ServerStatus.objects.none()
     serializer_class = ServerStatusSerializer
     detail = False
+    CACHE_KEY = "threatr:status"
 
     @action(methods=['get'], detail=False)
     def now(self, request, *args, **kwargs):
+        """
+        Status of the server. The numbers of cached objects are estimates unless `exact` is set, the status is cached
+        for THREATR_STATUS_CACHE_TTL seconds in that case.
+        """
+        exact = request.query_params.get('exact', '').lower() in ['1', 'true', 'yes']
+        if not exact and (data := cache.get(self.CACHE_KEY)) is not None:
+            return Response(data)
         commit_hash = ''
         # Undefined in dev mode
         try:
             commit_hash = settings.GIT_COMMIT_HASH
         except: pass  # noqa: E722, E701
+        result_cache_stats = ResultCache.stats()
+        counts = count_objects(Entity, Event, EntityRelation, exact=exact)
         status_data = ServerStatus(**{
             'git_commit_hash': commit_hash,
-            'cached_entities': Entity.objects.count(),
-            'cached_events': Event.objects.count(),
-            'cached_relations': EntityRelation.objects.count()
+            'cached_entities': counts[Entity],
+            'cached_events': counts[Event],
+            'cached_relations': counts[EntityRelation],
+            'exact_counts': exact,
+            'result_cache_hits': result_cache_stats.get('hits'),
+            'result_cache_misses': result_cache_stats.get('misses'),
         })
         workers = [
             WorkerStatus(**{
@@ -121,13 +237,70 @@ class StatusView(GenericViewSet):
             })
             for stat in Stat.get_all()
         ]
-        status_data.available_modules.extend(ModulesView.get_module_list())
-        status_data.workers.extend(workers)
+        status_data.available_modules = ModulesView.get_module_list()
+        status_data.workers = workers
         # return status_data
         serializer = self.get_serializer(status_data, many=False)
+        if not exact:
+            cache.set(self.CACHE_KEY, serializer.data, timeout=settings.THREATR_STATUS_CACHE_TTL)
         return Response(serializer.data)
 
 
+class EntityView(GenericViewSet):
+    authentication_classes = [SessionAuthentication, TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    queryset = Entity.objects.select_related("super_type", "type")
+    serializer_class = EntitySerializer
+
+    @action(methods=["get"], detail=True)
+    def neighbourhood(self, request, *args, **kwargs):
+        """
+        Entities reachable from this entity within `depth` hops, along with the relations between them. The
+        traversal only follows the relations named after `relation` and the entities of the types given by `type`
+        when set. The neighbourhood is computed with one query per level and the document is streamed. The
+        neighbourhood is truncated when it has more than `max_nodes` entities or when some entities have more than
+        `fan_out` neighbours, `truncation` tells which.
+        """
+        root_entity = self.get_object()
+        serializer = NeighbourhoodQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        depths, nodes_truncated, fan_out_truncated = get_neighbourhood(
+            root_entity.id,
+            query["depth"],
+            query["fan_out"],
+            query["max_nodes"],
+            relation_names=query.get("relation"),
+            type_ids=query.get("type"),
+        )
+        return _streaming_response(
+            request,
+            _buffer(self.__encode_neighbourhood(
+                root_entity, depths, {"max_nodes": nodes_truncated, "fan_out": fan_out_truncated}, query
+            )),
+            content_type="application/json",
+            status=status.HTTP_200_OK,
+        )
+
+    @staticmethod
+    def __encode_neighbourhood(root_entity: Entity, depths: dict, truncation: dict, query: dict) -> Iterator[str]:
+        entities = Entity.objects.select_related("super_type", "type").filter(id__in=depths).exclude(
+            id=root_entity.id
+        )
+        relations = EntityRelation.objects.filter(obj_from_id__in=depths, obj_to_id__in=depths)
+        if query.get("relation"):
+            relations = relations.filter(name__in=query["relation"])
+
+        yield '{"root_entity": ' + _encode(EntitySerializer(root_entity).data)
+        yield f', "depth": {query["depth"]}, "truncated": {_encode(any(truncation.values()))}'
+        yield f', "truncation": {_encode(truncation)}'
+        yield ', "entities": '
+        yield from _encode_list(entities, EntitySerializer, lambda entity: {"depth": depths[entity.id]})
+        yield ', "relations": '
+        yield from _encode_list(relations, EntityRelationSerializer)
+        yield "}"
+
+
 class RequestView(
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
@@ -138,115 +311,289 @@ class RequestView(
     permission_classes = [IsAuthenticated]
     queryset = Request.objects.all()
     serializer_class = RequestSerializer
+    pagination_class = RequestCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != "list":
+            return queryset
+        # Each filter matches an index ending with the ordering of the pagination
+        params = self.request.query_params
+        if statuses := params.getlist("status"):
+            queryset = queryset.filter(status__in=statuses)
+        if types := params.getlist("type"):
+            queryset = queryset.filter(
+                type_id__in=list(EntityType.objects.filter(short_name__in=types).values_list("id", flat=True))
+            )
+        if super_type := params.get("super_type"):
+            queryset = queryset.filter(super_type_id=super_type)
+        if value := params.get("value"):
+            queryset = queryset.for_value(value)
+        return queryset.select_related("super_type", "type")
 
     @staticmethod
-    def __get_mermaid_graph(entities, relations):
-        entity_lines = []
-        relation_lines = []
-        for entity in entities:
-            entity_lines.append(f'{entity.id}("{str(entity)}")')
-        for relation in relations:
-            relation_lines.append(
-                f"{relation.obj_from.id} -- {relation.name} --> {relation.obj_to.id}"
+    def __encode_results(root_entity: Entity) -> Iterator[str]:
+        """
+        Encode the results document piece by piece while reading the neighbourhood of the root entity from database
+        cursors, so the memory used does not depend on the size of the graph. Events have already been compacted by
+        the workers.
+        """
+        # Each direction is looked up with its own index, UNION drops the entities related in both directions
+        entities = Entity.objects.select_related("super_type", "type").exclude(id=root_entity.id).order_by()
+        neighbours = entities.filter(
+            id__in=EntityRelation.objects.filter(obj_from=root_entity).values("obj_to")
+        ).union(entities.filter(id__in=EntityRelation.objects.filter(obj_to=root_entity).values("obj_from")))
+        events = Event.objects.filter(involved_entity=root_entity).select_related("type")
+        relations = root_entity.get_relations()
+
+        yield '{"root_entity": ' + _encode(EntitySerializer(root_entity).data)
+        yield ', "entities": '
+        yield from _encode_list(neighbours, EntitySerializer)
+        yield ', "events": '
+        yield from _encode_list(events, EventSerializer)
+        yield ', "relations": '
+        yield from _encode_list(relations, EntityRelationSerializer)
+        # Mermaid flowchart of the graph, encoded line by line as a single JSON string
+        yield ', "graph": "flowchart LR'
+        for entity in chain([root_entity], neighbours.iterator()):
+            yield _encode(f'\n\t{entity.id}("{entity}")')[1:-1]
+        for relation in relations.iterator():
+            yield _encode(f"\n\t{relation.obj_from_id} -- {relation.name} --> {relation.obj_to_id}")[1:-1]
+        yield '"}'
+
+    def __stream_results(self, root_entity: Entity, cache_version: int) -> Iterator[bytes]:
+        """
+        Stream the encoded results document, documents small enough are kept along the way to be cached once fully
+        streamed.
+        """
+        max_cached_size = settings.THREATR_RESULT_CACHE_MAX_SIZE * 1024
+        cached = [] if ResultCache.enabled() else None
+        cached_size = 0
+        for chunk in _buffer(self.__encode_results(root_entity)):
+            if cached is not None:
+                cached_size += len(chunk)
+                if cached_size <= max_cached_size:
+                    cached.append(chunk)
+                else:
+                    cached = None
+            yield chunk
+        if cached is not None:
+            ResultCache.set(
+                root_entity.name, root_entity.super_type_id, root_entity.type.short_name, cache_version,
+                b"".join(cached), entity_version=root_entity.version,
             )
-        entity_txt = "\n\t".join(list(set(entity_lines)))
-        relation_txt = "\n\t".join(list(set(relation_lines)))
-        return f"flowchart LR\n\t{entity_txt}\n\t{relation_txt}"
-
-    def __handle_existing_results(self, q_set: QuerySet, output_format: str):
-        root_entity = q_set.first()
-        events = Event.objects.filter(involved_entity=root_entity).all()
-        relations = EntityRelation.objects.filter(
-            Q(obj_from=root_entity) | Q(obj_to=root_entity)
-        ).all()
+
+    def __handle_existing_results(self, request, root_entity: Entity, output_format: str, cache_version: int = 0):
         if output_format == "json":
-            entity_serializer = EntitySerializer(root_entity)
-            # Merge all existing events
-            merged_events = merge_similar_events(events)
-            # Clean up old requests
-            time_threshold = datetime.now(tz=pytz.UTC) - timedelta(days=30)
-            Request.objects.filter(created_at__lte=time_threshold).delete()
-            event_serializer = EventSerializer(merged_events, many=True)
-            relation_serializer = EntityRelationSerializer(relations, many=True)
-            entities = []
-            for relation in relations:
-                if relation.obj_from != root_entity:
-                    entities.append(relation.obj_from)
-                else:
-                    entities.append(relation.obj_to)
-            for event in events:
-                if event.involved_entity and event.involved_entity != root_entity:
-                    entities.append(event.involved_entity)
-            entities = list(set(entities))
-            entities_serializer = EntitySerializer(entities, many=True)
-            result = {
-                "root_entity": entity_serializer.data,
-                "entities": entities_serializer.data,
-                "events": event_serializer.data,
-                "relations": relation_serializer.data,
-                "graph": self.__get_mermaid_graph(entities + [root_entity], relations),
-            }
-            return JsonResponse(result, status=status.HTTP_200_OK)
+            return _streaming_response(
+                request,
+                self.__stream_results(root_entity, cache_version),
+                content_type="application/json",
+                status=status.HTTP_200_OK,
+            )
         return HttpResponse('Invalid format', status=status.HTTP_406_NOT_ACCEPTABLE)
 
+    def __serve_existing_results(self, request, root_entity: Entity, output_format: str):
+        """
+        Serve the results of an existing entity, from the cache when available. The results are versioned by the
+        entity and the stamp of its relations and events, clients already holding the current version get a 304
+        response without the document being built nor read from the cache.
+        """
+        etag = _get_etag(ResultCache.DOCUMENT_VERSION, root_entity.id, root_entity.version, output_format)
+        if _is_not_modified(request, etag, root_entity.version):
+            response = HttpResponseNotModified()
+        else:
+            content, cache_version = None, 0
+            if output_format == "json":
+                content, cache_version = ResultCache.get(
+                    root_entity.name, root_entity.super_type_id, root_entity.type.short_name,
+                    entity_version=root_entity.version,
+                )
+            if content is not None:
+                response = HttpResponse(content, content_type="application/json", status=status.HTTP_200_OK)
+            else:
+                response = self.__handle_existing_results(request, root_entity, output_format, cache_version)
+        if response.status_code in [status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED]:
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(root_entity.version.timestamp())
+        return response
+
+    @staticmethod
+    def __with_freshness(response: HttpResponse, value: str, e_super_type: EntitySuperType, e_type: EntityType):
+        """
+        Tell how fresh the served results are. Stale results are served as is while a new enrichment is enqueued,
+        the client can come back for the refreshed results once the request given by X-Threatr-Refresh completes.
+        A pending pivot on the value is enqueued right away and given as the refresh.
+        """
+        enriched_at, stale, refresh_due = get_freshness(value, e_super_type, e_type)
+        response["X-Threatr-Freshness"] = "stale" if stale else "fresh"
+        if enriched_at:
+            response["X-Threatr-Enriched-At"] = enriched_at.isoformat()
+        if refresh_due:
+            request_object, created = Request.get_or_create_in_flight(value, e_super_type, e_type)
+            if created:
+                transaction.on_commit(lambda: async_task(handle_request, request_object.id))
+        else:
+            # A pending pivot on the value refreshes it, it is not worth waiting for its delay
+            request_object = Request.objects.for_value(value).filter(
+                super_type=e_super_type, type=e_type, status=Request.Status.CREATED
+            ).first()
+        if request_object:
+            _promote_pending(request_object)
+            response["X-Threatr-Refresh"] = str(request_object.id)
+        return response
+
+    @action(methods=["post"], detail=False)
+    def batch(self, request, *args, **kwargs):
+        """
+        Look up a list of values at once. The values already analyzed are resolved with a single query, the others
+        are enqueued for analysis. The response gives the status of each item, in the same order as the request.
+        """
+        items = request.data.get("items", []) if isinstance(request.data, dict) else request.data
+        if len(items) > settings.THREATR_BATCH_MAX_SIZE:
+            return Response(
+                {"error": f"A batch cannot contain more than {settings.THREATR_BATCH_MAX_SIZE} items"},
+                status=status.HTTP_406_NOT_ACCEPTABLE,
+            )
+        serializer = BatchItemSerializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        results = []
+        lookups = {}
+        for item in serializer.validated_data:
+            result = {"value": item["value"], "super_type": item["super_type"], "type": item["type"]}
+            results.append(result)
+            e_super_type = type_registry.get_super_type(item["super_type"])
+            e_type = type_registry.get_type(e_super_type.short_name, item["type"]) if e_super_type else None
+            if not e_type:
+                result["status"] = "INVALID"
+                result["error"] = "Selected entity type not supported"
+                continue
+            lookups.setdefault((item["value"], e_super_type.short_name, e_type.id), []).append(result)
+        if not lookups:
+            return Response({"results": results}, status=status.HTTP_200_OK)
+
+        values = {key[0] for key in lookups}
+        # Existing entities
+        for entity_id, *key in Entity.objects.filter(name__in=values).values_list(
+            "id", "name", "super_type_id", "type_id"
+        ):
+            for result in lookups.pop(tuple(key), []):
+                result["status"] = "AVAILABLE"
+                result["entity"] = entity_id
+        # Latest request of each missing value
+        requests = {}
+        if lookups:
+            for request_object in Request.objects.for_values(key[0] for key in lookups):
+                requests.setdefault((request_object.value, request_object.super_type_id, request_object.type_id),
+                                    request_object)
+        missing_requests = [
+            Request(value=key[0], super_type_id=key[1], type_id=key[2], status=Request.Status.ENQUEUED)
+            for key in lookups if key not in requests
+        ]
+        with transaction.atomic():
+            # Requests put in flight concurrently by other callers are kept, the missing values attach to them
+            Request.objects.bulk_create(missing_requests, ignore_conflicts=True)
+            if missing_requests:
+                for request_object in Request.objects.for_values(r.value for r in missing_requests).filter(
+                    status__in=Request.IN_FLIGHT_STATUSES
+                ):
+                    key = (request_object.value, request_object.super_type_id, request_object.type_id)
+                    if key in lookups:
+                        requests[key] = request_object
+            # Only the caller moving a request out of the created status enqueues it
+            created_ids = [r.id for r in requests.values() if r.status == Request.Status.CREATED]
+            enqueued_ids = list(
+                Request.objects.select_for_update(skip_locked=True)
+                .filter(id__in=created_ids, status=Request.Status.CREATED)
+                .values_list("id", flat=True)
+            )
+            Request.objects.filter(id__in=enqueued_ids).update(status=Request.Status.ENQUEUED)
+            attached_ids = {r.id for r in requests.values()}
+            enqueued_ids += [r.id for r in missing_requests if r.id in attached_ids]
+            for request_object in requests.values():
+                if request_object.status == Request.Status.CREATED:
+                    request_object.status = Request.Status.ENQUEUED
+            transaction.on_commit(lambda: [async_task(handle_request, request_id) for request_id in enqueued_ids])
+        for key, key_results in lookups.items():
+            for result in key_results:
+                result["status"] = requests[key].status
+                result["request"] = requests[key].id
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = _get_etag(
+            instance.id, instance.status, sorted(instance.modules_status.items()), instance.pivot_budget
+        )
+        if _is_not_modified(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = Response(self.get_serializer(instance).data)
+        response["ETag"] = etag
+        return response
+
     def create(self, request, *args, **kwargs):
         value = request.data.get("value", "")
         e_super_type = request.data.get("super_type", "")
         e_type = request.data.get("type", "")
         output_format = request.data.get("format", "json")
         force = request.data.get("force", False)
+        try:
+            pivot_depth = min(int(request.data.get("pivot_depth", 0)), settings.THREATR_PIVOT_MAX_DEPTH)
+            pivot_budget = min(
+                int(request.data.get("pivot_budget", settings.THREATR_PIVOT_MAX_BUDGET)),
+                settings.THREATR_PIVOT_MAX_BUDGET,
+            )
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "Pivot depth and budget must be integers"},
+                status=status.HTTP_406_NOT_ACCEPTABLE,
+            )
         if not value:
             return Response(
                 {"error": "Requested value cannot be empty"},
                 status=status.HTTP_406_NOT_ACCEPTABLE,
             )
-        try:
-            e_super_type = EntitySuperType.objects.get(short_name=e_super_type.upper())
-        except Exception:
+        e_super_type = type_registry.get_super_type(str(e_super_type))
+        if not e_super_type:
             return Response(
                 {"error": "Selected entity super type not supported"},
                 status=status.HTTP_406_NOT_ACCEPTABLE,
             )
-        try:
-            e_type = EntityType.objects.get(short_name=e_type.upper())
-        except Exception:
+        e_type = type_registry.get_type(e_super_type.short_name, str(e_type))
+        if not e_type:
             return Response(
                 {"error": "Selected entity type not supported"},
                 status=status.HTTP_406_NOT_ACCEPTABLE,
             )
 
-        # Check if the requested entity already exists
+        # A single query tells whether results exist and gives their version
         if not force:
-            q_set = Entity.objects.filter(
+            root_entity = Entity.objects.select_related("super_type", "type").filter(
                 name=value, super_type=e_super_type, type=e_type
-            )
-            if q_set:
-                return self.__handle_existing_results(q_set, output_format)
+            ).first()
+            if root_entity:
+                return self.__with_freshness(
+                    self.__serve_existing_results(request, root_entity, output_format), value, e_super_type, e_type
+                )
 
         # Start analysis modules
         request_object = None
         if not force:
             # Get the latest corresponding request
-            requests = Request.objects.filter(
-                value=value,
+            request_object = Request.objects.for_value(value).filter(
                 super_type=e_super_type,
                 type=e_type,
-            )
-            if requests:
-                request_object = requests.first()
-        # No existing request
+            ).first()
+        # No existing request, attach to the one in flight if any
         if force or not request_object:
-            request_object = Request(
-                value=value,
-                super_type=e_super_type,
-                type=e_type,
+            request_object, created = Request.get_or_create_in_flight(
+                value, e_super_type, e_type, pivot_depth=max(0, pivot_depth), pivot_budget=max(0, pivot_budget)
             )
-            request_object.save()
-
-        if request_object.status == Request.Status.CREATED:
-            request_object.status = Request.Status.ENQUEUED
-            request_object.save()
-            transaction.on_commit(lambda: async_task(handle_request, request_object.id))
+            if created:
+                transaction.on_commit(lambda: async_task(handle_request, request_object.id))
+        _promote_pending(request_object)
 
         # Simply return the details of the request, client would have to come back later
         serializer = RequestSerializer(request_object)
@@ -23,6 +23,9 @@ class ServerStatus(models.Model):
     cached_entities = models.IntegerField(default=0)
     cached_events = models.IntegerField(default=0)
     cached_relations = models.IntegerField(default=0)
+    exact_counts = models.BooleanField(default=False)
+    result_cache_hits = models.IntegerField(default=0)
+    result_cache_misses = models.IntegerField(default=0)
 
 
 class WorkerStatus(models.Model):
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RequestCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the requests, newest first. Each page is read from the position encoded in the cursor
+    along the matching indexes, so its cost does not depend on how deep the page is.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
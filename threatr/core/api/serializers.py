@@ -1,6 +1,7 @@
 from json import JSONEncoder
 from uuid import UUID
 
+from django.conf import settings
 from rest_framework import serializers
 
 from threatr.core.api.models import AvailableModule, WorkerStatus, ServerStatus
@@ -105,4 +106,51 @@ class RequestSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Request
-        fields = ["id", "value", "super_type", "type", "status", "created_at"]
+        fields = [
+            "id",
+            "value",
+            "super_type",
+            "type",
+            "status",
+            "modules_status",
+            "pivot_depth",
+            "pivot_budget",
+            "pivot_root",
+            "created_at",
+        ]
+
+
+class BatchItemSerializer(serializers.Serializer):
+    value = serializers.CharField()
+    super_type = serializers.CharField()
+    type = serializers.CharField()
+
+
+class NeighbourhoodQuerySerializer(serializers.Serializer):
+    depth = serializers.IntegerField(min_value=1, default=2)
+    fan_out = serializers.IntegerField(min_value=1, required=False)
+    max_nodes = serializers.IntegerField(min_value=1, required=False)
+    relation = serializers.ListField(child=serializers.CharField(), required=False)
+    type = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def validate_depth(self, value):
+        if value > settings.THREATR_NEIGHBOURHOOD_MAX_DEPTH:
+            raise serializers.ValidationError(
+                f"The depth cannot be greater than {settings.THREATR_NEIGHBOURHOOD_MAX_DEPTH}"
+            )
+        return value
+
+    def validate_type(self, value):
+        type_ids = list(EntityType.objects.filter(short_name__in=value).values_list("id", flat=True).distinct())
+        if not type_ids:
+            raise serializers.ValidationError("Selected entity types not supported")
+        return type_ids
+
+    def validate(self, data):
+        data["fan_out"] = min(
+            data.get("fan_out", settings.THREATR_NEIGHBOURHOOD_MAX_FAN_OUT), settings.THREATR_NEIGHBOURHOOD_MAX_FAN_OUT
+        )
+        data["max_nodes"] = min(
+            data.get("max_nodes", settings.THREATR_NEIGHBOURHOOD_MAX_NODES), settings.THREATR_NEIGHBOURHOOD_MAX_NODES
+        )
+        return data
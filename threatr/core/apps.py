@@ -7,4 +7,7 @@ class CoreConfig(AppConfig):
     verbose_name = _("Threatr")
 
     def ready(self):
-        pass
+        import threatr.core.signals  # noqa: F401
+        from threatr.core.loader import registry
+
+        registry.load()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+
+import zstandard
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from threatr.core.models import Request, VendorResponse
+
+logger = logging.getLogger(__name__)
+
+
+def _get_path(digest: str) -> Path:
+    return Path(settings.THREATR_ARCHIVE_ROOT) / digest[:2] / f"{digest}.json.zst"
+
+
+def archive_response(request: Request, module: str, response) -> VendorResponse | None:
+    """
+    Archive the raw response obtained by an analysis module. The response is stored by the worker which obtained it,
+    handing it over to another task would copy the whole response through the broker. Failing to archive a response
+    does not fail the module.
+    """
+    if response is None:
+        return None
+    try:
+        return store_response(str(request.id), module, response)
+    except Exception as e:
+        logger.warning(f"Unable to archive the response of module {module} to request {request.id}: {e}")
+        return None
+
+
+def store_response(request_id: str, module: str, response) -> VendorResponse:
+    """
+    Store a vendor response zstd-compressed under its SHA256, identical responses share the same file.
+    """
+    content = json.dumps(response, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    digest = hashlib.sha256(content).hexdigest()
+    path = _get_path(digest)
+    if path.exists():
+        size = path.stat().st_size
+    else:
+        compressed = zstandard.ZstdCompressor().compress(content)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Concurrent workers and the modules run in their threads may store the same response, the file is
+        # atomically moved in place once written
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(compressed)
+        os.replace(tmp_path, path)
+        size = len(compressed)
+    return VendorResponse.objects.create(
+        request_id=request_id,
+        module=module,
+        digest=digest,
+        size=size,
+        raw_size=len(content),
+    )
+
+
+def load_response(vendor_response: VendorResponse):
+    """
+    :return: the decoded response
+    """
+    content = _get_path(vendor_response.digest).read_bytes()
+    return json.loads(zstandard.ZstdDecompressor().decompress(content))
+
+
+def evict_responses(max_size: int | None = None, batch_size: int = 1000) -> int:
+    """
+    Delete the oldest archived responses so that the archive does not exceed the given size in megabytes.
+    :return: the number of evicted responses
+    """
+    if max_size is None:
+        max_size = settings.THREATR_ARCHIVE_MAX_SIZE
+    max_size *= 1024 * 1024
+    total_size = 0
+    kept_digests = set()
+    evicted_digests = set()
+    evicted_ids = []
+    for response_id, digest, size in (
+        VendorResponse.objects.order_by("-created_at").values_list("id", "digest", "size").iterator()
+    ):
+        if digest in kept_digests:
+            continue
+        if not evicted_digests and total_size + size <= max_size:
+            kept_digests.add(digest)
+            total_size += size
+        else:
+            evicted_digests.add(digest)
+            evicted_ids.append(response_id)
+    for start in range(0, len(evicted_ids), batch_size):
+        VendorResponse.objects.filter(id__in=evicted_ids[start:start + batch_size]).delete()
+
+    # Responses identical to an evicted one may have been archived in the meantime
+    evicted_digests -= set(
+        VendorResponse.objects.filter(digest__in=evicted_digests).values_list("digest", flat=True)
+    )
+    for digest in evicted_digests:
+        _get_path(digest).unlink(missing_ok=True)
+    if evicted_ids:
+        logger.info(f"Evicted {len(evicted_ids)} archived vendor responses")
+    return len(evicted_ids)
@@ -0,0 +1,93 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Read-through cache of the result documents served by the request API.
+
+    Documents are stored already JSON-encoded and keyed by the requested (value, super type, type). Each key has a
+    version stamp which is bumped once new data has been written for it, a document is only served if it has been
+    built against the current version. Both the document and its version are fetched in a single round-trip.
+
+    Documents are also tagged with the version of their root entity. The graph of an entity changes when the
+    results of another request are written, so its cached document would otherwise outlive the version clients
+    validate it against.
+    """
+    # Bump when the layout of the result document changes
+    DOCUMENT_VERSION = 2
+    PREFIX = "threatr:results"
+    HITS_KEY = f"{PREFIX}:stats:hits"
+    MISSES_KEY = f"{PREFIX}:stats:misses"
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.THREATR_RESULT_CACHE_TTL > 0
+
+    @classmethod
+    def _keys(cls, value: str, super_type: str, e_type: str) -> (str, str):
+        digest = hashlib.sha256(
+            f"{super_type.upper()}\x00{e_type.upper()}\x00{value}".encode()
+        ).hexdigest()
+        return (
+            f"{cls.PREFIX}:v{cls.DOCUMENT_VERSION}:doc:{digest}",
+            f"{cls.PREFIX}:version:{digest}",
+        )
+
+    @classmethod
+    def _count(cls, key: str):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=None)
+
+    @classmethod
+    def get(cls, value: str, super_type: str, e_type: str, entity_version=None) -> (bytes | None, int):
+        """
+        Get the cached result document.
+        :param entity_version: version of the root entity the document must have been built from
+        :return: the encoded document or None and the current version stamp, the version stamp has to be passed back
+        to `set` when the document is built on a cache miss
+        """
+        if not cls.enabled():
+            return None, 0
+        doc_key, version_key = cls._keys(value, super_type, e_type)
+        values = cache.get_many([doc_key, version_key])
+        version = values.get(version_key, 0)
+        document = values.get(doc_key)
+        if document and document[0] == version and document[1] == entity_version:
+            cls._count(cls.HITS_KEY)
+            return document[2], version
+        cls._count(cls.MISSES_KEY)
+        return None, version
+
+    @classmethod
+    def set(cls, value: str, super_type: str, e_type: str, version: int, content: bytes, entity_version=None):
+        if not cls.enabled():
+            return
+        doc_key, _ = cls._keys(value, super_type, e_type)
+        cache.set(doc_key, (version, entity_version, content), timeout=settings.THREATR_RESULT_CACHE_TTL)
+
+    @classmethod
+    def invalidate(cls, value: str, super_type: str, e_type: str):
+        doc_key, version_key = cls._keys(value, super_type, e_type)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            # Outlive the documents built against the previous version
+            cache.add(version_key, 1, timeout=2 * settings.THREATR_RESULT_CACHE_TTL)
+        cache.delete(doc_key)
+        logger.debug(f"Invalidated cached results of {super_type}/{e_type} [{value}]")
+
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        values = cache.get_many([cls.HITS_KEY, cls.MISSES_KEY])
+        return {
+            "hits": values.get(cls.HITS_KEY, 0),
+            "misses": values.get(cls.MISSES_KEY, 0),
+        }
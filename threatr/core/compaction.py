@@ -0,0 +1,104 @@
+import logging
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from threatr.core.models import Entity, Event
+
+logger = logging.getLogger(__name__)
+
+# Events sharing the same name, involved entity and source vendor are grouped into islands of overlapping
+# intervals (compared day by day). Each island having more than one event is merged into its earliest event. Only
+# the events of the given entities are read, events involving no entity could never be grouped together.
+OVERLAPPING_EVENTS_SQL = """
+WITH ordered AS (
+    SELECT
+        id, name, involved_entity_id, first_seen, last_seen, count,
+        COALESCE(attributes -> 'source_vendor', '') AS source_vendor,
+        MAX((last_seen AT TIME ZONE 'UTC')::date) OVER (
+            PARTITION BY name, involved_entity_id, COALESCE(attributes -> 'source_vendor', '')
+            ORDER BY first_seen, id
+            ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+        ) AS previous_last_seen
+    FROM core_event
+    WHERE involved_entity_id = ANY(%s::uuid[])
+),
+islands AS (
+    SELECT
+        *,
+        SUM(
+            CASE WHEN previous_last_seen IS NULL
+                OR (first_seen AT TIME ZONE 'UTC')::date > previous_last_seen THEN 1 ELSE 0 END
+        ) OVER (
+            PARTITION BY name, involved_entity_id, source_vendor
+            ORDER BY first_seen, id
+        ) AS island
+    FROM ordered
+)
+SELECT
+    ARRAY_AGG(id ORDER BY first_seen, id) AS ids,
+    MAX(last_seen) AS last_seen,
+    SUM(count) AS count,
+    involved_entity_id
+FROM islands
+GROUP BY name, involved_entity_id, source_vendor, island
+HAVING COUNT(*) > 1
+"""
+
+
+def compact_events(entity_ids: list | None = None, batch_size: int = 100) -> int:
+    """
+    Merge the overlapping events of the given entities, or of every entity if none is given.
+    Entities are compacted in batches of `batch_size`, one short transaction each, so that a full run never holds a
+    long transaction nor its locks on the events the workers keep on writing. The overlapping intervals of a batch
+    are computed set-wise by the database, then its merged events are written with a single delete and a single
+    bulk update.
+    :return: the number of events that have been merged into others
+    """
+    if entity_ids is not None:
+        return sum(
+            _compact_batch(entity_ids[start:start + batch_size]) for start in range(0, len(entity_ids), batch_size)
+        )
+
+    dropped = 0
+    last_id = None
+    while True:
+        # Walk through the entities along their primary key rather than the events table
+        entities = Entity.objects.order_by("id")
+        if last_id is not None:
+            entities = entities.filter(id__gt=last_id)
+        batch = list(entities.values_list("id", flat=True)[:batch_size])
+        if not batch:
+            break
+        dropped += _compact_batch(batch)
+        last_id = batch[-1]
+    return dropped
+
+
+def _compact_batch(entity_ids: list) -> int:
+    if not entity_ids:
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(OVERLAPPING_EVENTS_SQL, [[str(entity_id) for entity_id in entity_ids]])
+        dropped = _merge_islands(cursor.fetchall())
+    if dropped:
+        logger.info(f"Compacted {dropped} overlapping events")
+    return dropped
+
+
+def _merge_islands(islands) -> int:
+    if not islands:
+        return 0
+    now = timezone.now()
+    kept_events = []
+    dropped_ids = []
+    entity_ids = set()
+    for ids, last_seen, count, entity_id in islands:
+        kept_id, *merged_ids = ids
+        kept_events.append(Event(id=kept_id, last_seen=last_seen, count=count, updated_at=now))
+        dropped_ids.extend(merged_ids)
+        entity_ids.add(entity_id)
+    Event.objects.filter(id__in=dropped_ids).delete()
+    Event.objects.bulk_update(kept_events, ["last_seen", "count", "updated_at"])
+    Entity.objects.filter(id__in=entity_ids).update(graph_updated_at=now)
+    return len(dropped_ids)
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from threatr.core.loader import ModulesLoader
+from threatr.core.models import EntitySuperType, EntityType, Request
+
+# Number of latest requests for a value looked at to find the latest successful run of each module
+LOOKBACK = 20
+
+
+def get_module_freshness(module) -> timedelta:
+    hours = settings.THREATR_MODULES_FRESHNESS.get(module.unique_identifier())
+    return timedelta(hours=hours) if hours is not None else module.freshness()
+
+
+def get_freshness(value: str, super_type: EntitySuperType, e_type: EntityType) -> (datetime | None, bool, bool):
+    """
+    Check how fresh the data of the given value is. The data of a module is stale once its latest successful run is
+    older than the freshness of the module, the modules which never succeeded for the value are not accounted for.
+    :return: the date of the latest successful enrichment, whether the data is stale and whether a refresh is due,
+    refreshes are enqueued at most once every THREATR_REFRESH_MIN_INTERVAL minutes
+    """
+    modules = ModulesLoader().get_candidate_classes(Request(super_type=super_type, type=e_type))
+    last_successes = {}
+    latest_request_at = None
+    for created_at, request_status, modules_status in Request.objects.for_value(value).filter(
+        super_type=super_type, type=e_type
+    ).values_list("created_at", "status", "modules_status")[:LOOKBACK]:
+        latest_request_at = latest_request_at or created_at
+        if request_status == Request.Status.SUCCEEDED and not modules_status:
+            # Requests handled before the status of each module was recorded
+            modules_status = {m.unique_identifier(): Request.Status.SUCCEEDED for m in modules}
+        for module, module_status in modules_status.items():
+            if module_status == Request.Status.SUCCEEDED:
+                last_successes.setdefault(module, created_at)
+
+    now = timezone.now()
+    stale = not last_successes or any(
+        now - last_successes[m.unique_identifier()] > get_module_freshness(m)
+        for m in modules
+        if m.unique_identifier() in last_successes
+    )
+    refresh_due = stale and (
+        not latest_request_at
+        or now - latest_request_at > timedelta(minutes=settings.THREATR_REFRESH_MIN_INTERVAL)
+    )
+    return max(last_successes.values(), default=None), stale, refresh_due
@@ -0,0 +1,76 @@
+from uuid import UUID
+
+from django.db import connection
+
+# One level of the breadth-first traversal of the relations in both directions. Each entity of the frontier expands
+# at most `fan_out` neighbours not visited yet, in a stable order. One extra neighbour is read to tell whether an
+# entity has more neighbours than followed.
+NEIGHBOURHOOD_LEVEL_SQL = """
+WITH expanded AS (
+    SELECT neighbour.id, row_number() OVER (PARTITION BY n.id ORDER BY neighbour.id) AS rank
+    FROM unnest(%(frontier)s::uuid[]) AS n(id)
+    CROSS JOIN LATERAL (
+        SELECT e.id
+        FROM (
+            SELECT r.obj_to_id AS id FROM core_entityrelation r
+            WHERE r.obj_from_id = n.id AND (%(names)s::text[] IS NULL OR r.name = ANY(%(names)s::text[]))
+            UNION
+            SELECT r.obj_from_id FROM core_entityrelation r
+            WHERE r.obj_to_id = n.id AND (%(names)s::text[] IS NULL OR r.name = ANY(%(names)s::text[]))
+        ) e
+        JOIN core_entity entity ON entity.id = e.id
+        WHERE e.id <> ALL(%(visited)s::uuid[])
+          AND (%(types)s::uuid[] IS NULL OR entity.type_id = ANY(%(types)s::uuid[]))
+        ORDER BY e.id
+        LIMIT %(fan_out)s + 1
+    ) neighbour
+)
+SELECT
+    ARRAY(SELECT id FROM expanded WHERE rank <= %(fan_out)s GROUP BY id ORDER BY id LIMIT %(limit)s),
+    EXISTS(SELECT 1 FROM expanded WHERE rank > %(fan_out)s)
+"""
+
+
+def get_neighbourhood(
+    root_id: UUID,
+    depth: int,
+    fan_out: int,
+    max_nodes: int,
+    relation_names: list[str] | None = None,
+    type_ids: list[UUID] | None = None,
+) -> tuple[dict[UUID, int], bool, bool]:
+    """
+    Compute the entities reachable from the root entity within `depth` hops, with one query per level. The entities
+    visited at a level are never expanded again, so the work grows with the size of the neighbourhood rather than
+    with the number of paths leading to it.
+    :param fan_out: maximum number of neighbours followed from each entity
+    :param max_nodes: maximum number of entities returned, the closest ones first
+    :param relation_names: only follow the relations having one of these names
+    :param type_ids: only follow the entities having one of these types
+    :return: the depth of each entity of the neighbourhood, root included, whether it has been truncated to
+    `max_nodes` entities and whether some entities had more neighbours than `fan_out`
+    """
+    depths = {root_id: 0}
+    frontier = [root_id]
+    nodes_truncated = fan_out_truncated = False
+    with connection.cursor() as cursor:
+        for level in range(1, depth + 1):
+            if not frontier or len(depths) > max_nodes:
+                break
+            cursor.execute(NEIGHBOURHOOD_LEVEL_SQL, {
+                "frontier": [str(node_id) for node_id in frontier],
+                "visited": [str(node_id) for node_id in depths],
+                "fan_out": fan_out,
+                # One more entity than allowed tells whether the neighbourhood is truncated
+                "limit": max_nodes + 1 - len(depths),
+                "names": relation_names or None,
+                "types": [str(t) for t in type_ids] if type_ids else None,
+            })
+            neighbours, level_fan_out_truncated = cursor.fetchone()
+            fan_out_truncated |= level_fan_out_truncated
+            frontier = [UUID(str(node_id)) for node_id in neighbours]
+            depths.update((node_id, level) for node_id in frontier)
+    if len(depths) > max_nodes:
+        nodes_truncated = True
+        depths = dict(list(depths.items())[:max_nodes])
+    return depths, nodes_truncated, fan_out_truncated
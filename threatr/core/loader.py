@@ -1,58 +1,165 @@
-import importlib
-import inspect
 import logging
-import pkgutil
+from datetime import timedelta
+from importlib.metadata import entry_points
+
+from django.conf import settings
+from django.utils.module_loading import import_string
 
 from threatr.core.models import Request
 from threatr.modules.module import AnalysisModule
 
 logger = logging.getLogger(__name__)
 
+ENTRY_POINT_GROUP = "threatr.modules"
+
+
+class LazyModule:
+    """
+    Analysis module of a third-party package, registered from the manifest exposed by its `threatr.modules` entry
+    point. The manifest gives the metadata of the module, the module itself is only imported once a request is
+    executed, so the web processes never import it:
+
+        MANIFEST = {
+            "module": "threatr_example.module.ExampleModule",
+            "unique_identifier": "example",
+            "vendor": "Example",
+            "description": "Get intelligence from Example.",
+            "supported_types": {"observable": ["domain", "ipv4"]},
+            # Optional, in hours
+            "freshness": 24,
+        }
+
+    The entry point refers to the manifest, e.g. `example = "threatr_example.manifest:MANIFEST"`, the module holding
+    it must not import the analysis module.
+    """
+
+    def __init__(self, manifest: dict):
+        self._manifest = manifest
+        self._module: type[AnalysisModule] | None = None
+
+    def load(self) -> type[AnalysisModule]:
+        if self._module is None:
+            self._module = import_string(self._manifest["module"])
+        return self._module
+
+    def unique_identifier(self) -> str:
+        return self._manifest["unique_identifier"]
+
+    def vendor(self) -> str:
+        return self._manifest["vendor"]
+
+    def description(self) -> str:
+        return self._manifest.get("description", "")
+
+    def supported_types(self) -> dict[str, list[str]]:
+        return self._manifest["supported_types"]
+
+    def freshness(self) -> timedelta:
+        if "freshness" in self._manifest:
+            return timedelta(hours=self._manifest["freshness"])
+        return AnalysisModule.freshness()
+
+    def __call__(self, *args, **kwargs) -> AnalysisModule:
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        # Everything else is only needed to execute requests
+        return getattr(self.load(), name)
+
+    def __repr__(self) -> str:
+        return f"<LazyModule {self._manifest['module']}>"
+
+
+class ModuleRegistry:
+    """
+    Registry of the analysis modules, built once when the application is ready. Modules are declared by their
+    dotted path in the THREATR_ANALYSIS_MODULES setting, by third-party packages through the `threatr.modules` entry
+    point group, or registered explicitly with `register`. Third-party modules are registered from their manifest,
+    see `LazyModule`.
+
+    The modules supporting each (super type, type) are indexed at registration so that selecting the candidate
+    modules of a request is a single dict lookup.
+    """
+
+    def __init__(self):
+        self._modules: dict[str, type[AnalysisModule]] = {}
+        self._index: dict[tuple[str, str], tuple[type[AnalysisModule], ...]] = {}
+        self._loaded = False
+
+    def register(self, module: type[AnalysisModule]) -> type[AnalysisModule]:
+        """
+        Register an analysis module, it can be used as a class decorator.
+        """
+        self._modules[module.unique_identifier()] = module
+        for super_type, types in module.supported_types().items():
+            for e_type in types:
+                key = (super_type.lower(), e_type.lower())
+                modules = {m.unique_identifier(): m for m in self._index.get(key, ())}
+                modules[module.unique_identifier()] = module
+                self._index[key] = tuple(modules[identifier] for identifier in sorted(modules))
+        return module
+
+    def load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        for path in settings.THREATR_ANALYSIS_MODULES:
+            self._load(path, lambda: import_string(path))
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            self._load(entry_point.value, lambda: self._from_entry_point(entry_point))
+        logger.info(f"Registered analysis modules: {', '.join(sorted(self._modules))}")
+
+    @staticmethod
+    def _from_entry_point(entry_point):
+        declared = entry_point.load()
+        if isinstance(declared, dict):
+            return LazyModule(declared)
+        logger.warning(
+            f"The analysis module {entry_point.value} is imported by every process, its entry point should refer to "
+            f"a manifest instead"
+        )
+        return declared
+
+    def _load(self, path: str, loader):
+        try:
+            self.register(loader())
+        except Exception as e:
+            # A module missing its dependencies must not prevent the others from running
+            logger.error(f"Unable to load the analysis module {path}: {e}")
+
+    def modules(self) -> list[type[AnalysisModule]]:
+        self.load()
+        return list(self._modules.values())
+
+    def get_module(self, identifier: str) -> type[AnalysisModule] | None:
+        self.load()
+        return self._modules.get(identifier)
+
+    def get_candidates(self, super_type: str, e_type: str) -> tuple[type[AnalysisModule], ...]:
+        self.load()
+        return self._index.get((super_type.lower(), e_type.lower()), ())
+
+    def get_supported_types(self) -> dict[str, list[str]]:
+        self.load()
+        supported_types = {}
+        for super_type, e_type in self._index:
+            supported_types.setdefault(super_type, []).append(e_type)
+        return supported_types
+
+
+registry = ModuleRegistry()
+
 
 class ModulesLoader:
-    root_module = importlib.import_module("threatr.modules")
-    module_classes: set[type[AnalysisModule]] = set()
-    supported_types = {}
+    """
+    Access to the analysis modules of the registry.
+    """
 
     def list_modules(self) -> set[type[AnalysisModule]]:
-        for _, modname, _ in pkgutil.walk_packages(
-            path=self.root_module.__path__,
-            prefix=self.root_module.__name__ + ".",
-            onerror=lambda x: None,
-        ):
-            module = importlib.import_module(modname)
-            for name in dir(module):
-                obj = getattr(module, name)
-                if (
-                    inspect.isclass(obj)
-                    and issubclass(obj, AnalysisModule)
-                    and not inspect.isabstract(obj)
-                ):
-                    self.module_classes.add(obj)
-        return self.module_classes
+        return set(registry.modules())
 
     def get_supported_types(self) -> dict[str, list[str]]:
-        if not self.module_classes:
-            self.list_modules()
-        self.supported_types = {}
-        for module in self.module_classes:
-            for st, t in module.supported_types().items():
-                if st not in self.supported_types:
-                    self.supported_types[st] = set()
-                self.supported_types[st].update(t)
-        for st, t in self.supported_types.items():
-            self.supported_types[st] = list(t)
-        return self.supported_types
+        return registry.get_supported_types()
 
     def get_candidate_classes(self, request: Request) -> {type}:
-        candidates = set()
-        if not self.module_classes:
-            self.list_modules()
-        for c in self.module_classes:
-            logger.info(f"Loading analysis module {c} for [{c.vendor()}]")
-            requested_super_type = request.super_type.short_name.lower()
-            requested_type = request.type.short_name.lower()
-            supported_types = c.supported_types()
-            if requested_type in supported_types.get(requested_super_type, []):  # noqa: E501
-                candidates.add(c)
-        return candidates
+        return set(registry.get_candidates(request.super_type.short_name, request.type.short_name))
@@ -0,0 +1,125 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from threatr.core.models import Entity, EntityRelation, Event, Request
+from threatr.core.type_registry import type_registry
+
+PREFIX = "bench-"
+
+ENTITIES_SQL = """
+INSERT INTO core_entity (id, name, super_type_id, type_id, created_at, updated_at, tlp, pap, attributes)
+SELECT gen_random_uuid(), %(prefix)s || n || '.example.com', %(super_type)s, %(type)s, now(), now(), 'WHITE',
+       'WHITE', ''::hstore
+FROM generate_series(1, %(count)s) n
+ON CONFLICT DO NOTHING
+"""
+
+RELATIONS_SQL = """
+WITH entities AS (
+    SELECT id, row_number() OVER (ORDER BY name) AS n FROM core_entity WHERE name LIKE %(prefix)s || '%%'
+)
+INSERT INTO core_entityrelation (id, name, created_at, attributes, obj_from_id, obj_to_id)
+SELECT gen_random_uuid(), %(prefix)s || 'relation', now(), ''::hstore, a.id, b.id
+FROM generate_series(1, %(count)s) g
+JOIN entities a ON a.n = 1 + g %% %(entities)s
+JOIN entities b ON b.n = 1 + (g::bigint * 7919) %% %(entities)s
+ON CONFLICT DO NOTHING
+"""
+
+EVENTS_SQL = """
+WITH entities AS (
+    SELECT id, row_number() OVER (ORDER BY name) AS n FROM core_entity WHERE name LIKE %(prefix)s || '%%'
+)
+INSERT INTO core_event (id, name, type_id, first_seen, last_seen, count, created_at, updated_at, attributes,
+                        involved_entity_id)
+SELECT gen_random_uuid(), %(prefix)s || 'event', %(type)s, now() - g * interval '1 minute',
+       now() - g * interval '1 minute', 1, now(), now(), ''::hstore, e.id
+FROM generate_series(1, %(count)s) g
+JOIN entities e ON e.n = 1 + g %% %(entities)s
+ON CONFLICT DO NOTHING
+"""
+
+REQUESTS_SQL = """
+INSERT INTO core_request (id, created_at, value, status, super_type_id, type_id, modules_status)
+SELECT gen_random_uuid(), now() - g * interval '1 second', %(prefix)s || (1 + g %% %(entities)s) || '.example.com',
+       'SUCCEEDED', %(super_type)s, %(type)s, ''::hstore
+FROM generate_series(1, %(count)s) g
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a synthetic dataset and show the plans of the lookup and graph queries of the "
+        "request API. Run it before and after migrating to compare the plans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entities", type=int, default=1_000_000)
+        parser.add_argument("--relations", type=int, default=3_000_000)
+        parser.add_argument("--events", type=int, default=2_000_000)
+        parser.add_argument("--requests", type=int, default=1_000_000)
+        parser.add_argument(
+            "--explain-only", action="store_true", help="Only show the plans, the dataset is already loaded."
+        )
+        parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic dataset and exit.")
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            self.cleanup()
+            return
+        domain = type_registry.get_type("OBSERVABLE", "DOMAIN")
+        event_type = next(iter(type_registry.get_types("EVENT").values()), None)
+        if not domain or not event_type:
+            raise CommandError("Entity types are missing, run the insert_default_data command first.")
+        if not options["explain_only"]:
+            self.load(options, domain, event_type)
+        self.explain(options["entities"] // 2, domain)
+
+    def load(self, options: dict, domain, event_type):
+        params = {
+            "prefix": PREFIX,
+            "super_type": domain.super_type_id,
+            "type": domain.id,
+            "entities": options["entities"],
+        }
+        with connection.cursor() as cursor:
+            for table, sql, count, extra_params in [
+                ("entities", ENTITIES_SQL, options["entities"], {}),
+                ("relations", RELATIONS_SQL, options["relations"], {}),
+                ("events", EVENTS_SQL, options["events"], {"type": event_type.id}),
+                ("requests", REQUESTS_SQL, options["requests"], {}),
+            ]:
+                self.stdout.write(f"Loading {count} {table}")
+                cursor.execute(sql, {**params, **extra_params, "count": count})
+            for table in ["core_entity", "core_entityrelation", "core_event", "core_request"]:
+                cursor.execute(f"ANALYZE {table}")
+
+    def explain(self, n: int, domain):
+        value = f"{PREFIX}{n}.example.com"
+        entity = Entity.objects.filter(name=value, super_type=domain.super_type, type=domain).first()
+        if not entity:
+            raise CommandError(f"Unable to find the entity [{value}], load the dataset first.")
+        related_fields = ("obj_from__super_type", "obj_from__type", "obj_to__super_type", "obj_to__type")
+        queries = {
+            "Latest request": Request.objects.for_value(value).filter(super_type=domain.super_type, type=domain)[:1],
+            "Entity": Entity.objects.filter(name=value, super_type=domain.super_type, type=domain),
+            "Relations (OR)": EntityRelation.objects.filter(
+                Q(obj_from=entity) | Q(obj_to=entity)
+            ).select_related(*related_fields),
+            "Relations (UNION ALL)": entity.get_relations(*related_fields),
+            "Events": Event.objects.filter(involved_entity=entity).select_related("type"),
+        }
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain(analyze=True, buffers=True))
+            self.stdout.write("")
+
+    def cleanup(self):
+        # Plain deletes, collecting millions of rows to cascade the deletion would take ages
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM core_request WHERE value LIKE %s", [f"{PREFIX}%"])
+            cursor.execute("DELETE FROM core_event WHERE name = %s", [f"{PREFIX}event"])
+            cursor.execute("DELETE FROM core_entityrelation WHERE name = %s", [f"{PREFIX}relation"])
+            cursor.execute("DELETE FROM core_entity WHERE name LIKE %s", [f"{PREFIX}%"])
+        self.stdout.write("Deleted the synthetic dataset")
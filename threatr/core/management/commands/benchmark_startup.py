@@ -0,0 +1,96 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Vendor SDKs only needed by the workers executing the requests
+VENDOR_SDKS = ["vt", "shodan", "OTXv2", "pymisp", "scarlet_shark_client", "colander_data_converter"]
+
+# Boot a web worker in a fresh interpreter, then import the given packages as an eager module loading would
+PROBE = """
+import json, resource, sys, time
+
+start = time.perf_counter()
+import django
+
+django.setup()
+import config.urls
+from threatr.core.loader import registry
+
+registry.load()
+booted = time.perf_counter()
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+print(json.dumps({
+    "boot": booted - start,
+    "seconds": time.perf_counter() - start,
+    "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "sdks": sorted(name for name in sys.argv[1:] if name in sys.modules),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the startup time and memory of a web worker in fresh interpreters, with the vendor SDKs lazily "
+        "imported and with each of them imported eagerly, to show what every web worker saves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Number of interpreters started per scenario.")
+
+    def handle(self, *args, **options):
+        scenarios = {"lazy": [], "eager (all SDKs)": VENDOR_SDKS}
+        scenarios.update({f"eager ({sdk})": [sdk] for sdk in VENDOR_SDKS})
+
+        # Warm the file system cache up so that the first scenario is not penalized
+        self._probe(VENDOR_SDKS)
+        self.stdout.write(
+            f"{'scenario':<36}{'startup (ms)':>14}{'SDKs (ms)':>11}{'max RSS (MB)':>14}{'modules':>10}  SDKs"
+        )
+        baseline = None
+        for name, sdks in scenarios.items():
+            results = [self._probe(sdks) for _ in range(options["runs"])]
+            result = {
+                "seconds": statistics.median(r["seconds"] for r in results),
+                # Time spent importing the SDKs only, far less noisy than the whole startup
+                "sdk_seconds": statistics.median(r["seconds"] - r["boot"] for r in results),
+                "max_rss": statistics.median(r["max_rss"] for r in results) / 1024,
+                "modules": results[0]["modules"],
+                "sdks": results[0]["sdks"],
+            }
+            if baseline is None:
+                baseline = result
+                if result["sdks"]:
+                    self.stderr.write(f"The web worker imports vendor SDKs: {', '.join(result['sdks'])}")
+            elif not result["sdks"]:
+                self.stdout.write(f"{name:<36}{'not installed':>14}")
+                continue
+            self.stdout.write(
+                f"{name:<36}{1000 * result['seconds']:>14.0f}{1000 * result['sdk_seconds']:>11.0f}"
+                f"{result['max_rss']:>14.1f}{result['modules']:>10}  {', '.join(result['sdks']) or '-'}"
+            )
+            if result is not baseline:
+                self.stdout.write(
+                    f"{'saved per web worker':>36}{'':>14}{1000 * result['sdk_seconds']:>11.0f}"
+                    f"{result['max_rss'] - baseline['max_rss']:>14.1f}{result['modules'] - baseline['modules']:>10}"
+                )
+
+    def _probe(self, sdks: list[str]) -> dict:
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE, *sdks],
+            capture_output=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+            env=os.environ.copy(),
+            text=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
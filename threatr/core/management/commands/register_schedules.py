@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from threatr.core.schedules import register_schedules
+
+
+class Command(BaseCommand):
+    help = "Register the periodic jobs run by the workers."
+
+    def handle(self, *args, **options):
+        register_schedules()
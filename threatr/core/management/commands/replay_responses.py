@@ -0,0 +1,73 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from threatr.core.loader import ModulesLoader
+from threatr.core.models import VendorResponse
+from threatr.core.tasks import get_replayed_module
+from threatr.core.type_registry import type_registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the archived vendor responses through the analysis modules and report the time spent and the number "
+        "of queries issued to save their results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--module", action="append", dest="modules", help="Only replay the responses of this module."
+        )
+        parser.add_argument("--limit", type=int, default=100, help="Number of responses to replay per module.")
+        parser.add_argument(
+            "--commit", action="store_true", help="Keep the replayed results instead of rolling them back."
+        )
+
+    def handle(self, *args, **options):
+        handlers = {m.unique_identifier(): m for m in ModulesLoader().list_modules()}
+        modules = options["modules"] or sorted(handlers)
+        # Do not account for the loading of the entity types
+        type_registry.get_super_types()
+
+        self.stdout.write(f"{'module':<16}{'runs':>6}{'errors':>8}{'total (s)':>12}{'mean (ms)':>12}{'queries':>10}")
+        for module in modules:
+            handler = handlers.get(module)
+            if not handler:
+                self.stderr.write(f"Unknown module {module}")
+                continue
+            recorded_responses = (
+                VendorResponse.objects.select_related("request__super_type", "request__type")
+                .filter(module=module, request__isnull=False)[:options["limit"]]
+            )
+            stats = defaultdict(float)
+            for recorded in recorded_responses:
+                self._replay(handler, recorded, options["commit"], stats)
+            mean = 1000 * stats["time"] / stats["runs"] if stats["runs"] else 0
+            self.stdout.write(
+                f"{module:<16}{stats['runs']:>6.0f}{stats['errors']:>8.0f}{stats['time']:>12.3f}{mean:>12.1f}"
+                f"{stats['queries']:>10.0f}"
+            )
+
+    def _replay(self, handler, recorded: VendorResponse, commit: bool, stats: dict):
+        try:
+            analysis_module = get_replayed_module(handler, recorded)
+        except OSError as e:
+            stats["errors"] += 1
+            self.stderr.write(f"Unable to load response {recorded.id}: {e}")
+            return
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            try:
+                analysis_module.save_results()
+            except Exception as e:
+                stats["errors"] += 1
+                self.stderr.write(f"Unable to replay response {recorded.id}: {e}")
+                commit = False
+            stats["time"] += time.perf_counter() - start
+            stats["queries"] += len(queries)
+            stats["runs"] += 1
+            if not commit:
+                transaction.set_rollback(True)
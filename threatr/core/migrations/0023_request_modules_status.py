@@ -0,0 +1,21 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:27
+
+import django.contrib.postgres.fields.hstore
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0022_alter_entity_options_alter_entity_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="request",
+            name="modules_status",
+            field=django.contrib.postgres.fields.hstore.HStoreField(
+                default=dict,
+                help_text="Status of each analysis module run for this request.",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:32
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0023_request_modules_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vendorcredentials",
+            name="cooldown",
+            field=models.DurationField(
+                default=datetime.timedelta(0),
+                help_text="Minimum delay between two usages of these credentials.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="vendorcredentials",
+            name="usage_count",
+            field=models.PositiveBigIntegerField(
+                default=0,
+                editable=False,
+                help_text="Number of times these credentials have been used.",
+            ),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0024_vendorcredentials_cooldown_usage_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VendorResponse",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        help_text="Unique identifier.",
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        db_index=True,
+                        help_text="Creation date of this object.",
+                    ),
+                ),
+                (
+                    "module",
+                    models.CharField(
+                        help_text="Unique identifier of the analysis module having obtained the response.",
+                        max_length=64,
+                    ),
+                ),
+                (
+                    "digest",
+                    models.CharField(
+                        db_index=True,
+                        help_text="SHA256 of the response, it identifies the archived file.",
+                        max_length=64,
+                    ),
+                ),
+                (
+                    "size",
+                    models.PositiveBigIntegerField(
+                        help_text="Size in bytes of the compressed response."
+                    ),
+                ),
+                (
+                    "raw_size",
+                    models.PositiveBigIntegerField(
+                        help_text="Size in bytes of the response."
+                    ),
+                ),
+                (
+                    "request",
+                    models.ForeignKey(
+                        help_text="Request the response has been obtained for.",
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="vendor_responses",
+                        to="core.request",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
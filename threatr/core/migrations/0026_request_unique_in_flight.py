@@ -0,0 +1,52 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:36
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+IN_FLIGHT_STATUSES = ["CREATED", "ENQUEUED", "PROCESSING", "POST_PROCESSING"]
+
+
+def cancel_duplicate_requests(apps, schema_editor):
+    """
+    Keep only the latest request in flight for each requested value.
+    """
+    Request = apps.get_model("core", "Request")
+    latest = set()
+    duplicates = []
+    for request_id, *key in (
+        Request.objects.filter(status__in=IN_FLIGHT_STATUSES)
+        .order_by("-created_at")
+        .values_list("id", "value", "super_type_id", "type_id")
+        .iterator()
+    ):
+        if tuple(key) in latest:
+            duplicates.append(request_id)
+        else:
+            latest.add(tuple(key))
+    Request.objects.filter(id__in=duplicates).update(status="CANCELLED")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0025_vendorresponse"),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_requests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="request",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.MD5("value"),
+                models.F("super_type"),
+                models.F("type"),
+                condition=models.Q(
+                    (
+                        "status__in",
+                        ["CREATED", "ENQUEUED", "PROCESSING", "POST_PROCESSING"],
+                    )
+                ),
+                name="unique_in_flight_request",
+            ),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:38
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.text
+
+
+def drop_foreign_key_indexes(apps, schema_editor):
+    for model_name, field_name in [
+        ("EntityRelation", "obj_from"),
+        ("EntityRelation", "obj_to"),
+        ("Event", "involved_entity"),
+    ]:
+        model = apps.get_model("core", model_name)
+        column = model._meta.get_field(field_name).column
+        for index_name in schema_editor._constraint_names(
+            model, [column], index=True, unique=False
+        ):
+            schema_editor.execute(
+                f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(index_name)}"
+            )
+
+
+class Migration(migrations.Migration):
+    # The indexes are built without locking the tables against writes
+    atomic = False
+
+    dependencies = [
+        ("core", "0026_request_unique_in_flight"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="entityrelation",
+            index=models.Index(fields=["obj_from", "name"], name="relation_from_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="entityrelation",
+            index=models.Index(fields=["obj_to", "obj_from"], name="relation_to_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="event",
+            index=models.Index(
+                fields=["involved_entity", "-first_seen"], name="event_entity_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="request",
+            index=models.Index(
+                django.db.models.functions.text.MD5("value"),
+                models.F("super_type"),
+                models.F("type"),
+                models.OrderBy(models.F("created_at"), descending=True),
+                name="request_lookup_idx",
+            ),
+        ),
+        # The single column indexes of the foreign keys are superseded by the composite ones, they are dropped
+        # without altering the foreign keys themselves
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="entityrelation",
+                    name="obj_from",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="source_of_relation",
+                        to="core.entity",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="entityrelation",
+                    name="obj_to",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="target_of_relation",
+                        to="core.entity",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="event",
+                    name="involved_entity",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="core.entity",
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(
+                    drop_foreign_key_indexes, migrations.RunPython.noop
+                ),
+            ],
+        ),
+    ]
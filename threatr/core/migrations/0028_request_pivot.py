@@ -0,0 +1,41 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0027_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="request",
+            name="pivot_budget",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Remaining number of module runs the pivots of this request may issue.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="request",
+            name="pivot_depth",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="Number of hops of discovered entities to enrich in turn, 0 disables pivoting.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="request",
+            name="pivot_root",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Request at the origin of this pivot, holding the budget shared by all its pivots.",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="pivots",
+                to="core.request",
+            ),
+        ),
+    ]
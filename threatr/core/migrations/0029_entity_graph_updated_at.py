@@ -0,0 +1,22 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0028_request_pivot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entity",
+            name="graph_updated_at",
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                help_text="Latest modification of the relations and events of this object.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.8 on 2026-10-17 22:50
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The indexes are built without locking the requests against writes
+    atomic = False
+
+    dependencies = [
+        ("core", "0029_entity_graph_updated_at"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="request",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="request_listing_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="request",
+            index=models.Index(
+                fields=["status", "-created_at", "-id"],
+                name="request_status_listing_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="request",
+            index=models.Index(
+                fields=["type", "-created_at", "-id"], name="request_type_listing_idx"
+            ),
+        ),
+    ]
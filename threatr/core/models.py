@@ -1,11 +1,17 @@
+import hashlib
 import uuid
+from datetime import datetime, timedelta
 
+from django.conf import settings
 from django.contrib.postgres.fields import HStoreField
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, DateTimeField, ExpressionWrapper, F, Min, Q, Value, When
+from django.db.models.functions import MD5
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from threatr.core.type_registry import type_registry
+
 
 class VendorCredentials(models.Model):
     class Meta:
@@ -25,6 +31,61 @@ class VendorCredentials(models.Model):
     )
     last_usage = models.DateTimeField(default=timezone.now)
     credentials = HStoreField(default=dict)
+    cooldown = models.DurationField(
+        default=timedelta(0),
+        help_text=_("Minimum delay between two usages of these credentials."),
+    )
+    usage_count = models.PositiveBigIntegerField(
+        default=0, help_text=_("Number of times these credentials have been used."), editable=False
+    )
+
+    @classmethod
+    def lease(cls, vendor: str) -> "VendorCredentials | None":
+        """
+        Lease the least recently used credentials of the given vendor out of their cooldown. The leased row is locked
+        while its usage is recorded and rows locked by other workers are skipped, so concurrent workers are handed
+        distinct credentials.
+        :return: the leased credentials or None if all of them are in use or cooling down
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            credentials = (
+                cls.objects.select_for_update(skip_locked=True)
+                .alias(available_at=ExpressionWrapper(F("last_usage") + F("cooldown"), output_field=DateTimeField()))
+                .filter(vendor=vendor, available_at__lte=now)
+                .order_by("last_usage")
+                .first()
+            )
+            if credentials:
+                cls.objects.filter(id=credentials.id).update(last_usage=now, usage_count=F("usage_count") + 1)
+                # Restored should the credentials be released unused
+                credentials._previous_usage = credentials.last_usage
+                credentials.last_usage = now
+                credentials.usage_count += 1
+        return credentials
+
+    def release(self):
+        """
+        Give leased credentials back unused, their usage is not recorded. The last usage is left as is if they have
+        been leased again in the meantime.
+        """
+        VendorCredentials.objects.filter(id=self.id).update(
+            usage_count=F("usage_count") - 1,
+            last_usage=Case(
+                When(last_usage=self.last_usage, then=Value(self._previous_usage)), default=F("last_usage")
+            ),
+        )
+        self.last_usage = self._previous_usage
+        self.usage_count -= 1
+
+    @classmethod
+    def next_availability(cls, vendor: str) -> datetime | None:
+        """
+        :return: when the first credentials of the given vendor will be out of their cooldown, None if there are none
+        """
+        return cls.objects.filter(vendor=vendor).aggregate(
+            available_at=Min(ExpressionWrapper(F("last_usage") + F("cooldown"), output_field=DateTimeField()))
+        )["available_at"]
 
 
 class EntitySuperType(models.Model):
@@ -52,10 +113,7 @@ class EntitySuperType(models.Model):
 
     @staticmethod
     def get_types() -> dict:
-        super_types = {}
-        for t in EntitySuperType.objects.all():
-            super_types[t.short_name] = t
-        return super_types
+        return type_registry.get_super_types()
 
     def __str__(self):
         return self.name
@@ -87,18 +145,62 @@ class EntityType(models.Model):
 
     @staticmethod
     def get_types(super_type: str) -> dict:
-        sub_types = {}
-        for t in EntityType.objects.filter(super_type=super_type.upper()):
-            sub_types[t.short_name] = t
-        return sub_types
+        return type_registry.get_types(super_type)
 
     def __str__(self):
         return self.name
 
 
+class RequestQuerySet(models.QuerySet):
+    """
+    Requested values can exceed the size of a btree index entry, e.g. long URLs, they are indexed by their MD5
+    digest instead. Lookups by value have to go through these methods for the indexes to be used.
+    """
+
+    def for_value(self, value):
+        """
+        :param value: the requested value or an expression, e.g. OuterRef("name")
+        """
+        if isinstance(value, str):
+            return self.alias(value_md5=MD5("value")).filter(
+                value_md5=hashlib.md5(value.encode()).hexdigest(), value=value
+            )
+        return self.alias(value_md5=MD5("value")).filter(value_md5=MD5(value), value=value)
+
+    def stale(self):
+        """
+        Requests still in flight long after their creation, e.g. their worker has been killed or ran out of retries.
+        """
+        return self.filter(status__in=Request.IN_FLIGHT_STATUSES, created_at__lt=Request.stale_threshold())
+
+    def for_values(self, values):
+        values = set(values)
+        return self.alias(value_md5=MD5("value")).filter(
+            value_md5__in={hashlib.md5(value.encode()).hexdigest() for value in values}, value__in=values
+        )
+
+
 class Request(models.Model):
     class Meta:
         ordering = ["-created_at"]
+        constraints = [
+            # At most one enrichment in flight per requested value
+            models.UniqueConstraint(
+                MD5("value"),
+                F("super_type"),
+                F("type"),
+                condition=Q(status__in=["CREATED", "ENQUEUED", "PROCESSING", "POST_PROCESSING"]),
+                name="unique_in_flight_request",
+            ),
+        ]
+        indexes = [
+            # Latest request for a value
+            models.Index(MD5("value"), F("super_type"), F("type"), F("created_at").desc(), name="request_lookup_idx"),
+            # Listing of the requests, optionally by status or by type
+            models.Index(fields=["-created_at", "-id"], name="request_listing_idx"),
+            models.Index(fields=["status", "-created_at", "-id"], name="request_status_listing_idx"),
+            models.Index(fields=["type", "-created_at", "-id"], name="request_type_listing_idx"),
+        ]
 
     class Status(models.TextChoices):
         CREATED = "CREATED", _("Created")
@@ -109,6 +211,10 @@ class Request(models.Model):
         CANCELLED = "CANCELLED", _("Cancelled")
         FAILED = "FAILED", _("Failed")
 
+    IN_FLIGHT_STATUSES = [Status.CREATED, Status.ENQUEUED, Status.PROCESSING, Status.POST_PROCESSING]
+
+    objects = RequestQuerySet.as_manager()
+
     id = models.UUIDField(
         primary_key=True,
         default=uuid.uuid4,
@@ -134,6 +240,89 @@ class Request(models.Model):
         on_delete=models.CASCADE,
         related_name="request_type"
     )
+    modules_status = HStoreField(
+        default=dict, help_text=_("Status of each analysis module run for this request.")
+    )
+    pivot_depth = models.PositiveSmallIntegerField(
+        default=0, help_text=_("Number of hops of discovered entities to enrich in turn, 0 disables pivoting.")
+    )
+    pivot_budget = models.PositiveIntegerField(
+        default=0, help_text=_("Remaining number of module runs the pivots of this request may issue.")
+    )
+    pivot_root = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="pivots",
+        help_text=_("Request at the origin of this pivot, holding the budget shared by all its pivots."),
+    )
+
+    @classmethod
+    def get_or_create_in_flight(
+        cls, value: str, super_type: EntitySuperType, e_type: EntityType, **fields
+    ) -> ("Request", bool):
+        """
+        Get the request in flight for the given value or create it. The unique constraint on the requests in flight
+        is the only guarantee that concurrent callers share a single request, the callers losing the race get the
+        request created by the winner. A request in flight for longer than THREATR_REQUEST_STALE_AFTER is marked as
+        failed and replaced, its worker is considered gone.
+        :param fields: additional fields of the created request, created requests are enqueued unless another status
+        is given
+        :return: the request and whether it has been created
+        """
+        in_flight = cls.objects.for_value(value).filter(
+            super_type=super_type, type=e_type, status__in=cls.IN_FLIGHT_STATUSES
+        )
+        request = in_flight.first()
+        if request:
+            if request.created_at >= cls.stale_threshold():
+                return request, False
+            cls.objects.filter(id=request.id, status__in=cls.IN_FLIGHT_STATUSES).update(status=cls.Status.FAILED)
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    value=value, super_type=super_type, type=e_type, **{"status": cls.Status.ENQUEUED, **fields}
+                ), True
+        except IntegrityError:
+            return in_flight.get(), False
+
+    @staticmethod
+    def stale_threshold() -> datetime:
+        """
+        :return: the creation date before which a request still in flight is considered stale
+        """
+        return timezone.now() - timedelta(seconds=settings.THREATR_REQUEST_STALE_AFTER)
+
+
+class VendorResponse(models.Model):
+    class Meta:
+        ordering = ["-created_at"]
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        help_text=_("Unique identifier."),
+        editable=False,
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True, help_text=_("Creation date of this object."), editable=False, db_index=True
+    )
+    request = models.ForeignKey(
+        Request,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="vendor_responses",
+        help_text=_("Request the response has been obtained for."),
+    )
+    module = models.CharField(
+        max_length=64, help_text=_("Unique identifier of the analysis module having obtained the response.")
+    )
+    digest = models.CharField(
+        max_length=64, db_index=True, help_text=_("SHA256 of the response, it identifies the archived file.")
+    )
+    size = models.PositiveBigIntegerField(help_text=_("Size in bytes of the compressed response."))
+    raw_size = models.PositiveBigIntegerField(help_text=_("Size in bytes of the response."))
 
 
 class Entity(models.Model):
@@ -180,6 +369,10 @@ class Entity(models.Model):
     updated_at = models.DateTimeField(
         help_text=_("Latest modification of this object."), auto_now=True
     )
+    graph_updated_at = models.DateTimeField(
+        help_text=_("Latest modification of the relations and events of this object."), null=True, blank=True,
+        editable=False,
+    )
     super_type = models.ForeignKey(
         EntitySuperType,
         on_delete=models.CASCADE,
@@ -223,11 +416,25 @@ class Entity(models.Model):
     def __str__(self):
         return f"{self.name} ({self.type.name})"
 
-    def get_relations(self):
-        relations = EntityRelation.objects.filter(
-            Q(obj_from_id=self.id) | Q(obj_to_id=self.id)
-        ).all()
-        return relations
+    @property
+    def version(self) -> datetime:
+        """
+        Latest modification of this entity, its relations or its events.
+        """
+        return max(self.updated_at, self.graph_updated_at or self.updated_at)
+
+    def get_relations(self, *related_fields: str):
+        """
+        Relations from or to this entity. Each direction is looked up with its own index and both are concatenated
+        with UNION ALL instead of a single OR lookup, relations of the entity with itself are only returned once.
+        :param related_fields: related objects to fetch along with the relations
+        """
+        return EntityRelation.objects.filter(obj_from_id=self.id).select_related(*related_fields).union(
+            EntityRelation.objects.filter(obj_to_id=self.id).exclude(obj_from_id=self.id).select_related(
+                *related_fields
+            ),
+            all=True,
+        )
 
     def get_in_relations(self):
         relations = EntityRelation.objects.filter(obj_to_id=self.id).all()
@@ -253,6 +460,12 @@ class Entity(models.Model):
 class EntityRelation(models.Model):
     class Meta:
         unique_together = ["name", "obj_from_id", "obj_to_id"]
+        indexes = [
+            # Relations from an entity, optionally by name
+            models.Index(fields=["obj_from", "name"], name="relation_from_idx"),
+            # Relations to an entity, the relations from the same entity being excluded
+            models.Index(fields=["obj_to", "obj_from"], name="relation_to_idx"),
+        ]
 
     id = models.UUIDField(
         primary_key=True,
@@ -272,10 +485,10 @@ class EntityRelation(models.Model):
     )
     attributes = HStoreField(default=dict)
     obj_from = models.ForeignKey(
-        Entity, on_delete=models.CASCADE, related_name="source_of_relation"
+        Entity, on_delete=models.CASCADE, related_name="source_of_relation", db_index=False
     )
     obj_to = models.ForeignKey(
-        Entity, on_delete=models.CASCADE, related_name="target_of_relation"
+        Entity, on_delete=models.CASCADE, related_name="target_of_relation", db_index=False
     )
 
     def __eq__(self, other):
@@ -294,6 +507,10 @@ class Event(models.Model):
     class Meta:
         ordering = ["-first_seen"]
         unique_together = ["type", "name", "first_seen", "last_seen", "involved_entity"]
+        indexes = [
+            # Events of an entity, latest first
+            models.Index(fields=["involved_entity", "-first_seen"], name="event_entity_idx"),
+        ]
 
     id = models.UUIDField(
         primary_key=True,
@@ -328,6 +545,7 @@ class Event(models.Model):
     involved_entity = models.ForeignKey(
         Entity,
         on_delete=models.CASCADE,
+        db_index=False,
     )
     attributes = HStoreField(default=dict)
 
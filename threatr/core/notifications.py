@@ -0,0 +1,100 @@
+import asyncio
+import json
+import logging
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.db import transaction
+
+from threatr.core.models import Request
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "threatr:requests:"
+FINAL_STATUSES = [Request.Status.SUCCEEDED, Request.Status.CANCELLED, Request.Status.FAILED]
+
+_client: redis.Redis | None = None
+
+
+def get_request_event(request_id, request_status: str, modules_status: dict) -> str:
+    return json.dumps({
+        "type": "request",
+        "id": str(request_id),
+        "status": request_status,
+        "modules_status": modules_status,
+    })
+
+
+def publish_request_status(request: Request):
+    """
+    Publish the status of a request to the websocket subscribers once the current transaction is committed, so
+    that they never see a status before it is visible in the database.
+    """
+    if not settings.THREATR_NOTIFICATIONS_REDIS_URL:
+        return
+    channel = f"{CHANNEL_PREFIX}{request.id}"
+    event = get_request_event(request.id, request.status, dict(request.modules_status))
+
+    def publish():
+        global _client
+        try:
+            if _client is None:
+                _client = redis.Redis.from_url(settings.THREATR_NOTIFICATIONS_REDIS_URL)
+            _client.publish(channel, event)
+        except Exception as e:
+            # Subscribers can still fall back on polling the request
+            logger.warning(f"Unable to publish the status of request {request.id}: {e}")
+
+    transaction.on_commit(publish)
+
+
+class RequestEvents:
+    """
+    Dispatch the status events of the requests published through Redis to the websocket connections of the process.
+    A single pattern subscription is shared by all the connections of the process, whatever their number.
+    """
+    RETRY_DELAY = 1
+
+    def __init__(self):
+        self._queues: dict[str, set[asyncio.Queue]] = {}
+        self._listener: asyncio.Task | None = None
+
+    def subscribe(self, request_id: str, queue: asyncio.Queue):
+        self._queues.setdefault(request_id, set()).add(queue)
+        if not settings.THREATR_NOTIFICATIONS_REDIS_URL:
+            return
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    def unsubscribe(self, request_id: str, queue: asyncio.Queue):
+        queues = self._queues.get(request_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._queues[request_id]
+
+    def dispatch(self, request_id: str, event: str):
+        for queue in list(self._queues.get(request_id, ())):
+            queue.put_nowait(event)
+
+    async def _listen(self):
+        while True:
+            client = redis.asyncio.Redis.from_url(settings.THREATR_NOTIFICATIONS_REDIS_URL)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                    async for message in pubsub.listen():
+                        if message["type"] == "pmessage":
+                            self.dispatch(message["channel"].decode()[len(CHANNEL_PREFIX):], message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Lost the subscription to the request events: {e}")
+                await asyncio.sleep(self.RETRY_DELAY)
+            finally:
+                await client.aclose()
+
+
+request_events = RequestEvents()
@@ -0,0 +1,356 @@
+import logging
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.db.models import Model
+from django.utils import timezone
+
+from threatr.core.models import Entity, EntityRelation, EntitySuperType, EntityType, Event
+
+logger = logging.getLogger(__name__)
+
+
+def _merge_tags(*tags: str) -> str:
+    merged = []
+    for _tags in tags:
+        for tag in (_tags or '').split(','):
+            tag = tag.strip()
+            if tag and tag not in merged:
+                merged.append(tag)
+    return ','.join(merged)
+
+
+def _merge_attributes(defaults: dict, existing: dict, attributes: dict) -> dict:
+    """
+    Merge the attributes of an object, the attributes set by the module override the existing ones which override
+    the defaults. Tags are merged instead of being overridden.
+    """
+    merged = {**defaults, **existing, **attributes}
+    if 'tags' in existing and 'tags' in attributes:
+        merged['tags'] = _merge_tags(existing['tags'], attributes['tags'])
+    for key, value in merged.items():
+        # Entities can be referenced by attributes, they are stored as their ID
+        if isinstance(value, Entity):
+            merged[key] = str(value.id)
+    return merged
+
+
+def _upsert(model: type[Model], rows: list[dict], unique_fields: list[str], update_fields: list[str],
+            merged_fields: list[str] = None, batch_size: int = 500) -> list[tuple]:
+    """
+    Insert the given rows or update the existing ones conflicting on the given unique fields with a single
+    INSERT ... ON CONFLICT DO UPDATE statement per batch.
+    :param merged_fields: hstore fields merged into the stored value instead of replacing it, so that the keys written
+    by a worker which inserted the same row concurrently are kept
+    :return: the ID and the unique fields of every written row
+    """
+    if not rows:
+        return []
+    # Always lock the rows in the same order to avoid deadlocks between concurrent workers
+    rows = sorted(rows, key=lambda row: tuple(str(row[name]) for name in unique_fields))
+    quote_name = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    columns = ', '.join(quote_name(f.column) for f in fields)
+    conflict = ', '.join(quote_name(model._meta.get_field(name).column) for name in unique_fields)
+    table = quote_name(model._meta.db_table)
+    updates = ', '.join(
+        f'{quote_name(c)} = {table}.{quote_name(c)} || EXCLUDED.{quote_name(c)}'
+        if name in (merged_fields or []) else f'{quote_name(c)} = EXCLUDED.{quote_name(c)}'
+        for name, c in [(name, model._meta.get_field(name).column) for name in update_fields]
+    )
+    placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    written = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = []
+            for row in batch:
+                params.extend(f.get_db_prep_save(row[f.name], connection) for f in fields)
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'VALUES {", ".join([placeholders] * len(batch))} '
+                f'ON CONFLICT ({conflict}) DO UPDATE SET {updates} '
+                f'RETURNING {quote_name("id")}, {conflict}',
+                params,
+            )
+            written.extend(cursor.fetchall())
+    return written
+
+
+class _StagedEntity:
+    def __init__(self, entity: Entity, overwrite: bool):
+        self.entity = entity
+        self.defaults = {}
+        self.fields = {}
+        self.overwrite = overwrite
+
+
+class ResultsWriter:
+    """
+    Collect the entities, relations and events produced by an analysis module and write them with set-based upserts
+    keyed on their unique constraints.
+
+    Each collected object is returned as an unsaved model instance the module can keep on updating (attributes,
+    tags, description...) until `flush` is called. Flushing reads and locks the existing objects once, merges them
+    with the collected ones in memory, then writes everything with one INSERT ... ON CONFLICT statement per table.
+    """
+
+    def __init__(self, vendor: str):
+        self.vendor = vendor
+        self._entities: dict[tuple, _StagedEntity] = {}
+        self._relations: dict[tuple, tuple[EntityRelation, dict]] = {}
+        self._events: dict[tuple, tuple[Event, dict]] = {}
+
+    def entity(self, name: str, super_type: EntitySuperType, entity_type: EntityType, attributes: dict = None,
+               defaults: dict = None, description: str = None, source_url: str = None, tlp: str = None,
+               pap: str = None, overwrite: bool = False) -> Entity:
+        """
+        Collect an entity.
+        :param attributes: attributes overriding the existing ones
+        :param defaults: attributes set only if missing, the source vendor is always part of them
+        :param overwrite: whether the given description, source URL, TLP and PAP override the existing values,
+        by default they are only set on entities lacking them
+        :return: the collected entity, the same instance is returned every time the same entity is collected
+        """
+        key = (name, super_type.short_name, entity_type.id)
+        staged = self._entities.get(key)
+        if not staged:
+            entity = Entity(name=name, super_type=super_type, type=entity_type, attributes={})
+            staged = _StagedEntity(entity, overwrite)
+            staged.defaults['source_vendor'] = self.vendor
+            self._entities[key] = staged
+        staged.entity.attributes.update(attributes or {})
+        staged.defaults.update(defaults or {})
+        fields = {'description': description, 'source_url': source_url, 'tlp': tlp, 'pap': pap}
+        staged.fields.update({k: v for k, v in fields.items() if v})
+        staged.overwrite |= overwrite
+        return staged.entity
+
+    def relation(self, name: str, obj_from: Entity, obj_to: Entity, attributes: dict = None,
+                 defaults: dict = None) -> EntityRelation:
+        """
+        Collect a relation between two collected entities.
+        :param attributes: attributes overriding the existing ones
+        :param defaults: attributes set only if missing, the source vendor is always part of them
+        """
+        key = (name, id(obj_from), id(obj_to))
+        if key not in self._relations:
+            relation = EntityRelation(name=name, obj_from=obj_from, obj_to=obj_to, attributes={})
+            self._relations[key] = (relation, {'source_vendor': self.vendor})
+        relation, relation_defaults = self._relations[key]
+        relation.attributes.update(attributes or {})
+        relation_defaults.update(defaults or {})
+        return relation
+
+    def event(self, name: str, event_type: EntityType, first_seen: datetime, last_seen: datetime,
+              involved_entity: Entity, count: int = 1, description: str = None, attributes: dict = None,
+              defaults: dict = None) -> Event:
+        """
+        Collect an event involving a collected entity. The count and the description override the existing ones.
+        :param attributes: attributes overriding the existing ones
+        :param defaults: attributes set only if missing, the source vendor is always part of them
+        """
+        key = (name, event_type.id, first_seen, last_seen, id(involved_entity))
+        if key not in self._events:
+            event = Event(
+                name=name, type=event_type, first_seen=first_seen, last_seen=last_seen,
+                involved_entity=involved_entity, attributes={}
+            )
+            self._events[key] = (event, {'source_vendor': self.vendor})
+        event, event_defaults = self._events[key]
+        event.count = count
+        if description:
+            event.description = description
+        event.attributes.update(attributes or {})
+        event_defaults.update(defaults or {})
+        return event
+
+    def flush(self) -> ([Entity], [EntityRelation], [Event]):
+        """
+        Write all the collected objects.
+        :return: the written entities, relations and events with their resolved IDs
+        """
+        with transaction.atomic():
+            entities = self._flush_entities()
+            relations = self._flush_relations()
+            events = self._flush_events()
+            self._touch_graphs(relations, events)
+        logger.info(
+            f"{self.vendor}: wrote {len(entities)} entities, {len(relations)} relations and {len(events)} events"
+        )
+        return entities, relations, events
+
+    def _flush_entities(self) -> [Entity]:
+        if not self._entities:
+            return []
+        now = timezone.now()
+        # The existing entities are locked until the end of the flush, so that the attributes written by the other
+        # modules of the request are merged instead of being overwritten. They are locked in the same order by every
+        # worker to avoid deadlocks.
+        existing_entities = {
+            (e.name, e.super_type_id, e.type_id): e
+            for e in Entity.objects.select_for_update().filter(
+                name__in={k[0] for k in self._entities},
+                type_id__in={k[2] for k in self._entities},
+            ).order_by('name', 'super_type_id', 'type_id')
+        }
+        # Resolve the IDs of the existing entities first, attributes can reference other entities
+        for key, staged in self._entities.items():
+            existing = existing_entities.get(key)
+            if existing:
+                staged.entity.id = existing.id
+        rows = []
+        for key, staged in self._entities.items():
+            entity = staged.entity
+            existing = existing_entities.get(key)
+            if existing:
+                entity.created_at = existing.created_at
+                for field in ['description', 'source_url', 'tlp', 'pap']:
+                    value = staged.fields.get(field)
+                    current = getattr(existing, field)
+                    setattr(entity, field, value if value and (staged.overwrite or not current) else current)
+            else:
+                entity.created_at = now
+                for field, value in staged.fields.items():
+                    setattr(entity, field, value)
+            entity.updated_at = now
+            entity.attributes = _merge_attributes(
+                staged.defaults, existing.attributes if existing else {}, entity.attributes
+            )
+            rows.append({
+                'id': entity.id,
+                'name': entity.name,
+                'super_type': entity.super_type_id,
+                'type': entity.type_id,
+                'description': entity.description,
+                'source_url': entity.source_url,
+                'tlp': entity.tlp,
+                'pap': entity.pap,
+                'attributes': entity.attributes,
+                'created_at': entity.created_at,
+                'updated_at': entity.updated_at,
+            })
+        written = _upsert(
+            Entity, rows,
+            unique_fields=['name', 'super_type', 'type'],
+            update_fields=['description', 'source_url', 'tlp', 'pap', 'attributes', 'updated_at'],
+            merged_fields=['attributes'],
+        )
+        # Another worker may have created some of the entities in the meantime
+        for entity_id, *key in written:
+            if staged := self._entities.get(tuple(key)):
+                staged.entity.id = entity_id
+        return [staged.entity for staged in self._entities.values()]
+
+    def _flush_relations(self) -> [EntityRelation]:
+        if not self._relations:
+            return []
+        now = timezone.now()
+        relations = {}
+        for relation, defaults in self._relations.values():
+            # The entities were unsaved when the relation got them, the foreign keys only get the IDs the entities
+            # have been given since, e.g. the ones of existing entities, once copied explicitly
+            relation.obj_from_id, relation.obj_to_id = relation.obj_from.id, relation.obj_to.id
+            relations[(relation.name, relation.obj_from_id, relation.obj_to_id)] = (relation, defaults)
+        existing_relations = {
+            (r.name, r.obj_from_id, r.obj_to_id): r
+            for r in EntityRelation.objects.select_for_update().filter(
+                name__in={k[0] for k in relations},
+                obj_from_id__in={k[1] for k in relations},
+            ).order_by('name', 'obj_from_id', 'obj_to_id')
+        }
+        rows = []
+        for key, (relation, defaults) in relations.items():
+            existing = existing_relations.get(key)
+            if existing:
+                relation.id = existing.id
+                relation.created_at = existing.created_at
+                relation.description = relation.description or existing.description
+            else:
+                relation.created_at = now
+            relation.attributes = _merge_attributes(
+                defaults, existing.attributes if existing else {}, relation.attributes
+            )
+            rows.append({
+                'id': relation.id,
+                'name': relation.name,
+                'description': relation.description,
+                'obj_from': relation.obj_from_id,
+                'obj_to': relation.obj_to_id,
+                'attributes': relation.attributes,
+                'created_at': relation.created_at,
+            })
+        written = _upsert(
+            EntityRelation, rows,
+            unique_fields=['name', 'obj_from', 'obj_to'],
+            update_fields=['description', 'attributes'],
+            merged_fields=['attributes'],
+        )
+        for relation_id, *key in written:
+            if relation := relations.get(tuple(key)):
+                relation[0].id = relation_id
+        return [relation for relation, _ in relations.values()]
+
+    @staticmethod
+    def _touch_graphs(relations: [EntityRelation], events: [Event]):
+        """
+        Stamp the entities whose relations or events have been written, the stamp versions their result documents.
+        """
+        entity_ids = {r.obj_from_id for r in relations} | {r.obj_to_id for r in relations}
+        entity_ids.update(e.involved_entity_id for e in events)
+        if entity_ids:
+            Entity.objects.filter(id__in=entity_ids).update(graph_updated_at=timezone.now())
+
+    def _flush_events(self) -> [Event]:
+        if not self._events:
+            return []
+        now = timezone.now()
+        events = {}
+        for event, defaults in self._events.values():
+            # Same as for the relations, the entity may have been given its ID since it was assigned to the event
+            event.involved_entity_id = event.involved_entity.id
+            key = (event.type_id, event.name, event.first_seen, event.last_seen, event.involved_entity_id)
+            events[key] = (event, defaults)
+        existing_events = {
+            (e.type_id, e.name, e.first_seen, e.last_seen, e.involved_entity_id): e
+            for e in Event.objects.select_for_update().filter(
+                name__in={k[1] for k in events},
+                involved_entity_id__in={k[4] for k in events},
+            ).order_by('type_id', 'name', 'first_seen', 'last_seen', 'involved_entity_id')
+        }
+        rows = []
+        for key, (event, defaults) in events.items():
+            existing = existing_events.get(key)
+            if existing:
+                event.id = existing.id
+                event.created_at = existing.created_at
+                event.description = event.description or existing.description
+            else:
+                event.created_at = now
+            event.updated_at = now
+            event.attributes = _merge_attributes(
+                defaults, existing.attributes if existing else {}, event.attributes
+            )
+            rows.append({
+                'id': event.id,
+                'name': event.name,
+                'type': event.type_id,
+                'first_seen': event.first_seen,
+                'last_seen': event.last_seen,
+                'involved_entity': event.involved_entity_id,
+                'count': event.count,
+                'description': event.description,
+                'attributes': event.attributes,
+                'created_at': event.created_at,
+                'updated_at': event.updated_at,
+            })
+        written = _upsert(
+            Event, rows,
+            unique_fields=['type', 'name', 'first_seen', 'last_seen', 'involved_entity'],
+            update_fields=['count', 'description', 'attributes', 'updated_at'],
+            merged_fields=['attributes'],
+        )
+        for event_id, *key in written:
+            if event := events.get(tuple(key)):
+                event[0].id = event_id
+        return [event for event, _ in events.values()]
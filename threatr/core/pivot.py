@@ -0,0 +1,92 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from django_q.models import Schedule
+from django_q.tasks import schedule
+
+from threatr.core.loader import ModulesLoader
+from threatr.core.models import Entity, EntityRelation, Request
+
+logger = logging.getLogger(__name__)
+
+
+def _get_discovered_entities(request: Request):
+    """
+    Entities related to the requested one which have never been enriched, nor are being enriched.
+    """
+    root_entities = Entity.objects.filter(name=request.value, super_type=request.super_type, type=request.type)
+    enriched = Request.objects.for_value(OuterRef("name")).filter(
+        super_type=OuterRef("super_type"), type=OuterRef("type")
+    ).exclude(status__in=[Request.Status.FAILED, Request.Status.CANCELLED])
+    return (
+        Entity.objects.select_related("super_type", "type")
+        .filter(
+            Q(id__in=EntityRelation.objects.filter(obj_from__in=root_entities).values("obj_to"))
+            | Q(id__in=EntityRelation.objects.filter(obj_to__in=root_entities).values("obj_from"))
+        )
+        .alias(enriched=Exists(enriched))
+        .filter(enriched=False)
+        .order_by("created_at")
+    )
+
+
+def _reserve_budget(budget_holder_id, cost: int) -> bool:
+    return bool(
+        Request.objects.filter(id=budget_holder_id, pivot_budget__gte=cost).update(
+            pivot_budget=F("pivot_budget") - cost
+        )
+    )
+
+
+def _refund_budget(budget_holder_id, cost: int):
+    Request.objects.filter(id=budget_holder_id).update(pivot_budget=F("pivot_budget") + cost)
+
+
+def enqueue_pivots(request: Request) -> int:
+    """
+    Create the requests enriching the entities discovered by a request in pivot mode. Each pivot consumes one unit
+    of the budget of the original request per analysis module it runs, no pivot is created once the budget is
+    exhausted. Pivots are handled after a delay and spread over time so that they do not flood the queue.
+
+    Pivots wait in the created status, like any request not enqueued yet. A lookup of the same value promotes the
+    pivot and runs it right away instead of waiting behind it.
+    :return: the number of pivots created
+    """
+    if request.pivot_depth <= 0:
+        return 0
+    budget_holder_id = request.pivot_root_id or request.id
+    loader = ModulesLoader()
+    next_run = timezone.now() + timedelta(seconds=settings.THREATR_PIVOT_DELAY)
+    created_pivots = 0
+    for entity in _get_discovered_entities(request).iterator():
+        cost = len(loader.get_candidate_classes(Request(super_type=entity.super_type, type=entity.type)))
+        if not cost:
+            continue
+        if not _reserve_budget(budget_holder_id, cost):
+            logger.info(f"Pivot budget of request {budget_holder_id} exhausted")
+            break
+        pivot, created = Request.get_or_create_in_flight(
+            entity.name,
+            entity.super_type,
+            entity.type,
+            pivot_depth=request.pivot_depth - 1,
+            pivot_root_id=budget_holder_id,
+            status=Request.Status.CREATED,
+        )
+        if not created:
+            _refund_budget(budget_holder_id, cost)
+            continue
+        schedule(
+            "threatr.core.tasks.handle_pivot",
+            str(pivot.id),
+            schedule_type=Schedule.ONCE,
+            next_run=next_run,
+        )
+        next_run += timedelta(seconds=settings.THREATR_PIVOT_INTERVAL)
+        created_pivots += 1
+    if created_pivots:
+        logger.info(f"Request {request.id} pivoted to {created_pivots} entities")
+    return created_pivots
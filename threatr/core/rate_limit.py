@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Token bucket refilled continuously at `capacity / period` tokens per second. Takes a token if one is available and
+# returns 0, otherwise returns the number of seconds to wait for the next token. The Redis clock is used so that all
+# the workers share the same time reference.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+local rate = capacity / period
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(period) * 2)
+return tostring(wait)
+"""
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by all the workers through Redis, keyed by vendor and credentials.
+
+    When the cache is not backed by Redis (local development, tests), the buckets are kept in the memory of the
+    process instead.
+    """
+    PREFIX = "threatr:ratelimit"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._script = None
+        self._local_buckets: dict[str, tuple[float, float]] = {}
+
+    def _get_script(self):
+        if self._script is None:
+            try:
+                from django_redis import get_redis_connection
+
+                self._script = get_redis_connection("default").register_script(TOKEN_BUCKET_SCRIPT)
+            except (ImportError, NotImplementedError):
+                self._script = False
+        return self._script
+
+    def _acquire_local(self, key: str, capacity: int, period: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._local_buckets.get(key, (capacity, now))
+            rate = capacity / period
+            tokens = min(capacity, tokens + max(0., now - updated_at) * rate)
+            wait = 0.
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._local_buckets[key] = (tokens, now)
+            return wait
+
+    def acquire(self, vendor: str, credentials_id: str, capacity: int, period: float) -> float:
+        """
+        Take a token from the bucket of the given vendor and credentials allowing `capacity` calls every `period`
+        seconds.
+        :return: 0 if a token has been taken, otherwise the number of seconds to wait before the next token is
+        available
+        """
+        key = f"{self.PREFIX}:{vendor}:{credentials_id}"
+        script = self._get_script()
+        if not script:
+            return self._acquire_local(key, capacity, period)
+        try:
+            return float(script(keys=[key], args=[capacity, period]))
+        except Exception as e:
+            # Do not block the analysis modules when Redis is unavailable
+            logger.warning(f"Unable to check the rate limit of {vendor}: {e}")
+            return 0.
+
+    def throttle(self, vendor: str, credentials_id: str, capacity: int, period: float, max_wait: float):
+        """
+        Wait until a token of the given bucket is available.
+        :raise RateLimited: if no token is available within `max_wait` seconds
+        """
+        deadline = time.monotonic() + max_wait
+        while wait := self.acquire(vendor, credentials_id, capacity, period):
+            if time.monotonic() + wait > deadline:
+                raise RateLimited(vendor, wait)
+            logger.info(f"Rate limit of {vendor} reached, waiting {wait:.1f}s")
+            time.sleep(wait)
+
+
+class RateLimited(Exception):
+    def __init__(self, vendor: str, retry_in: float):
+        super().__init__(f"Rate limit of {vendor} reached, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+rate_limiter = RateLimiter()
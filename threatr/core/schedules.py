@@ -0,0 +1,43 @@
+import logging
+
+from django.conf import settings
+from django_q.models import Schedule
+
+logger = logging.getLogger(__name__)
+
+
+def get_schedules() -> list[dict]:
+    return [
+        {
+            "name": "Compact overlapping events",
+            "func": "threatr.core.compaction.compact_events",
+            "schedule_type": Schedule.MINUTES,
+            "minutes": settings.THREATR_EVENT_COMPACTION_INTERVAL,
+        },
+        {
+            "name": "Purge expired requests",
+            "func": "threatr.core.tasks.purge_expired_requests",
+            "schedule_type": Schedule.HOURLY,
+        },
+        {
+            "name": "Fail stale requests",
+            "func": "threatr.core.tasks.fail_stale_requests",
+            "schedule_type": Schedule.MINUTES,
+            "minutes": 15,
+        },
+        {
+            "name": "Evict archived vendor responses",
+            "func": "threatr.core.archive.evict_responses",
+            "schedule_type": Schedule.HOURLY,
+        },
+    ]
+
+
+def register_schedules():
+    """
+    Create or update the periodic jobs run by the django-q cluster.
+    """
+    for definition in get_schedules():
+        name = definition.pop("name")
+        Schedule.objects.update_or_create(name=name, defaults=definition)
+        logger.info(f"Registered schedule [{name}]")
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from threatr.core.models import EntitySuperType, EntityType
+from threatr.core.type_registry import type_registry
+
+
+@receiver([post_save, post_delete], sender=EntitySuperType)
+@receiver([post_save, post_delete], sender=EntityType)
+def invalidate_type_registry(sender, **kwargs):
+    # Invalidate once again after commit so that no other process keeps the types it may have loaded in between
+    type_registry.invalidate()
+    transaction.on_commit(type_registry.invalidate)
@@ -1,49 +1,346 @@
+import asyncio
 import logging
+import time
+from datetime import timedelta
 
+from django.conf import settings
+from django.db import connection, transaction
 from django.utils import timezone
+from django_q.models import Schedule
+from django_q.tasks import schedule
 
-from threatr.core.loader import ModulesLoader
-from threatr.core.models import Request, VendorCredentials
+from threatr.core.archive import archive_response, load_response
+from threatr.core.cache import ResultCache
+from threatr.core.compaction import compact_events
+from threatr.core.loader import ModulesLoader, registry
+from threatr.core.models import Request, VendorCredentials, VendorResponse, Entity
+from threatr.core.notifications import publish_request_status
+from threatr.core.pivot import enqueue_pivots
+from threatr.core.rate_limit import RateLimited, rate_limiter
 from threatr.modules.module import AnalysisModule
 
 logger = logging.getLogger(__name__)
 
 
-def launch_module(request: Request, handler) -> bool:
-    credentials = VendorCredentials.objects.filter(vendor=handler.unique_identifier())
-    if not credentials:
-        logger.error(f"No credentials found for module {handler.unique_identifier()}")
-        return False
+def _get_rate_limit(handler, module_credentials: VendorCredentials) -> tuple[int, float] | None:
+    rate_limit = module_credentials.credentials.get("rate_limit")
+    if rate_limit:
+        try:
+            calls, seconds = rate_limit.split("/")
+            return int(calls), float(seconds)
+        except ValueError:
+            logger.error(f"Invalid rate limit [{rate_limit}] for module {handler.unique_identifier()}")
+    return handler.rate_limit()
 
-    # Rotate credentials
-    module_credentials: VendorCredentials = credentials.first()
-    module_credentials.last_usage = timezone.now()
-    module_credentials.save()
-    analysis_module: AnalysisModule = handler(request, module_credentials.credentials)
 
+def _lease_credentials(handler) -> VendorCredentials | None:
+    """
+    Lease credentials of the module vendor, waiting up to THREATR_RATE_LIMIT_MAX_WAIT seconds for some to be
+    available.
+    :raise RateLimited: if all the credentials are still in use or cooling down after that
+    """
+    vendor = handler.unique_identifier()
+    deadline = time.monotonic() + settings.THREATR_RATE_LIMIT_MAX_WAIT
+    while not (module_credentials := VendorCredentials.lease(vendor)):
+        available_at = VendorCredentials.next_availability(vendor)
+        if not available_at:
+            logger.error(f"No credentials found for module {vendor}")
+            return None
+        # Credentials out of their cooldown may only be locked by other workers for a short while
+        wait = max(1., (available_at - timezone.now()).total_seconds())
+        if time.monotonic() + wait > deadline:
+            raise RateLimited(vendor, wait)
+        time.sleep(wait)
+    return module_credentials
+
+
+def _prepare_module(request: Request, handler) -> AnalysisModule | None:
+    module_credentials = _lease_credentials(handler)
+    if not module_credentials:
+        return None
+
+    analysis_module: AnalysisModule = handler(request, module_credentials.credentials)
+    # Requests rejected by the module use neither the credentials nor the quota of the vendor
     if analysis_module.fail_fast():
-        return False
+        module_credentials.release()
+        return None
+
+    if rate_limit := _get_rate_limit(handler, module_credentials):
+        rate_limiter.throttle(
+            handler.unique_identifier(), str(module_credentials.id), *rate_limit,
+            max_wait=settings.THREATR_RATE_LIMIT_MAX_WAIT,
+        )
+    return analysis_module
+
 
+def _reschedule_module(request: Request, handler, delay: float):
+    logger.info(f"Module {handler.unique_identifier()} rescheduled in {delay:.0f}s")
+    schedule(
+        "threatr.core.tasks.retry_module",
+        str(request.id),
+        handler.unique_identifier(),
+        schedule_type=Schedule.ONCE,
+        next_run=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def _save_results(request: Request, handler, analysis_module: AnalysisModule):
     try:
-        analysis_module.execute_request()
         analysis_module.save_results()
-        return True
+    finally:
+        # Archived once the results are saved, responses the module failed to save included so that they can be
+        # replayed. Errors returned by the vendor are not worth replaying.
+        if not analysis_module.in_error:
+            archive_response(request, handler.unique_identifier(), analysis_module.vendor_response)
+
+
+def get_replayed_module(handler, recorded: VendorResponse) -> AnalysisModule:
+    """
+    Build an analysis module fed with a recorded vendor response instead of calling the vendor.
+    """
+    analysis_module: AnalysisModule = handler(recorded.request, {})
+    analysis_module.vendor_response = load_response(recorded)
+    return analysis_module
+
+
+def _replay_module(request: Request, handler) -> str:
+    recorded = (
+        VendorResponse.objects.select_related("request__super_type", "request__type")
+        .filter(
+            module=handler.unique_identifier(),
+            request__in=Request.objects.for_value(request.value).filter(
+                super_type=request.super_type, type=request.type
+            ),
+        )
+        .first()
+    )
+    if not recorded:
+        logger.error(f"No recorded response of module {handler.unique_identifier()} to replay")
+        return Request.Status.FAILED
+    recorded.request = request
+    get_replayed_module(handler, recorded).save_results()
+    return Request.Status.SUCCEEDED
+
+
+def launch_module(request: Request, handler, replay: bool = False) -> str:
+    """
+    Run an analysis module and save its results. A module whose vendor rate limit has been reached is rescheduled
+    for when its quota allows it.
+    :param replay: feed the module with its latest recorded response for the requested value instead of calling the
+    vendor
+    :return: the status of the module
+    """
+    try:
+        if replay:
+            return _replay_module(request, handler)
+        analysis_module = _prepare_module(request, handler)
+        if not analysis_module:
+            return Request.Status.FAILED
+        analysis_module.execute_request()
+        _save_results(request, handler, analysis_module)
+        return Request.Status.SUCCEEDED
+    except RateLimited as e:
+        _reschedule_module(request, handler, e.retry_in)
+        return Request.Status.ENQUEUED
     except Exception as e:
         logger.exception(e)
-        return False
+        return Request.Status.FAILED
 
 
-def handle_request(request_id: str):
-    request = Request.objects.get(id=request_id)
-    request.status = Request.Status.PROCESSING
-    request.save()
-    loader = ModulesLoader()
-    modules = loader.get_candidate_classes(request)
-    success = False
-    for module in modules:
-        success |= launch_module(request, module)
-    if success:
+async def _in_thread(func, *args):
+    """
+    Run a function accessing the database in a thread, each thread has its own database connection.
+    """
+    def run():
+        try:
+            return func(*args)
+        finally:
+            connection.close()
+    return await asyncio.to_thread(run)
+
+
+async def launch_module_async(request: Request, handler, replay: bool = False) -> str:
+    try:
+        if replay:
+            return await _in_thread(_replay_module, request, handler)
+        analysis_module = await _in_thread(_prepare_module, request, handler)
+        if not analysis_module:
+            return Request.Status.FAILED
+        await analysis_module.execute_request_async()
+        saving = asyncio.ensure_future(_in_thread(_save_results, request, handler, analysis_module))
+        try:
+            await asyncio.shield(saving)
+        except asyncio.CancelledError:
+            # The thread saving the results cannot be interrupted, the module is reported with the outcome of the
+            # save rather than as cancelled while its results are still being written
+            await saving
+        return Request.Status.SUCCEEDED
+    except RateLimited as e:
+        await _in_thread(_reschedule_module, request, handler, e.retry_in)
+        return Request.Status.ENQUEUED
+    except Exception as e:
+        logger.exception(e)
+        return Request.Status.FAILED
+
+
+_worker_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _get_worker_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop of the worker process. It outlives the requests so that the pooled asynchronous clients bound to it
+    keep their connections alive from one request to another.
+    """
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+    return _worker_loop
+
+
+async def _run_modules_async(request: Request, modules, replay: bool) -> dict[str, str]:
+    semaphore = asyncio.Semaphore(max(1, settings.THREATR_MODULES_CONCURRENCY))
+
+    async def run(module):
+        async with semaphore:
+            return await launch_module_async(request, module, replay)
+
+    tasks = {asyncio.create_task(run(module)): module for module in modules}
+    done, pending = await asyncio.wait(tasks, timeout=settings.THREATR_MODULES_DEADLINE)
+    modules_status = {}
+    for task in done:
+        modules_status[tasks[task].unique_identifier()] = task.result()
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in pending:
+        if task.cancelled():
+            logger.error(f"Module {tasks[task].unique_identifier()} did not complete before the deadline")
+            modules_status[tasks[task].unique_identifier()] = Request.Status.CANCELLED
+        else:
+            # Module saving its results when the deadline was reached
+            modules_status[tasks[task].unique_identifier()] = task.result()
+    return modules_status
+
+
+def run_modules(request: Request, modules, replay: bool = False) -> dict[str, str]:
+    """
+    Run the given analysis modules on the event loop of the worker, at most THREATR_MODULES_CONCURRENCY of them at
+    once. Modules still running once THREATR_MODULES_DEADLINE is reached are cancelled and reported as such, unless
+    they are already saving their results, the save is then awaited. Modules rescheduled because of the rate limit
+    of their vendor are reported as enqueued.
+    :return: the status of each module
+    """
+    if not modules:
+        return {}
+    return _get_worker_loop().run_until_complete(_run_modules_async(request, modules, replay))
+
+
+def _complete_request(request: Request):
+    """
+    Update the status of a request from the status of its modules. The request is kept processing as long as some
+    modules are rescheduled and none has succeeded yet.
+    """
+    modules_status = request.modules_status.values()
+    if Request.Status.SUCCEEDED in modules_status:
+        root_entities = Entity.objects.filter(
+            name=request.value, super_type=request.super_type, type=request.type
+        ).values_list("id", flat=True)
+        try:
+            compact_events(list(root_entities))
+        except Exception as e:
+            logger.exception(e)
         request.status = Request.Status.SUCCEEDED
+    elif Request.Status.ENQUEUED in modules_status:
+        request.status = Request.Status.PROCESSING
     else:
         request.status = Request.Status.FAILED
     request.save()
+    publish_request_status(request)
+    # New data may have been written for the requested entity
+    ResultCache.invalidate(request.value, request.super_type_id, request.type.short_name)
+    if request.status == Request.Status.SUCCEEDED:
+        try:
+            enqueue_pivots(request)
+        except Exception as e:
+            logger.exception(e)
+
+
+def handle_request(request_id: str, replay: bool = False):
+    request = Request.objects.select_related("super_type", "type").get(id=request_id)
+    request.status = Request.Status.PROCESSING
+    request.save()
+    publish_request_status(request)
+    loader = ModulesLoader()
+    modules = loader.get_candidate_classes(request)
+    request.modules_status = run_modules(request, list(modules), replay)
+    _complete_request(request)
+
+
+def handle_pivot(request_id: str):
+    """
+    Run a pivot once its delay has elapsed, unless a lookup of the same value has already promoted and run it.
+    """
+    if Request.objects.filter(id=request_id, status=Request.Status.CREATED).update(status=Request.Status.ENQUEUED):
+        handle_request(request_id)
+
+
+def retry_module(request_id: str, module_identifier: str):
+    """
+    Run again a module rescheduled because of the rate limit of its vendor.
+    """
+    request = Request.objects.select_related("super_type", "type").filter(id=request_id).first()
+    if not request:
+        return
+    handler = registry.get_module(module_identifier)
+    if not handler:
+        logger.error(f"Unknown module {module_identifier}")
+        return
+    module_status = launch_module(request, handler)
+    with transaction.atomic():
+        # Other modules of the request may complete concurrently
+        request = Request.objects.select_for_update().select_related("super_type", "type").get(id=request_id)
+        request.modules_status[module_identifier] = module_status
+        _complete_request(request)
+
+
+def fail_stale_requests() -> int:
+    """
+    Mark as failed the requests in flight for longer than THREATR_REQUEST_STALE_AFTER, e.g. whose worker has been
+    killed, so that they no longer hold the unique constraint on the requests in flight for their value.
+    :return: the number of failed requests
+    """
+    with transaction.atomic():
+        stale = list(Request.objects.stale().select_for_update(skip_locked=True))
+        Request.objects.filter(id__in=[request.id for request in stale]).update(status=Request.Status.FAILED)
+        for request in stale:
+            request.status = Request.Status.FAILED
+            publish_request_status(request)
+    if stale:
+        logger.warning(f"Failed {len(stale)} requests in flight for more than {settings.THREATR_REQUEST_STALE_AFTER}s")
+    return len(stale)
+
+
+def purge_expired_requests(max_age: int | None = None, batch_size: int | None = None) -> int:
+    """
+    Delete the requests older than the given number of days in bounded batches so that
+    no long-running transaction nor lock is held on the requests table.
+    :return: the number of deleted requests
+    """
+    if max_age is None:
+        max_age = settings.THREATR_REQUEST_RETENTION_DAYS
+    if batch_size is None:
+        batch_size = settings.THREATR_REQUEST_RETENTION_BATCH_SIZE
+    time_threshold = timezone.now() - timedelta(days=max_age)
+    deleted = 0
+    while True:
+        expired_ids = list(
+            Request.objects.filter(created_at__lte=time_threshold)
+            .order_by()
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not expired_ids:
+            break
+        Request.objects.filter(id__in=expired_ids).delete()
+        deleted += len(expired_ids)
+    logger.info(f"Purged {deleted} requests older than {max_age} days")
+    return deleted
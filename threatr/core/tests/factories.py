@@ -0,0 +1,83 @@
+import uuid
+from datetime import timedelta
+
+from django.utils import timezone
+from factory import Faker, LazyAttribute, SelfAttribute, Sequence, SubFactory
+from factory.django import DjangoModelFactory
+
+from threatr.core.models import (
+    Entity,
+    EntityRelation,
+    EntitySuperType,
+    EntityType,
+    Event,
+    Request,
+    VendorCredentials,
+)
+
+
+class EntitySuperTypeFactory(DjangoModelFactory):
+    short_name = "OBSERVABLE"
+    name = LazyAttribute(lambda o: o.short_name.title())
+
+    class Meta:
+        model = EntitySuperType
+        django_get_or_create = ["short_name"]
+
+
+class EntityTypeFactory(DjangoModelFactory):
+    short_name = "DOMAIN"
+    name = LazyAttribute(lambda o: o.short_name.title())
+    super_type = SubFactory(EntitySuperTypeFactory)
+
+    class Meta:
+        model = EntityType
+        django_get_or_create = ["short_name", "super_type"]
+
+
+class EntityFactory(DjangoModelFactory):
+    name = Faker("domain_name")
+    type = SubFactory(EntityTypeFactory)
+    super_type = SelfAttribute("type.super_type")
+
+    class Meta:
+        model = Entity
+
+
+class EntityRelationFactory(DjangoModelFactory):
+    name = "resolves to"
+    obj_from = SubFactory(EntityFactory)
+    obj_to = SubFactory(EntityFactory)
+
+    class Meta:
+        model = EntityRelation
+
+
+class EventFactory(DjangoModelFactory):
+    name = Sequence(lambda n: f"A 10.0.0.{n}")
+    type = SubFactory(EntityTypeFactory, short_name="PASSIVE_DNS", super_type__short_name="EVENT")
+    first_seen = LazyAttribute(lambda o: timezone.now() - timedelta(days=2))
+    last_seen = LazyAttribute(lambda o: o.first_seen + timedelta(days=1))
+    count = 1
+    involved_entity = SubFactory(EntityFactory)
+
+    class Meta:
+        model = Event
+
+
+class RequestFactory(DjangoModelFactory):
+    value = Faker("domain_name")
+    type = SubFactory(EntityTypeFactory)
+    super_type = SelfAttribute("type.super_type")
+
+    class Meta:
+        model = Request
+
+
+class VendorCredentialsFactory(DjangoModelFactory):
+    vendor = "vt"
+    credentials = LazyAttribute(lambda o: {"api_key": str(uuid.uuid4())})
+    last_usage = LazyAttribute(lambda o: timezone.now() - timedelta(hours=1))
+
+    class Meta:
+        model = VendorCredentials
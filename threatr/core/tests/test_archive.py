@@ -0,0 +1,40 @@
+import pytest
+
+from threatr.core.archive import evict_responses, load_response, store_response
+from threatr.core.models import VendorResponse
+from threatr.core.tests.factories import RequestFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def archive_root(settings, tmp_path):
+    settings.THREATR_ARCHIVE_ROOT = str(tmp_path)
+    return tmp_path
+
+
+def test_identical_responses_share_the_same_file(archive_root):
+    request = RequestFactory()
+    response = {"data": {"attributes": {"size": 42}}}
+
+    first = store_response(str(request.id), "vt", response)
+    second = store_response(str(request.id), "vt", dict(response))
+
+    assert first.digest == second.digest
+    assert len(list(archive_root.glob("*/*.json.zst"))) == 1
+    assert list(request.vendor_responses.all()) == [second, first]
+    assert load_response(first) == response
+
+
+def test_evict_oldest_responses(archive_root):
+    request = RequestFactory()
+    responses = [store_response(str(request.id), "shodan", {"data": "x" * 10 ** 6, "n": n}) for n in range(3)]
+    # Make each compressed response large enough for only two of them to fit in 1 MB
+    VendorResponse.objects.update(size=400 * 1024)
+
+    assert evict_responses(max_size=1) == 1
+    assert list(VendorResponse.objects.all()) == responses[:0:-1]
+    assert len(list(archive_root.glob("*/*.json.zst"))) == 2
+    # An explicit zero is not the default size
+    assert evict_responses(max_size=0) == 2
+    assert not list(archive_root.glob("*/*.json.zst"))
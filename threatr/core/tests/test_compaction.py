@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from threatr.core.compaction import compact_events
+from threatr.core.models import Event
+from threatr.core.tests.factories import EntityFactory, EventFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def day(n: int) -> datetime:
+    return datetime(2024, 1, 1, 12, tzinfo=pytz.UTC) + timedelta(days=n)
+
+
+def test_overlapping_events_are_merged():
+    entity = EntityFactory()
+    kept = EventFactory(name="A 10.0.0.1", involved_entity=entity, first_seen=day(0), last_seen=day(3), count=2)
+    EventFactory(name="A 10.0.0.1", involved_entity=entity, first_seen=day(2), last_seen=day(5), count=3)
+    EventFactory(name="A 10.0.0.1", involved_entity=entity, first_seen=day(5), last_seen=day(6), count=1)
+    distinct = EventFactory(name="A 10.0.0.1", involved_entity=entity, first_seen=day(10), last_seen=day(11))
+
+    assert compact_events([entity.id]) == 2
+
+    events = Event.objects.filter(involved_entity=entity).order_by("first_seen")
+    assert list(events) == [kept, distinct]
+    kept.refresh_from_db()
+    assert kept.last_seen == day(6)
+    assert kept.count == 6
+
+
+def test_events_of_other_entities_are_left_untouched():
+    entity = EntityFactory()
+    other = EntityFactory()
+    for involved_entity in [entity, other]:
+        EventFactory(name="A 10.0.0.1", involved_entity=involved_entity, first_seen=day(0), last_seen=day(3))
+        EventFactory(name="A 10.0.0.1", involved_entity=involved_entity, first_seen=day(1), last_seen=day(2))
+
+    assert compact_events([entity.id]) == 1
+    assert Event.objects.filter(involved_entity=other).count() == 2
+    assert compact_events() == 1
+
+
+def test_full_compaction_runs_in_batches():
+    entities = [EntityFactory() for _ in range(5)]
+    for involved_entity in entities:
+        EventFactory(name="A 10.0.0.1", involved_entity=involved_entity, first_seen=day(0), last_seen=day(3))
+        EventFactory(name="A 10.0.0.1", involved_entity=involved_entity, first_seen=day(1), last_seen=day(2))
+
+    assert compact_events(batch_size=2) == 5
+    assert Event.objects.count() == 5
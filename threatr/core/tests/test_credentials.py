@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from threatr.core.models import VendorCredentials
+from threatr.core.tests.factories import VendorCredentialsFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_lease_rotates_credentials():
+    older = VendorCredentialsFactory(last_usage=timezone.now() - timedelta(days=1))
+    newer = VendorCredentialsFactory()
+    VendorCredentialsFactory(vendor="shodan", last_usage=timezone.now() - timedelta(days=2))
+
+    assert VendorCredentials.lease("vt") == older
+    assert VendorCredentials.lease("vt") == newer
+    assert VendorCredentials.lease("vt") == older
+    older.refresh_from_db()
+    assert older.usage_count == 2
+
+
+def test_lease_skips_credentials_cooling_down():
+    VendorCredentialsFactory(cooldown=timedelta(hours=2))
+    available = VendorCredentialsFactory(last_usage=timezone.now(), cooldown=timedelta(0))
+
+    assert VendorCredentials.lease("vt") == available
+
+
+def test_lease_without_available_credentials():
+    cooling_down = VendorCredentialsFactory(last_usage=timezone.now(), cooldown=timedelta(minutes=1))
+
+    assert VendorCredentials.lease("vt") is None
+    assert VendorCredentials.next_availability("vt") == cooling_down.last_usage + timedelta(minutes=1)
+    assert VendorCredentials.next_availability("shodan") is None
+
+
+def test_release_does_not_record_the_usage():
+    last_usage = timezone.now() - timedelta(days=1)
+    credentials = VendorCredentialsFactory(last_usage=last_usage)
+
+    VendorCredentials.lease("vt").release()
+    credentials.refresh_from_db()
+    assert credentials.last_usage == last_usage
+    assert credentials.usage_count == 0
+
+    # Leased again in the meantime
+    leased = VendorCredentials.lease("vt")
+    VendorCredentials.objects.filter(id=leased.id).update(last_usage=timezone.now())
+    leased.release()
+    credentials.refresh_from_db()
+    assert credentials.last_usage > last_usage
+    assert credentials.usage_count == 0
@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from threatr.core.api.generic import RequestView
+from threatr.core.freshness import get_freshness
+from threatr.core.loader import ModulesLoader
+from threatr.core.models import Request
+from threatr.core.tests.factories import EntityFactory, RequestFactory
+from threatr.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+
+class DailyModule:
+    @classmethod
+    def unique_identifier(cls):
+        return "daily"
+
+    @classmethod
+    def freshness(cls):
+        return timedelta(days=1)
+
+
+class WeeklyModule(DailyModule):
+    @classmethod
+    def unique_identifier(cls):
+        return "weekly"
+
+    @classmethod
+    def freshness(cls):
+        return timedelta(days=7)
+
+
+@pytest.fixture(autouse=True)
+def modules(monkeypatch):
+    monkeypatch.setattr(ModulesLoader, "get_candidate_classes", lambda self, request: {DailyModule, WeeklyModule})
+
+
+def enriched(entity, days: int, modules_status: dict):
+    request = RequestFactory(
+        value=entity.name, type=entity.type, status=Request.Status.SUCCEEDED, modules_status=modules_status
+    )
+    Request.objects.filter(id=request.id).update(created_at=timezone.now() - timedelta(days=days))
+
+
+def test_fresh_data():
+    entity = EntityFactory()
+    enriched(entity, 0, {"daily": "SUCCEEDED", "weekly": "SUCCEEDED"})
+
+    enriched_at, stale, refresh_due = get_freshness(entity.name, entity.super_type, entity.type)
+    assert enriched_at is not None
+    assert not stale
+    assert not refresh_due
+
+
+def test_stale_data_of_a_single_module(settings):
+    entity = EntityFactory()
+    enriched(entity, 2, {"daily": "SUCCEEDED", "weekly": "SUCCEEDED"})
+
+    _, stale, refresh_due = get_freshness(entity.name, entity.super_type, entity.type)
+    assert stale
+    assert refresh_due
+
+    # The freshness of a module can be overridden
+    settings.THREATR_MODULES_FRESHNESS = {"daily": 72}
+    _, stale, _ = get_freshness(entity.name, entity.super_type, entity.type)
+    assert not stale
+
+
+def test_failing_modules_are_not_accounted_for():
+    entity = EntityFactory()
+    enriched(entity, 10, {"daily": "FAILED", "weekly": "SUCCEEDED"})
+    enriched(entity, 2, {"daily": "FAILED", "weekly": "FAILED"})
+
+    _, stale, refresh_due = get_freshness(entity.name, entity.super_type, entity.type)
+    assert stale
+    assert refresh_due
+    enriched(entity, 0, {"daily": "FAILED", "weekly": "SUCCEEDED"})
+    _, stale, _ = get_freshness(entity.name, entity.super_type, entity.type)
+    assert not stale
+
+
+def test_refresh_is_not_enqueued_twice():
+    entity = EntityFactory()
+    enriched(entity, 2, {"daily": "SUCCEEDED"})
+    RequestFactory(value=entity.name, type=entity.type, status=Request.Status.PROCESSING)
+
+    _, stale, refresh_due = get_freshness(entity.name, entity.super_type, entity.type)
+    assert stale
+    assert not refresh_due
+
+
+def test_stale_results_are_served_while_refreshed(user: User, settings):
+    settings.THREATR_RESULT_CACHE_TTL = 0
+    entity = EntityFactory()
+    enriched(entity, 2, {"daily": "SUCCEEDED"})
+    request = APIRequestFactory().post(
+        "/fake-url/",
+        {"value": entity.name, "super_type": entity.super_type_id, "type": entity.type.short_name},
+        format="json",
+    )
+    force_authenticate(request, user=user)
+
+    response = RequestView.as_view({"post": "create"})(request)
+    assert response.status_code == 200
+    assert response["X-Threatr-Freshness"] == "stale"
+    assert "X-Threatr-Enriched-At" in response
+    refresh = Request.objects.get(id=response["X-Threatr-Refresh"])
+    assert refresh.status == Request.Status.ENQUEUED
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from threatr.core.api.generic import EntityView
+from threatr.core.graph import get_neighbourhood
+from threatr.core.tests.factories import EntityFactory, EntityRelationFactory, EntityTypeFactory
+from threatr.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def chain():
+    # root -> a -> b -> c, c pointing back to the root
+    entities = [EntityFactory() for _ in range(4)]
+    for obj_from, obj_to in zip(entities, entities[1:]):
+        EntityRelationFactory(obj_from=obj_from, obj_to=obj_to)
+    EntityRelationFactory(obj_from=entities[-1], obj_to=entities[0], name="communicates with")
+    return entities
+
+
+def test_neighbourhood_depth(chain):
+    root, a, b, c = chain
+
+    depths, nodes_truncated, fan_out_truncated = get_neighbourhood(root.id, 1, 10, 10)
+    assert depths == {root.id: 0, a.id: 1, c.id: 1}
+    assert not nodes_truncated
+    assert not fan_out_truncated
+
+    depths, _, _ = get_neighbourhood(root.id, 3, 10, 10)
+    assert depths == {root.id: 0, a.id: 1, b.id: 2, c.id: 1}
+
+
+def test_neighbourhood_filters(chain):
+    root, a, b, c = chain
+
+    depths, _, _ = get_neighbourhood(root.id, 3, 10, 10, relation_names=["resolves to"])
+    assert depths == {root.id: 0, a.id: 1, b.id: 2, c.id: 3}
+
+    ip = EntityFactory(type=EntityTypeFactory(short_name="IPV4"))
+    EntityRelationFactory(obj_from=root, obj_to=ip)
+    depths, _, _ = get_neighbourhood(root.id, 3, 10, 10, type_ids=[ip.type_id])
+    assert depths == {root.id: 0, ip.id: 1}
+
+
+def test_neighbourhood_limits():
+    root = EntityFactory()
+    neighbours = sorted(EntityRelationFactory(obj_from=root).obj_to_id for _ in range(5))
+
+    depths, nodes_truncated, fan_out_truncated = get_neighbourhood(root.id, 1, 2, 10)
+    # The neighbours followed are always the same ones
+    assert depths == {root.id: 0, neighbours[0]: 1, neighbours[1]: 1}
+    assert not nodes_truncated
+    assert fan_out_truncated
+
+    depths, nodes_truncated, fan_out_truncated = get_neighbourhood(root.id, 1, 10, 4)
+    assert len(depths) == 4
+    assert nodes_truncated
+    assert not fan_out_truncated
+
+
+def test_neighbourhood_visits_entities_once():
+    # Every entity of a level is related to every entity of the next one, the paths grow as 3^depth
+    levels = [[EntityFactory()]] + [[EntityFactory() for _ in range(3)] for _ in range(3)]
+    for upper, lower in zip(levels, levels[1:]):
+        for obj_from in upper:
+            for obj_to in lower:
+                EntityRelationFactory(obj_from=obj_from, obj_to=obj_to)
+
+    with CaptureQueriesContext(connection) as context:
+        depths, nodes_truncated, fan_out_truncated = get_neighbourhood(levels[0][0].id, 3, 10, 100)
+
+    assert len(context.captured_queries) == 3
+    assert depths == {entity.id: depth for depth, level in enumerate(levels) for entity in level}
+    assert not nodes_truncated
+    assert not fan_out_truncated
+
+
+def test_neighbourhood_view(user: User, chain):
+    root, a, b, c = chain
+    request = APIRequestFactory().get("/fake-url/", {"depth": 2, "relation": ["resolves to"]})
+    force_authenticate(request, user=user)
+
+    response = EntityView.as_view({"get": "neighbourhood"})(request, pk=str(root.id))
+    assert response.status_code == 200
+    result = json.loads(b"".join(response.streaming_content))
+    assert result["root_entity"]["id"] == str(root.id)
+    assert not result["truncated"]
+    assert result["truncation"] == {"max_nodes": False, "fan_out": False}
+    assert {(e["id"], e["depth"]) for e in result["entities"]} == {(str(a.id), 1), (str(b.id), 2)}
+    assert len(result["relations"]) == 2
+
+
+def test_neighbourhood_view_max_depth(user: User, settings):
+    settings.THREATR_NEIGHBOURHOOD_MAX_DEPTH = 2
+    request = APIRequestFactory().get("/fake-url/", {"depth": 3})
+    force_authenticate(request, user=user)
+
+    response = EntityView.as_view({"get": "neighbourhood"})(request, pk=str(EntityFactory().id))
+    assert response.status_code == 400
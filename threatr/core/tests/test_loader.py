@@ -0,0 +1,99 @@
+import json
+from datetime import timedelta
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+from django.conf import settings as django_settings
+
+from threatr.core import loader
+from threatr.core.loader import ModuleRegistry
+from threatr.core.management.commands.benchmark_startup import VENDOR_SDKS
+
+
+class DomainModule:
+    @classmethod
+    def unique_identifier(cls):
+        return "domain"
+
+    @classmethod
+    def supported_types(cls):
+        return {"observable": ["domain", "hostname"]}
+
+
+class IpModule(DomainModule):
+    @classmethod
+    def unique_identifier(cls):
+        return "ip"
+
+    @classmethod
+    def supported_types(cls):
+        return {"observable": ["ipv4", "domain"]}
+
+
+def test_candidates_are_indexed_by_type(settings):
+    settings.THREATR_ANALYSIS_MODULES = [
+        "threatr.core.tests.test_loader.IpModule",
+        "threatr.core.tests.test_loader.MissingModule",
+    ]
+    registry = ModuleRegistry()
+    registry.register(DomainModule)
+    registry.load()
+
+    assert registry.get_candidates("OBSERVABLE", "DOMAIN") == (DomainModule, IpModule)
+    assert registry.get_candidates("observable", "ipv4") == (IpModule,)
+    assert registry.get_candidates("OBSERVABLE", "URL") == ()
+    assert registry.get_module("ip") is IpModule
+    assert sorted(registry.get_supported_types()["observable"]) == ["domain", "hostname", "ipv4"]
+
+
+def test_entry_points_are_registered_from_their_manifest(settings, monkeypatch):
+    settings.THREATR_ANALYSIS_MODULES = []
+    manifests = {
+        "threatr_example.manifest:MANIFEST": {
+            # Not importable, the module must not be imported to be registered
+            "module": "threatr_example.module.ExampleModule",
+            "unique_identifier": "example",
+            "vendor": "Example",
+            "supported_types": {"observable": ["url"]},
+            "freshness": 12,
+        },
+        "threatr_domain.manifest:MANIFEST": {
+            "module": "threatr.core.tests.test_loader.DomainModule",
+            "unique_identifier": "domain",
+            "vendor": "Domain",
+            "supported_types": {"observable": ["domain"]},
+        },
+    }
+    monkeypatch.setattr(loader, "entry_points", lambda group: [
+        SimpleNamespace(value=value, load=lambda manifest=manifest: manifest) for value, manifest in manifests.items()
+    ])
+    registry = ModuleRegistry()
+    registry.load()
+
+    example = registry.get_module("example")
+    assert registry.get_candidates("observable", "url") == (example,)
+    assert example.vendor() == "Example"
+    assert example.freshness() == timedelta(hours=12)
+    with pytest.raises(ImportError):
+        example.rate_limit()
+    # The module is imported once executed
+    assert isinstance(registry.get_module("domain")(), DomainModule)
+
+
+def test_modules_metadata_does_not_import_vendor_sdks():
+    # In a fresh interpreter, the test session may already have imported the SDKs
+    code = (
+        "import json, sys, django; django.setup(); from threatr.core.loader import registry; "
+        "print(json.dumps([[m.unique_identifier(), m.vendor(), m.description(), m.supported_types()] "
+        "for m in registry.modules()])); print(json.dumps([m for m in sys.argv[1:] if m in sys.modules]))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code, *VENDOR_SDKS], capture_output=True, check=True, cwd=django_settings.BASE_DIR,
+        text=True,
+    ).stdout.strip().splitlines()
+
+    modules, imported_sdks = json.loads(output[-2]), json.loads(output[-1])
+    assert len(modules) == len(django_settings.THREATR_ANALYSIS_MODULES)
+    assert imported_sdks == []
@@ -0,0 +1,19 @@
+import pytest
+
+from threatr.core.tests.factories import EntityFactory, EntityRelationFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_get_relations():
+    root = EntityFactory()
+    relations = [
+        EntityRelationFactory(obj_from=root),
+        EntityRelationFactory(obj_to=root),
+        EntityRelationFactory(obj_from=root, obj_to=root),
+    ]
+    EntityRelationFactory()
+
+    assert sorted(r.id for r in root.get_relations("obj_from__type", "obj_to__type")) == sorted(
+        r.id for r in relations
+    )
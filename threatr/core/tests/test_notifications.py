@@ -0,0 +1,96 @@
+import asyncio
+import json
+import uuid
+
+from config import websocket
+from threatr.core.notifications import get_request_event, request_events
+
+
+class FakeSocket:
+    def __init__(self, messages: list):
+        self.incoming = asyncio.Queue()
+        for message in [{"type": "websocket.connect"}] + messages:
+            self.incoming.put_nowait(message)
+        self.sent = []
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        if message["type"] == "websocket.send":
+            self.sent.append(json.loads(message["text"]) if message["text"] != "pong!" else message["text"])
+
+    def close(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect"})
+
+
+def text(data) -> dict:
+    return {"type": "websocket.receive", "text": json.dumps(data)}
+
+
+def run(socket: FakeSocket, until):
+    async def main():
+        application = asyncio.create_task(websocket.websocket_application({}, socket.receive, socket.send))
+        while not until():
+            await asyncio.sleep(0.01)
+        socket.close()
+        await application
+
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
+
+
+def test_subscriptions_require_authentication():
+    socket = FakeSocket([{"type": "websocket.receive", "text": "ping"}, text({"action": "subscribe", "request": "x"})])
+
+    run(socket, lambda: len(socket.sent) == 2)
+
+    assert socket.sent == ["pong!", {"type": "error", "error": "Authentication required"}]
+
+
+def test_status_changes_are_pushed_until_completion(monkeypatch):
+    request_id = str(uuid.uuid4())
+
+    async def authenticate(token):
+        return object() if token == "valid" else None
+
+    async def get_event(rid):
+        return get_request_event(rid, "ENQUEUED", {})
+
+    monkeypatch.setattr(websocket, "_authenticate", authenticate)
+    monkeypatch.setattr(websocket, "_get_request_event", get_event)
+    socket = FakeSocket([
+        text({"action": "authenticate", "token": "invalid"}),
+        text({"action": "authenticate", "token": "valid"}),
+        text({"action": "subscribe", "request": request_id}),
+    ])
+
+    dispatched = []
+
+    def published():
+        # Published by the workers through Redis once the subscription is made
+        if len(socket.sent) == 3 and not dispatched:
+            dispatched.append(True)
+            request_events.dispatch(request_id, get_request_event(request_id, "PROCESSING", {}))
+            request_events.dispatch(request_id, get_request_event(request_id, "SUCCEEDED", {"vt": "SUCCEEDED"}))
+        return len(socket.sent) == 5
+
+    run(socket, published)
+
+    assert socket.sent[0]["type"] == "error"
+    assert socket.sent[1] == {"type": "authenticated"}
+    assert [event["status"] for event in socket.sent[2:]] == ["ENQUEUED", "PROCESSING", "SUCCEEDED"]
+    # Completed requests are unsubscribed from
+    assert request_id not in request_events._queues
+
+
+def test_database_access_closes_old_connections(monkeypatch):
+    calls = []
+    monkeypatch.setattr(websocket, "close_old_connections", lambda: calls.append("close"))
+
+    @websocket._database_sync_to_async
+    def query():
+        calls.append("query")
+        return 42
+
+    assert asyncio.run(query()) == 42
+    assert calls == ["close", "query", "close"]
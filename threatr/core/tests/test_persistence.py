@@ -0,0 +1,121 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+import pytz
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from threatr.core.models import Entity, EntityRelation, Event
+from threatr.core.persistence import ResultsWriter
+from threatr.core.tests.factories import EntityFactory, EntityTypeFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def domain_type():
+    return EntityTypeFactory(short_name="DOMAIN")
+
+
+@pytest.fixture
+def passive_dns_type():
+    return EntityTypeFactory(short_name="PASSIVE_DNS", super_type__short_name="EVENT")
+
+
+def write_graph(domain_type, passive_dns_type, size: int):
+    writer = ResultsWriter("Vendor")
+    root = writer.entity("example.com", domain_type.super_type, domain_type, attributes={"tags": "a,b"})
+    for i in range(size):
+        sub_domain = writer.entity(f"{i}.example.com", domain_type.super_type, domain_type)
+        writer.relation("subdomain of", sub_domain, root)
+        writer.event(
+            f"A 10.0.0.{i}",
+            passive_dns_type,
+            first_seen=datetime(2024, 1, 1, tzinfo=pytz.UTC),
+            last_seen=datetime(2024, 1, 2, tzinfo=pytz.UTC),
+            involved_entity=root,
+            count=i,
+        )
+    return writer.flush()
+
+
+def test_flush_writes_everything_in_a_fixed_number_of_queries(domain_type, passive_dns_type):
+    with CaptureQueriesContext(connection) as small:
+        write_graph(domain_type, passive_dns_type, 2)
+    with CaptureQueriesContext(connection) as large:
+        entities, relations, events = write_graph(domain_type, passive_dns_type, 50)
+
+    assert len(large.captured_queries) == len(small.captured_queries)
+    assert Entity.objects.count() == 51
+    assert EntityRelation.objects.count() == 50
+    assert Event.objects.count() == 50
+    assert {e.id for e in entities} == set(Entity.objects.values_list("id", flat=True))
+    assert {r.id for r in relations} == set(EntityRelation.objects.values_list("id", flat=True))
+    assert {e.id for e in events} == set(Event.objects.values_list("id", flat=True))
+    # The entities having new relations or events are stamped
+    assert not Entity.objects.filter(graph_updated_at__isnull=True).exists()
+
+
+def test_existing_entities_are_merged(domain_type):
+    existing = EntityFactory(
+        name="example.com",
+        type=domain_type,
+        description="Existing description",
+        attributes={"source_vendor": "Other", "tags": "a", "asn": "1"},
+    )
+    writer = ResultsWriter("Vendor")
+    root = writer.entity(
+        "example.com", domain_type.super_type, domain_type,
+        attributes={"tags": "b", "asn": "2"},
+        description="New description",
+    )
+    threat = writer.entity("Threat", domain_type.super_type, domain_type)
+    root.attributes["associated_threat"] = threat
+    writer.flush()
+
+    existing.refresh_from_db()
+    assert root.id == existing.id
+    assert existing.description == "Existing description"
+    assert existing.attributes == {
+        "source_vendor": "Other",
+        "tags": "a,b",
+        "asn": "2",
+        "associated_threat": str(threat.id),
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_writers_merge_their_attributes(domain_type):
+    existing = EntityFactory(name="example.com", type=domain_type, attributes={"tags": "a"})
+    first_flushed = threading.Event()
+
+    def write(vendor: str, attributes: dict, before_commit=None):
+        try:
+            with transaction.atomic():
+                writer = ResultsWriter(vendor)
+                writer.entity("example.com", domain_type.super_type, domain_type, attributes=attributes)
+                writer.flush()
+                if before_commit:
+                    before_commit()
+        finally:
+            connection.close()
+
+    def hold():
+        first_flushed.set()
+        # Give the second writer the time to read the entity while the first one has not committed yet
+        time.sleep(0.5)
+
+    first = threading.Thread(target=write, args=("First", {"tags": "b", "asn": "1"}, hold))
+    first.start()
+    assert first_flushed.wait(timeout=5)
+    second = threading.Thread(target=write, args=("Second", {"tags": "c", "country": "FR"}))
+    second.start()
+    first.join()
+    second.join()
+
+    existing.refresh_from_db()
+    assert existing.attributes["asn"] == "1"
+    assert existing.attributes["country"] == "FR"
+    assert existing.attributes["tags"] == "a,b,c"
@@ -0,0 +1,110 @@
+import pytest
+from django_q.models import Schedule
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from threatr.core import tasks
+from threatr.core.api import generic
+from threatr.core.api.generic import RequestView
+from threatr.core.loader import ModulesLoader
+from threatr.core.models import Request
+from threatr.core.pivot import enqueue_pivots
+from threatr.core.tests.factories import EntityFactory, EntityRelationFactory, RequestFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def two_modules(monkeypatch):
+    # Every entity type is handled by two analysis modules
+    monkeypatch.setattr(ModulesLoader, "get_candidate_classes", lambda self, request: {"a", "b"})
+
+
+@pytest.fixture
+def discovered():
+    root = EntityFactory()
+    entities = [EntityRelationFactory(obj_from=root).obj_to for _ in range(3)]
+    return root, entities
+
+
+def test_pivots_are_scheduled(discovered):
+    root, entities = discovered
+    request = RequestFactory(
+        value=root.name, type=root.type, status=Request.Status.SUCCEEDED, pivot_depth=2, pivot_budget=100
+    )
+
+    assert enqueue_pivots(request) == 3
+
+    pivots = Request.objects.filter(pivot_root=request)
+    assert {p.value for p in pivots} == {e.name for e in entities}
+    assert all(p.pivot_depth == 1 for p in pivots)
+    assert all(p.status == Request.Status.CREATED for p in pivots)
+    assert Schedule.objects.filter(func="threatr.core.tasks.handle_pivot").count() == 3
+    request.refresh_from_db()
+    assert request.pivot_budget == 94
+
+
+def test_pivots_stop_once_the_budget_is_exhausted(discovered):
+    root, _ = discovered
+    request = RequestFactory(
+        value=root.name, type=root.type, status=Request.Status.SUCCEEDED, pivot_depth=1, pivot_budget=5
+    )
+
+    assert enqueue_pivots(request) == 2
+    request.refresh_from_db()
+    assert request.pivot_budget == 1
+
+
+def test_enriched_entities_are_not_pivoted(discovered):
+    root, entities = discovered
+    RequestFactory(value=entities[0].name, type=entities[0].type, status=Request.Status.SUCCEEDED)
+    request = RequestFactory(
+        value=root.name, type=root.type, status=Request.Status.SUCCEEDED, pivot_depth=1, pivot_budget=100
+    )
+
+    assert enqueue_pivots(request) == 2
+    # Pivots already created are not created again
+    assert enqueue_pivots(request) == 0
+
+
+def test_pivot_mode_is_opt_in(discovered):
+    root, _ = discovered
+    request = RequestFactory(value=root.name, type=root.type, status=Request.Status.SUCCEEDED)
+
+    assert enqueue_pivots(request) == 0
+
+
+@pytest.mark.parametrize("force", [True, False])
+def test_lookups_promote_pending_pivots(force, discovered, user, monkeypatch, django_capture_on_commit_callbacks):
+    root, entities = discovered
+    request = RequestFactory(
+        value=root.name, type=root.type, status=Request.Status.SUCCEEDED, pivot_depth=1, pivot_budget=100
+    )
+    enqueue_pivots(request)
+    pivot = Request.objects.get(pivot_root=request, value=entities[0].name)
+    enqueued = []
+    monkeypatch.setattr(generic, "async_task", lambda func, request_id: enqueued.append(request_id))
+    handled = []
+    monkeypatch.setattr(tasks, "handle_request", lambda request_id: handled.append(request_id))
+
+    lookup = APIRequestFactory().post(
+        "/fake-url/",
+        {"value": pivot.value, "super_type": pivot.super_type_id, "type": pivot.type.short_name, "force": force},
+        format="json",
+    )
+    force_authenticate(lookup, user=user)
+    with django_capture_on_commit_callbacks(execute=True):
+        response = RequestView.as_view({"post": "create"})(lookup)
+
+    if force:
+        # The lookup attaches to the pivot, which is run right away
+        assert response.data["id"] == str(pivot.id)
+    else:
+        # The results of the discovered entity are served while the pivot, run right away, refreshes them
+        assert response["X-Threatr-Refresh"] == str(pivot.id)
+    assert enqueued == [pivot.id]
+    pivot.refresh_from_db()
+    assert pivot.status == Request.Status.ENQUEUED
+    # The pivot is not run again once its delay has elapsed
+    tasks.handle_pivot(str(pivot.id))
+    assert handled == []
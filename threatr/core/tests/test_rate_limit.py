@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+
+from threatr.core import tasks
+from threatr.core.rate_limit import RateLimited, RateLimiter
+
+
+def test_acquire_takes_tokens_until_the_bucket_is_empty():
+    limiter = RateLimiter()
+
+    assert limiter.acquire("vt", "credentials", 2, 60) == 0
+    assert limiter.acquire("vt", "credentials", 2, 60) == 0
+    assert 0 < limiter.acquire("vt", "credentials", 2, 60) <= 30
+    # Each set of credentials has its own bucket
+    assert limiter.acquire("vt", "other credentials", 2, 60) == 0
+
+
+def test_throttle_waits_for_the_next_token():
+    limiter = RateLimiter()
+    limiter.acquire("shodan", "credentials", 1, 0.05)
+
+    limiter.throttle("shodan", "credentials", 1, 0.05, max_wait=1)
+
+
+def test_throttle_gives_up_after_max_wait():
+    limiter = RateLimiter()
+    limiter.acquire("vt", "credentials", 1, 60)
+
+    with pytest.raises(RateLimited) as e:
+        limiter.throttle("vt", "credentials", 1, 60, max_wait=1)
+    assert 59 < e.value.retry_in <= 60
+
+
+def test_rejected_requests_do_not_consume_the_vendor_quota(monkeypatch):
+    limiter = RateLimiter()
+    monkeypatch.setattr(tasks, "rate_limiter", limiter)
+    released = []
+    credentials = SimpleNamespace(id="credentials", credentials={}, release=lambda: released.append(True))
+    monkeypatch.setattr(tasks, "_lease_credentials", lambda handler: credentials)
+
+    class Module:
+        rejected = True
+
+        def __init__(self, request, credentials):
+            pass
+
+        @classmethod
+        def unique_identifier(cls):
+            return "vt"
+
+        @classmethod
+        def rate_limit(cls):
+            return 1, 60
+
+        def fail_fast(self):
+            return self.rejected
+
+    assert tasks._prepare_module(None, Module) is None
+    assert released == [True]
+    Module.rejected = False
+    assert isinstance(tasks._prepare_module(None, Module), Module)
+    # The token was still available for the accepted request
+    assert limiter.acquire("vt", "credentials", 1, 60) > 0
@@ -0,0 +1,337 @@
+import json
+import secrets
+import tracemalloc
+import uuid
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from threatr.core.api.generic import RequestView
+from threatr.core.models import Entity, Request
+from threatr.core.tests.factories import EntityFactory, EntityRelationFactory, EventFactory, RequestFactory
+from threatr.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+
+class TestExistingResults:
+    @pytest.fixture(autouse=True)
+    def disable_result_cache(self, settings):
+        settings.THREATR_RESULT_CACHE_TTL = 0
+
+    @staticmethod
+    def lookup(user: User, entity):
+        request = APIRequestFactory().post(
+            "/fake-url/",
+            {"value": entity.name, "super_type": entity.super_type_id, "type": entity.type.short_name},
+            format="json",
+        )
+        force_authenticate(request, user=user)
+        with CaptureQueriesContext(connection) as context:
+            response = RequestView.as_view({"post": "create"})(request)
+            assert response.status_code == 200
+            # The result document is read from the database while it is streamed
+            b"".join(response.streaming_content)
+        return len(context.captured_queries)
+
+    @staticmethod
+    def grow(root, size: int):
+        for _ in range(size):
+            EntityRelationFactory(obj_from=root)
+            EntityRelationFactory(obj_to=root)
+            EventFactory(involved_entity=root)
+
+    def test_query_count_does_not_depend_on_graph_size(self, user: User):
+        root = EntityFactory()
+        self.grow(root, 1)
+        # Load the entity types registry
+        self.lookup(user, root)
+        small_graph_queries = self.lookup(user, root)
+
+        self.grow(root, 25)
+        large_graph_queries = self.lookup(user, root)
+
+        assert large_graph_queries == small_graph_queries
+
+    def test_result_content(self, user: User):
+        root = EntityFactory()
+        self.grow(root, 3)
+        request = APIRequestFactory().post(
+            "/fake-url/",
+            {"value": root.name, "super_type": root.super_type_id, "type": root.type.short_name},
+            format="json",
+        )
+        force_authenticate(request, user=user)
+        response = RequestView.as_view({"post": "create"})(request)
+        result = json.loads(b"".join(response.streaming_content))
+        assert result["root_entity"]["id"] == str(root.id)
+        assert len(result["entities"]) == 6
+        assert len(result["relations"]) == 6
+        assert len(result["events"]) == 3
+
+    @staticmethod
+    def lookup_through_asgi(token: Token, entity) -> tuple[int, int, int]:
+        """
+        Look the entity up through the ASGI handler, as served in production, and return the size of the document,
+        the number of body messages sent and the peak of memory allocated while serving it.
+        """
+        body = json.dumps(
+            {"value": entity.name, "super_type": str(entity.super_type_id), "type": entity.type.short_name}
+        )
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/api/request/",
+            "raw_path": b"/api/request/",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"content-type", b"application/json"),
+                (b"authorization", f"Token {token.key}".encode()),
+            ],
+            "client": ("127.0.0.1", 1234),
+            "server": ("testserver", 80),
+        }
+        sent = {"size": 0, "messages": 0}
+
+        async def receive():
+            return {"type": "http.request", "body": body.encode(), "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                assert message["status"] == 200
+            elif message["type"] == "http.response.body" and message.get("body"):
+                # Only the size is kept, the test must not hold the document itself
+                sent["size"] += len(message["body"])
+                sent["messages"] += 1
+
+        tracemalloc.start()
+        try:
+            async_to_sync(ASGIHandler())(scope, receive, send)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return sent["size"], sent["messages"], peak
+
+    @pytest.mark.django_db(transaction=True)
+    def test_memory_is_bounded_through_asgi(self, user: User, settings):
+        settings.THREATR_RESULT_STREAMING_BUFFER_SIZE = 4 * 1024
+        settings.THREATR_RESULT_STREAMING_CHUNK_SIZE = 50
+        token = Token.objects.create(user=user)
+        root = EntityFactory()
+        self.grow(root, 10)
+        # Warm up the imports, the URL resolvers and the entity types registry
+        self.lookup_through_asgi(token, root)
+        small_size, _, small_peak = self.lookup_through_asgi(token, root)
+
+        self.grow(root, 400)
+        large_size, messages, large_peak = self.lookup_through_asgi(token, root)
+
+        assert messages > 1
+        # The memory used grows far slower than the document does
+        assert large_peak - small_peak < (large_size - small_size) / 4
+
+
+class TestBatch:
+    @staticmethod
+    def batch(user: User, items: list):
+        request = APIRequestFactory().post("/fake-url/", {"items": items}, format="json")
+        force_authenticate(request, user=user)
+        with CaptureQueriesContext(connection) as context:
+            response = RequestView.as_view({"post": "batch"})(request)
+        assert response.status_code == 200
+        return response.data["results"], len(context.captured_queries)
+
+    @staticmethod
+    def item(value: str, super_type: str = "OBSERVABLE", e_type: str = "DOMAIN"):
+        return {"value": value, "super_type": super_type, "type": e_type}
+
+    def test_item_statuses(self, user: User):
+        entity = EntityFactory()
+        failed = RequestFactory(type=entity.type, status=Request.Status.FAILED)
+
+        results, _ = self.batch(user, [
+            self.item(entity.name),
+            self.item("new.example.com"),
+            self.item(failed.value),
+            self.item("new.example.com"),
+            self.item("1.1.1.1", e_type="UNKNOWN"),
+        ])
+
+        assert [r["status"] for r in results] == ["AVAILABLE", "ENQUEUED", "FAILED", "ENQUEUED", "INVALID"]
+        assert results[0]["entity"] == entity.id
+        assert results[1]["request"] == results[3]["request"]
+        assert Request.objects.filter(value="new.example.com").count() == 1
+
+    def test_query_count_does_not_depend_on_batch_size(self, user: User):
+        entities = EntityFactory.create_batch(20)
+        # Load the entity types registry
+        self.batch(user, [self.item(entities[0].name)])
+        _, small_batch_queries = self.batch(user, [self.item(e.name) for e in entities[:2]] + [self.item("a.com")])
+        _, large_batch_queries = self.batch(
+            user, [self.item(e.name) for e in entities] + [self.item(f"{n}.example.com") for n in range(20)]
+        )
+
+        assert large_batch_queries == small_batch_queries
+
+
+class TestCoalescing:
+    @staticmethod
+    def force(user: User, value: str):
+        request = APIRequestFactory().post(
+            "/fake-url/", {"value": value, "super_type": "OBSERVABLE", "type": "DOMAIN", "force": True}, format="json"
+        )
+        force_authenticate(request, user=user)
+        response = RequestView.as_view({"post": "create"})(request)
+        assert response.status_code == 201
+        return response.data["id"]
+
+    def test_callers_attach_to_the_request_in_flight(self, user: User):
+        EntityFactory(name="example.com")
+
+        request_id = self.force(user, "example.com")
+
+        assert self.force(user, "example.com") == request_id
+        Request.objects.filter(id=request_id).update(status=Request.Status.SUCCEEDED)
+        assert self.force(user, "example.com") != request_id
+        assert Request.objects.filter(value="example.com").count() == 2
+
+    def test_stale_requests_are_replaced(self, user: User, settings):
+        settings.THREATR_REQUEST_STALE_AFTER = 60 * 60
+        EntityFactory(name="example.com")
+        request_id = self.force(user, "example.com")
+        Request.objects.filter(id=request_id).update(
+            status=Request.Status.PROCESSING, created_at=timezone.now() - timedelta(hours=2)
+        )
+
+        assert self.force(user, "example.com") != request_id
+        assert Request.objects.get(id=request_id).status == Request.Status.FAILED
+
+    def test_long_values(self, user: User):
+        EntityFactory(name="example.com")
+        # Larger than a btree index entry, even once compressed
+        value = f"{secrets.token_hex(4000)}.example.com"
+
+        request_id = self.force(user, value)
+
+        assert self.force(user, value) == request_id
+        assert Request.objects.for_value(value).get().id == uuid.UUID(request_id)
+
+    def test_a_single_request_in_flight(self):
+        request = RequestFactory(status=Request.Status.PROCESSING)
+
+        with pytest.raises(IntegrityError):
+            RequestFactory(value=request.value, type=request.type, status=Request.Status.ENQUEUED)
+
+
+class TestConditionalRequests:
+    @staticmethod
+    def lookup(user: User, entity, **headers):
+        request = APIRequestFactory().post(
+            "/fake-url/",
+            {"value": entity.name, "super_type": entity.super_type_id, "type": entity.type.short_name},
+            format="json",
+            **{f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()},
+        )
+        force_authenticate(request, user=user)
+        return RequestView.as_view({"post": "create"})(request)
+
+    def test_unchanged_results_are_not_sent_again(self, user: User):
+        root = EntityFactory()
+        EntityRelationFactory(obj_from=root)
+
+        response = self.lookup(user, root)
+        assert response.status_code == 200
+        etag = response["ETag"]
+        assert response["Last-Modified"]
+
+        response = self.lookup(user, root, **{"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+        assert not response.content
+
+        # New relations or events of the entity change the version of its results
+        Entity.objects.filter(id=root.id).update(graph_updated_at=timezone.now() + timedelta(seconds=1))
+        response = self.lookup(user, root, **{"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    def test_cached_results_follow_the_entity_version(self, user: User, settings):
+        settings.THREATR_RESULT_CACHE_TTL = 60
+        root = EntityFactory()
+        EntityRelationFactory(obj_from=root)
+        response = self.lookup(user, root)
+        etag = response["ETag"]
+        b"".join(response.streaming_content)
+        assert self.lookup(user, root).content
+
+        # The graph of the entity changes when the results of another request are written, its cache is not
+        # invalidated then
+        neighbour = EntityFactory()
+        EntityRelationFactory(obj_from=neighbour, obj_to=root)
+        Entity.objects.filter(id=root.id).update(graph_updated_at=timezone.now() + timedelta(seconds=1))
+        response = self.lookup(user, root, **{"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+        result = json.loads(b"".join(response.streaming_content))
+        assert str(neighbour.id) in {entity["id"] for entity in result["entities"]}
+
+    def test_unchanged_request(self, user: User):
+        request_object = RequestFactory(status=Request.Status.PROCESSING)
+        view = RequestView.as_view({"get": "retrieve"})
+        request = APIRequestFactory().get("/fake-url/")
+        force_authenticate(request, user=user)
+        etag = view(request, pk=str(request_object.id))["ETag"]
+
+        request = APIRequestFactory().get("/fake-url/", HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=user)
+        assert view(request, pk=str(request_object.id)).status_code == 304
+
+        Request.objects.filter(id=request_object.id).update(status=Request.Status.SUCCEEDED)
+        response = view(request, pk=str(request_object.id))
+        assert response.status_code == 200
+        assert response.data["status"] == Request.Status.SUCCEEDED
+
+
+class TestListing:
+    @staticmethod
+    def list(user: User, **params):
+        request = APIRequestFactory().get("/fake-url/", params)
+        force_authenticate(request, user=user)
+        response = RequestView.as_view({"get": "list"})(request)
+        assert response.status_code == 200
+        cursor = parse_qs(urlparse(response.data["next"]).query).get("cursor") if response.data["next"] else None
+        return [r["id"] for r in response.data["results"]], cursor[0] if cursor else None
+
+    def test_pages_follow_the_cursor(self, user: User):
+        requests = RequestFactory.create_batch(5, status=Request.Status.SUCCEEDED)
+        expected = [str(r.id) for r in sorted(requests, key=lambda r: (r.created_at, r.id), reverse=True)]
+
+        listed = []
+        cursor = None
+        while True:
+            ids, cursor = self.list(user, page_size=2, **({"cursor": cursor} if cursor else {}))
+            listed.extend(ids)
+            if not cursor:
+                break
+        assert listed == expected
+
+    def test_filters(self, user: User):
+        succeeded = RequestFactory(status=Request.Status.SUCCEEDED)
+        failed = RequestFactory(status=Request.Status.FAILED)
+
+        assert self.list(user, status="FAILED")[0] == [str(failed.id)]
+        assert self.list(user, value=succeeded.value)[0] == [str(succeeded.id)]
+        assert self.list(user, type="UNKNOWN")[0] == []
@@ -0,0 +1,79 @@
+import pytest
+from django.core.cache import cache
+from django.db import connection, models
+from django_q.status import Stat
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from threatr.core.api.generic import ModulesView, StatusView
+from threatr.core.models import Entity
+from threatr.core.statistics import count_objects
+from threatr.core.tests.factories import EntityFactory, EntityRelationFactory
+from threatr.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+
+class Probe(models.Model):
+    # Table created by the tests themselves, hence never analyzed whatever ran before them
+    class Meta:
+        app_label = "core"
+        managed = False
+        db_table = "statistics_probe"
+
+
+def analyze(table: str):
+    # ANALYZE updates pg_class in place, the rollback of the test does not undo it
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {table}")
+
+
+def test_count_objects():
+    EntityFactory.create_batch(3)
+    analyze("core_entity")
+    EntityFactory()
+
+    assert count_objects(Entity)[Entity] == 3
+    assert count_objects(Entity, exact=True)[Entity] == 4
+
+
+def test_tables_never_analyzed_are_counted_exactly():
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TABLE statistics_probe AS SELECT generate_series(1, 5) AS id")
+
+    assert count_objects(Probe) == {Probe: 5}
+
+
+def test_estimates_ignore_other_schemas():
+    EntityFactory.create_batch(2)
+    analyze("core_entity")
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA other")
+        cursor.execute("CREATE TABLE other.core_entity AS SELECT generate_series(1, 1000) AS n")
+    analyze("other.core_entity")
+
+    assert count_objects(Entity)[Entity] == 2
+
+
+def test_status_is_cached_unless_exact(user: User, monkeypatch, settings):
+    settings.THREATR_STATUS_CACHE_TTL = 60
+    cache.delete(StatusView.CACHE_KEY)
+    monkeypatch.setattr(Stat, "get_all", staticmethod(lambda: []))
+    monkeypatch.setattr(ModulesView, "get_module_list", staticmethod(lambda: []))
+    view = StatusView.as_view({"get": "now"})
+
+    def status(**params):
+        request = APIRequestFactory().get("/fake-url/", params)
+        force_authenticate(request, user=user)
+        response = view(request)
+        assert response.status_code == 200
+        return response.data
+
+    EntityRelationFactory()
+    analyze("core_entityrelation")
+    assert status()["cached_relations"] == 1
+    EntityRelationFactory()
+    analyze("core_entityrelation")
+    assert status()["cached_relations"] == 1
+    exact_status = status(exact="true")
+    assert exact_status["cached_relations"] == 2
+    assert exact_status["exact_counts"]
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from threatr.core.archive import store_response
+from threatr.core.models import Request, VendorResponse
+from threatr.core import tasks
+from threatr.core.tasks import _save_results, fail_stale_requests, launch_module, purge_expired_requests, run_modules
+from threatr.core.tests.factories import RequestFactory
+from threatr.modules.module import AnalysisModule
+
+pytestmark = pytest.mark.django_db
+
+
+def test_purge_expired_requests():
+    expired = RequestFactory.create_batch(5)
+    recent = RequestFactory()
+    Request.objects.filter(id__in=[r.id for r in expired]).update(created_at=timezone.now() - timedelta(days=40))
+
+    assert purge_expired_requests(max_age=30, batch_size=2) == 5
+    assert list(Request.objects.all()) == [recent]
+    # An explicit zero is not the default retention
+    assert purge_expired_requests(max_age=0) == 1
+    assert not Request.objects.exists()
+
+
+def test_fail_stale_requests(settings):
+    settings.THREATR_REQUEST_STALE_AFTER = 60 * 60
+    stale = RequestFactory(status=Request.Status.PROCESSING)
+    running = RequestFactory(status=Request.Status.PROCESSING)
+    done = RequestFactory(status=Request.Status.SUCCEEDED)
+    Request.objects.filter(id__in=[stale.id, done.id]).update(created_at=timezone.now() - timedelta(hours=2))
+
+    assert fail_stale_requests() == 1
+    assert dict(Request.objects.values_list("id", "status")) == {
+        stale.id: Request.Status.FAILED,
+        running.id: Request.Status.PROCESSING,
+        done.id: Request.Status.SUCCEEDED,
+    }
+
+
+class RecordingModule(AnalysisModule):
+    saved_responses = []
+
+    def __init__(self, request, credentials):
+        self.request = request
+        self.credentials = credentials
+
+    @classmethod
+    def unique_identifier(cls) -> str:
+        return "recording"
+
+    def execute_request(self):
+        raise AssertionError("The vendor must not be called")
+
+    def save_results(self):
+        self.saved_responses.append(self.vendor_response)
+
+    vendor = description = supported_types = get_results = None
+
+
+@pytest.fixture(autouse=True)
+def saved_responses(monkeypatch):
+    monkeypatch.setattr(RecordingModule, "saved_responses", [])
+
+
+def test_replay_feeds_the_recorded_response(settings, tmp_path):
+    settings.THREATR_ARCHIVE_ROOT = str(tmp_path)
+    recorded_request = RequestFactory(status=Request.Status.SUCCEEDED)
+    store_response(str(recorded_request.id), "recording", {"data": 42})
+    request = RequestFactory(value=recorded_request.value, type=recorded_request.type)
+
+    assert launch_module(request, RecordingModule, replay=True) == Request.Status.SUCCEEDED
+    assert RecordingModule.saved_responses == [{"data": 42}]
+    assert launch_module(RequestFactory(), RecordingModule, replay=True) == Request.Status.FAILED
+
+
+def test_responses_are_archived_by_the_worker(settings, tmp_path):
+    settings.THREATR_ARCHIVE_ROOT = str(tmp_path)
+    request = RequestFactory()
+    analysis_module = RecordingModule(request, {})
+    analysis_module.vendor_response = {"data": 42}
+    _save_results(request, RecordingModule, analysis_module)
+    assert list(VendorResponse.objects.filter(request=request).values_list("module", flat=True)) == ["recording"]
+
+    failed_module = RecordingModule(request, {})
+    failed_module.vendor_response = {"error": "Forbidden"}
+    failed_module.in_error = True
+    _save_results(request, RecordingModule, failed_module)
+    assert VendorResponse.objects.filter(request=request).count() == 1
+
+
+def test_responses_are_archived_once_saved(settings, tmp_path, monkeypatch):
+    settings.THREATR_ARCHIVE_ROOT = str(tmp_path)
+    request = RequestFactory()
+    analysis_module = RecordingModule(request, {})
+    analysis_module.vendor_response = {"data": 42}
+
+    def save_results():
+        assert not VendorResponse.objects.exists()
+        raise ValueError("Unexpected response")
+
+    monkeypatch.setattr(analysis_module, "save_results", save_results)
+    with pytest.raises(ValueError):
+        _save_results(request, RecordingModule, analysis_module)
+    # Responses the module failed to save can be replayed
+    assert VendorResponse.objects.filter(request=request).exists()
+
+
+class SlowModule(RecordingModule):
+    execution_time = save_time = 0
+    # Nothing to archive
+    in_error = True
+
+    @classmethod
+    def unique_identifier(cls) -> str:
+        return cls.__name__
+
+    async def execute_request_async(self):
+        await asyncio.sleep(self.execution_time)
+
+    def save_results(self):
+        time.sleep(self.save_time)
+        self.saved_responses.append(self.unique_identifier())
+
+
+def test_modules_saving_at_the_deadline_complete(settings, monkeypatch):
+    settings.THREATR_MODULES_DEADLINE = 0.2
+    monkeypatch.setattr(tasks, "_prepare_module", lambda request, handler: handler(request, {}))
+    saving = type("SavingModule", (SlowModule,), {"save_time": 0.5})
+    running = type("RunningModule", (SlowModule,), {"execution_time": 0.5})
+
+    assert run_modules(RequestFactory(), [saving, running]) == {
+        "SavingModule": Request.Status.SUCCEEDED,
+        "RunningModule": Request.Status.CANCELLED,
+    }
+    time.sleep(0.5)
+    assert RecordingModule.saved_responses == ["SavingModule"]
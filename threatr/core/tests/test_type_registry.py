@@ -0,0 +1,27 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from threatr.core.models import EntitySuperType, EntityType
+from threatr.core.tests.factories import EntityTypeFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_types_are_loaded_once():
+    domain = EntityTypeFactory(short_name="DOMAIN")
+    EntityType.get_types("OBSERVABLE")
+    with CaptureQueriesContext(connection) as context:
+        for _ in range(10):
+            assert EntitySuperType.get_types().get("OBSERVABLE") == domain.super_type
+            assert EntityType.get_types("observable").get("DOMAIN") == domain
+    assert len(context.captured_queries) == 0
+
+
+def test_registry_is_invalidated_on_change():
+    EntityTypeFactory(short_name="DOMAIN")
+    assert "IPV4" not in EntityType.get_types("OBSERVABLE")
+    ipv4 = EntityTypeFactory(short_name="IPV4")
+    assert EntityType.get_types("OBSERVABLE").get("IPV4") == ipv4
+    ipv4.delete()
+    assert "IPV4" not in EntityType.get_types("OBSERVABLE")
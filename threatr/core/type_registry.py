@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class TypeRegistry:
+    """
+    Process-local registry of the entity super types and types, keyed by (super type, short name).
+
+    The registry is loaded once per process and reloaded only when the shared version stamp changes. The version
+    stamp is bumped whenever a type is saved or deleted and is checked at most once every
+    THREATR_TYPE_REGISTRY_CHECK_INTERVAL seconds.
+    """
+    VERSION_KEY = "threatr:types:version"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.
+        self._super_types = {}
+        self._types = {}
+
+    def _load(self):
+        from threatr.core.models import EntitySuperType, EntityType
+
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < settings.THREATR_TYPE_REGISTRY_CHECK_INTERVAL:
+            return
+        with self._lock:
+            version = cache.get(self.VERSION_KEY, 0)
+            self._checked_at = now
+            if version == self._version:
+                return
+            super_types = {t.short_name: t for t in EntitySuperType.objects.all()}
+            types = {}
+            for t in EntityType.objects.all():
+                t.super_type = super_types.get(t.super_type_id)
+                types.setdefault(t.super_type_id, {})[t.short_name] = t
+            self._super_types = super_types
+            self._types = types
+            self._version = version
+            logger.debug(f"Loaded entity types (version {version})")
+
+    def get_super_types(self) -> dict:
+        self._load()
+        return dict(self._super_types)
+
+    def get_super_type(self, short_name: str):
+        self._load()
+        return self._super_types.get(short_name.upper())
+
+    def get_types(self, super_type: str) -> dict:
+        self._load()
+        return dict(self._types.get(super_type.upper(), {}))
+
+    def get_type(self, super_type: str, short_name: str):
+        self._load()
+        return self._types.get(super_type.upper(), {}).get(short_name.upper())
+
+    def invalidate(self):
+        try:
+            cache.incr(self.VERSION_KEY)
+        except ValueError:
+            cache.add(self.VERSION_KEY, 1, timeout=None)
+        self._version = None
+
+
+type_registry = TypeRegistry()
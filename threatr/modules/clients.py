@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool:
+    """
+    Per-worker pool of vendor API clients keyed by (vendor, credentials).
+
+    Clients are built once per worker process and then reused by every request so that their HTTP sessions keep
+    their connections alive instead of doing a new TCP/TLS handshake for each call. Asynchronous clients are bound to
+    the event loop they have been created on, they are pooled per event loop. Synchronous clients running an event
+    loop of their own under the hood are bound to their thread, they are pooled per thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: dict[tuple, Any] = {}
+
+    def get(
+        self,
+        vendor: str,
+        credentials: str,
+        factory: Callable[[], Any],
+        loop_bound: bool = False,
+        thread_bound: bool = False,
+    ):
+        """
+        Get the pooled client of the given vendor and credentials, build it with the factory if there is none.
+        :param loop_bound: whether the client is bound to the running event loop
+        :param thread_bound: whether the client is bound to the current thread
+        """
+        if loop_bound:
+            owner = asyncio.get_running_loop()
+        elif thread_bound:
+            owner = threading.current_thread()
+        else:
+            owner = None
+        key = (vendor, credentials, owner)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+                logger.debug(f"New {vendor} client")
+            return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+client_pool = ClientPool()
@@ -1,15 +1,11 @@
 import logging
-
-from colander_data_converter.base.models import CommonEntitySuperTypes
-from colander_data_converter.base.types.observable import ObservableTypes
-from colander_data_converter.converters.misp.converter import MISPToColanderMapper
-from colander_data_converter.converters.misp.models import Mapping, EntityTypeMapping
-from colander_data_converter.converters.threatr.converter import ColanderToThreatrMapper
-from pymisp import PyMISP, MISPAttribute
+from datetime import timedelta
 
 from threatr.core.models import (
     Request, Entity, EntityRelation, Event, EntitySuperType, EntityType,
 )
+from threatr.core.persistence import ResultsWriter
+from threatr.modules.clients import client_pool
 from threatr.modules.module import AnalysisModule, ModuleUtils
 
 logger = logging.getLogger(__name__)
@@ -46,6 +42,10 @@ class MISPModule(AnalysisModule):
             'observable': ['ipv4', 'ipv6', 'domain', 'md5', 'sha1', 'sha256', 'email'],
         }
 
+    @classmethod
+    def freshness(cls) -> timedelta:
+        return timedelta(days=1)
+
     def fail_fast(self) -> bool:
         return super().fail_fast()
 
@@ -55,29 +55,37 @@ class MISPModule(AnalysisModule):
     def save_results(self):
         if self.in_error:
             return
+        from colander_data_converter.converters.misp.converter import MISPToColanderMapper
+        from colander_data_converter.converters.threatr.converter import ColanderToThreatrMapper
+        from pymisp import MISPAttribute
+
         misp_attribute = MISPAttribute()
         misp_attribute.from_dict(**self.vendor_response)
         converter = MISPToColanderMapper()
         colander_entity = converter.convert_attribute(misp_attribute)
         threatr_mapper = ColanderToThreatrMapper()
         threatr_entity = threatr_mapper.convert_entity(colander_entity)
-        entity, _ = Entity.objects.update_or_create(
-            name=threatr_entity.name,
-            super_type=EntitySuperType.get_types().get("OBSERVABLE"),
-            type=EntityType.get_types("OBSERVABLE").get(threatr_entity.type.short_name),
-            defaults={
-                "description": threatr_entity.description,
-                "tlp": threatr_entity.tlp,
-                "pap": threatr_entity.pap,
-            }
+        writer = ResultsWriter(self.vendor())
+        entity = writer.entity(
+            threatr_entity.name,
+            EntitySuperType.get_types().get("OBSERVABLE"),
+            EntityType.get_types("OBSERVABLE").get(threatr_entity.type.short_name),
+            description=threatr_entity.description,
+            tlp=threatr_entity.tlp,
+            pap=threatr_entity.pap,
+            overwrite=True,
         )
         if threatr_entity.attributes:
             tags = threatr_entity.attributes.get("tags", "")
             ModuleUtils.merge_tags(entity, tags)
-        entity.save()
-        self.entities.append(entity)
+        self.entities, self.relations, self.events = writer.flush()
 
     def execute_request(self):
+        from colander_data_converter.base.models import CommonEntitySuperTypes
+        from colander_data_converter.base.types.observable import ObservableTypes
+        from colander_data_converter.converters.misp.models import Mapping, EntityTypeMapping
+        from pymisp import PyMISP
+
         misp_url = self.credentials.get("url")
         misp_key = self.credentials.get("api_key")
         mapping = Mapping()
@@ -90,7 +98,9 @@ class MISPModule(AnalysisModule):
         )
         misp_type = entity_type_mapping.misp_type
         try:
-            pymisp = PyMISP(misp_url, misp_key, debug=False)
+            pymisp: PyMISP = client_pool.get(
+                self.vendor(), f"{misp_url}\x00{misp_key}", lambda: PyMISP(misp_url, misp_key, debug=False)
+            )
             self.vendor_response = pymisp.search(
                 controller="attributes",
                 type=misp_type,
@@ -1,5 +1,7 @@
+import asyncio
 import logging
 from abc import abstractmethod, ABC
+from datetime import timedelta
 
 from slugify import slugify
 
@@ -15,6 +17,8 @@ class AnalysisModule(ABC):
     events: list = []
     credentials: dict = None
     vendor_response: dict = None
+    # Set by the modules whose vendor answered with an error, their response is not archived
+    in_error: bool = False
 
     @classmethod
     @abstractmethod
@@ -43,6 +47,23 @@ class AnalysisModule(ABC):
         """
         pass
 
+    @classmethod
+    def rate_limit(cls) -> tuple[int, int] | None:
+        """
+        Number of calls allowed by the vendor per period of seconds for a single set of credentials, as
+        (calls, seconds). It can be overridden per credentials with a `rate_limit` entry formatted as `calls/seconds`.
+        :return: the rate limit or None if the vendor does not limit the rate of calls
+        """
+        return None
+
+    @classmethod
+    def freshness(cls) -> timedelta:
+        """
+        How long the data obtained from the vendor is considered fresh. Once stale, the data is still served but a
+        new enrichment is enqueued. It can be overridden with the THREATR_MODULES_FRESHNESS setting.
+        """
+        return timedelta(days=7)
+
     @abstractmethod
     def __init__(self, request: Request):
         pass
@@ -55,6 +76,13 @@ class AnalysisModule(ABC):
     def execute_request(self):
         pass
 
+    async def execute_request_async(self):
+        """
+        Asynchronous counterpart of `execute_request`, run on the event loop of the worker. Modules able to query
+        their vendor asynchronously override it, by default `execute_request` is run in a thread.
+        """
+        return await asyncio.to_thread(self.execute_request)
+
     @abstractmethod
     def save_results(self):
         pass
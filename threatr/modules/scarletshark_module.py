@@ -1,6 +1,4 @@
-import json
 import logging
-from scarlet_shark_client.client import ClientFactory
 
 from threatr.core.models import (
     Entity,
@@ -8,6 +6,8 @@ from threatr.core.models import (
     Request,
     Event, EntitySuperType, EntityType,
 )
+from threatr.core.persistence import ResultsWriter
+from threatr.modules.clients import client_pool
 from threatr.modules.module import AnalysisModule, ModuleUtils
 
 logger = logging.getLogger(__name__)
@@ -24,8 +24,6 @@ class ScarletShark(AnalysisModule):
     def __init__(self, request: Request, credentials: dict):
         self.request = request
         self.credentials = credentials
-        key = self.credentials.get('api_key', '')
-        self.client = ClientFactory.get_client(key, api_version='v0.4', print_json=False)
 
     @classmethod
     def unique_identifier(cls) -> str:
@@ -50,76 +48,64 @@ class ScarletShark(AnalysisModule):
         return super().fail_fast()
 
     def execute_request(self) -> dict:
+        from scarlet_shark_client.client import ClientFactory
+
+        key = self.credentials.get('api_key', '')
+        self.client = client_pool.get(
+            self.vendor(), key, lambda: ClientFactory.get_client(key, api_version='v0.4', print_json=False)
+        )
         obj_type = self.request.type.short_name
         if obj_type.lower() in ["sha256"]:
             self.vendor_response = self.client.search_hash(sha256=self.request.value)
-            with open("/app/scarlet_shark_hash.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
         elif obj_type.lower() in ["domain"]:
             self.vendor_response = self.client.search_domain(self.request.value)
-            with open("/app/scarlet_shark_domain.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
+            # Keep the details of the threat actor along with the response so that it can be replayed
+            threat_actor_id = self.vendor_response.get('threat_actor_id', 0) if self.vendor_response else 0
+            if threat_actor_id > 0:
+                self.vendor_response['threat_actor'] = self.client.search_threat_actors(
+                    threat_actor_id=threat_actor_id
+                )
         elif obj_type.lower() in ["ipv4", "ipv6"]:
             obj = self.client.search_ip(ip=self.request.value).get('ips', [])
             if obj:
                 obj = obj[0]
             self.vendor_response = obj
-            with open("/app/scarlet_shark_ip.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
         elif obj_type.lower() in ["url"]:
             obj = self.client.search_url(url=self.request.value).get('urls', [])
             if obj:
                 obj = obj[0]
             self.vendor_response = obj
-            with open("/app/scarlet_shark_url.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
         elif obj_type.lower() in ["email"]:
             obj = self.client.search_email(email=self.request.value)
             if obj:
                 obj = obj[0]
             self.vendor_response = obj
-            with open("/app/scarlet_shark_email.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
         return self.vendor_response
 
-    def __process_threat_actor(self, actor_id):
-        if actor_id < 1: return None  # noqa: E701
-        result = self.client.search_threat_actors(threat_actor_id=actor_id)
+    def __process_threat_actor(self, writer: ResultsWriter, result):
         if not result: return None  # noqa: E701
         aliases = result.get('aliases', [])
         if not aliases: return None  # noqa: E701
         name = aliases.pop(0).get('alias_name')
         description = result.get('description', '')
-        actor, _ = Entity.objects.update_or_create(
-            name=name.strip(),
-            super_type=EntitySuperType.get_types().get("ACTOR"),
-            type=EntityType.get_types("ACTOR").get("THREAT_ACTOR"),
+        actor = writer.entity(
+            name.strip(),
+            EntitySuperType.get_types().get("ACTOR"),
+            EntityType.get_types("ACTOR").get("THREAT_ACTOR"),
+            description=description,
         )
-        ModuleUtils.merge_attributes(actor, {
-            'source_vendor': self.vendor(),
-        })
-        if not actor.description and description:
-            actor.description = description
-        actor.save()
         for alias in aliases:
             alias_name = alias.get('alias_name', '')
             if not alias_name: continue  # noqa: E701
-            a, _ = Entity.objects.update_or_create(
-                name=alias_name.strip(),
-                super_type=EntitySuperType.get_types().get("ACTOR"),
-                type=EntityType.get_types("ACTOR").get("THREAT_ACTOR"),
-            )
-            ModuleUtils.merge_attributes(a, {
-                'source_vendor': self.vendor(),
-            })
-            aka, _ = EntityRelation.objects.update_or_create(
-                name="also known as",
-                obj_from=actor,
-                obj_to=a,
+            a = writer.entity(
+                alias_name.strip(),
+                EntitySuperType.get_types().get("ACTOR"),
+                EntityType.get_types("ACTOR").get("THREAT_ACTOR"),
             )
+            writer.relation("also known as", actor, a)
         return actor
 
-    def __process_domain(self):
+    def __process_domain(self, writer: ResultsWriter):
         if not self.vendor_response.get('domain', ''):
             return None
         domain = self.vendor_response.get('domain', '')
@@ -127,10 +113,11 @@ class ScarletShark(AnalysisModule):
         reference_url = self.vendor_response.get('reference_url', '')
         domain_description = self.vendor_response.get('domain_description', '')
         tags = self.vendor_response.get('tags', [])
-        d, _ = Entity.objects.update_or_create(
-            name=domain.strip(),
-            super_type=EntitySuperType.get_types().get("OBSERVABLE"),
-            type=EntityType.get_types("OBSERVABLE").get("DOMAIN"),
+        d = writer.entity(
+            domain.strip(),
+            EntitySuperType.get_types().get("OBSERVABLE"),
+            EntityType.get_types("OBSERVABLE").get("DOMAIN"),
+            description=domain_description,
         )
         ModuleUtils.merge_attributes(d, {
             'source_vendor': self.vendor(),
@@ -138,35 +125,23 @@ class ScarletShark(AnalysisModule):
             'reference_url': reference_url
         })
         ModuleUtils.merge_tags(d, tags)
-        if not d.description and domain_description:
-            d.description = domain_description
-        threat_actor_id = self.vendor_response.get('threat_actor_id', 0)
-        threat_actor = self.__process_threat_actor(threat_actor_id)
+        threat_actor = self.__process_threat_actor(writer, self.vendor_response.get('threat_actor'))
         if threat_actor:
             d.attributes['is_malicious'] = True
-            d.attributes['operated_by'] = str(threat_actor.id)
-            relation, created = EntityRelation.objects.update_or_create(
-                name="operated by", obj_from=d, obj_to=threat_actor
-            )
-            if created:
-                relation.attributes = {"source_vendor": self.vendor()}
-                relation.save()
-        d.save()
+            d.attributes['operated_by'] = threat_actor
+            writer.relation("operated by", d, threat_actor)
         return d
 
     def save_results(self):
+        writer = ResultsWriter(self.vendor())
         # Create or update root entity
-        root, created = Entity.objects.update_or_create(
-            name=self.request.value,
-            super_type=self.request.super_type,
-            type=self.request.type,
-        )
+        root = writer.entity(self.request.value, self.request.super_type, self.request.type)
         ModuleUtils.merge_attributes(root, {
             'source_vendor': self.vendor(),
         })
-        root.save()
         if self.request.type.short_name.lower() == 'domain':
-            self.__process_domain()
+            self.__process_domain(writer)
+        self.entities, self.relations, self.events = writer.flush()
 
     def get_results(self) -> ([Entity], [EntityRelation], [Event]):
         return self.entities, self.relations, self.events
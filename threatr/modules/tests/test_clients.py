@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+from threatr.modules.clients import ClientPool
+from threatr.modules.module import AnalysisModule
+
+
+def test_client_pool_reuses_clients():
+    pool = ClientPool()
+
+    client = pool.get("vendor", "key", object)
+
+    assert pool.get("vendor", "key", object) is client
+    assert pool.get("vendor", "other key", object) is not client
+    assert pool.get("other vendor", "key", object) is not client
+
+
+def test_client_pool_binds_clients_to_their_event_loop():
+    pool = ClientPool()
+
+    async def get_client():
+        return pool.get("vendor", "key", object, loop_bound=True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        client = loop.run_until_complete(get_client())
+        assert loop.run_until_complete(get_client()) is client
+    finally:
+        loop.close()
+    assert asyncio.run(get_client()) is not client
+
+
+class SyncModule(AnalysisModule):
+    def __init__(self):
+        self.thread = None
+
+    def execute_request(self):
+        self.thread = threading.current_thread()
+        return {"data": 42}
+
+    vendor = unique_identifier = description = supported_types = None
+    save_results = get_results = None
+
+
+def test_sync_modules_are_run_in_a_thread():
+    module = SyncModule()
+
+    assert asyncio.run(module.execute_request_async()) == {"data": 42}
+    assert module.thread is not threading.current_thread()
+
+
+def test_client_pool_binds_clients_to_their_thread():
+    pool = ClientPool()
+    client = pool.get("vendor", "key", object, thread_bound=True)
+
+    assert pool.get("vendor", "key", object, thread_bound=True) is client
+    thread = threading.Thread(target=lambda: clients.append(pool.get("vendor", "key", object, thread_bound=True)))
+    clients = []
+    thread.start()
+    thread.join()
+    assert clients[0] is not client
@@ -1,9 +1,7 @@
-import json
 import logging
 from datetime import datetime
 
 import pytz
-from vt import Client
 
 from threatr.core.models import (
     Entity,
@@ -13,7 +11,9 @@ from threatr.core.models import (
     EntityType,
     Event,
 )
-from threatr.modules.module import AnalysisModule
+from threatr.core.persistence import ResultsWriter
+from threatr.modules.clients import client_pool
+from threatr.modules.module import AnalysisModule, ModuleUtils
 
 logger = logging.getLogger(__name__)
 
@@ -73,45 +73,52 @@ class VirusTotal(AnalysisModule):
             'observable': ['ipv4', 'ipv6', 'domain', 'sha256', 'sha1', 'md5', 'url', 'dns_record']
         }
 
+    @classmethod
+    def rate_limit(cls) -> tuple[int, int] | None:
+        return (4, 60)
+
     def fail_fast(self) -> bool:
         return super().fail_fast()
 
+    def _get_endpoint(self) -> str | None:
+        request_type = self.request.type.short_name.lower()
+        if request_type in ["sha256", "sha1", "md5"]:
+            return f"/files/{self.request.value}"
+        elif request_type in ["domain"]:
+            return f"/domains/{self.request.value}"
+        elif request_type in ["ipv4", "ipv6"]:
+            return f"/ip_addresses/{self.request.value}"
+        elif request_type in ["url"]:
+            return f"/urls/{self.request.value}"
+        return None
+
     def execute_request(self) -> dict:
-        key = self.credentials.get("api_key")
-        vt = Client(key)
-        if self.request.type.short_name.lower() in ["sha256", "sha1", "md5"]:
-            self.vendor_response = vt.get_json(f"/files/{self.request.value}")
-            with open("/app/vt_hash.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
-        elif self.request.type.short_name.lower() in ["domain"]:
-            self.vendor_response = vt.get_json(f"/domains/{self.request.value}")
-            with open("/app/vt_domain.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
-        elif self.request.type.short_name.lower() in ["ipv4", "ipv6"]:
-            self.vendor_response = vt.get_json(f"/ip_addresses/{self.request.value}")
-            with open("/app/vt_ip.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
-        elif self.request.type.short_name.lower() in ["url"]:
-            self.vendor_response = vt.get_json(f"/urls/{self.request.value}")
-            with open("/app/vt_url.json", mode="w") as out:
-                json.dump(self.vendor_response, out)
+        endpoint = self._get_endpoint()
+        if endpoint:
+            from vt import Client
+
+            key = self.credentials.get("api_key")
+            # The synchronous client runs its requests on the event loop of the current thread
+            vt = client_pool.get(self.vendor(), key, lambda: Client(key), thread_bound=True)
+            self.vendor_response = vt.get_json(endpoint)
+        return self.vendor_response
+
+    async def execute_request_async(self) -> dict:
+        endpoint = self._get_endpoint()
+        if endpoint:
+            from vt import Client
+
+            key = self.credentials.get("api_key")
+            vt = client_pool.get(self.vendor(), key, lambda: Client(key), loop_bound=True)
+            self.vendor_response = await vt.get_json_async(endpoint)
         return self.vendor_response
 
     def save_results(self):
-        entities = []
-        relations = []
-        events = []
+        writer = ResultsWriter(self.vendor())
 
         response = self.vendor_response["data"]["attributes"]
 
-        root, created = Entity.objects.update_or_create(
-            name=self.request.value,
-            super_type=self.request.super_type,
-            type=self.request.type,
-        )
-        if created:
-            root.attributes = {"source_vendor": self.vendor()}
-            root.save()
+        root = writer.entity(self.request.value, self.request.super_type, self.request.type)
 
         if "tlsh" in response:
             root.attributes["tlsh"] = response["tlsh"]
@@ -139,88 +146,42 @@ class VirusTotal(AnalysisModule):
         root.attributes["vt_score"] = f"{malicious}/{total}"
         if "categories" in response and "alphaMountain.ai" in response["categories"]:
             root.attributes["category"] = response["categories"]["alphaMountain.ai"]
-        root.save()
 
         if malicious > 0:
             cat, name, threat_type = _get_vt_threat_cat_and_name(response)
             if name:
-                threat, created = Entity.objects.update_or_create(
-                    name=name if name else "Uncategorized",
-                    super_type=EntitySuperType.get_types().get("THREAT"),
-                    type=threat_type,
-                )
-                if created:
-                    threat.attributes = {"source_vendor": self.vendor()}
-                    threat.save()
-                if response["tags"] and "tags" not in threat.attributes:
-                    threat.attributes["tags"] = ",".join(response["tags"])
-                    threat.save()
-                root.attributes["associated_threat"] = str(threat.id)
-                entities.append(threat)
-
-                relation, created = EntityRelation.objects.update_or_create(
-                    name="associated threat",
-                    obj_from=root,
-                    obj_to=threat,
+                threat = writer.entity(
+                    name if name else "Uncategorized",
+                    EntitySuperType.get_types().get("THREAT"),
+                    threat_type,
                 )
-                if created:
-                    relation.attributes = {"source_vendor": self.vendor()}
-                    relation.save()
-                relations.append(relation)
+                if response["tags"]:
+                    ModuleUtils.merge_tags(threat, response["tags"])
+                root.attributes["associated_threat"] = threat
+                writer.relation("associated threat", root, threat)
 
         if "last_dns_records" in response and response["last_dns_records"]:
+            observable = EntitySuperType.get_types().get("OBSERVABLE")
+            observable_types = EntityType.get_types("OBSERVABLE")
             for record in response["last_dns_records"]:
                 t = record["type"]
                 v = record["value"]
-                dns_record, created = Entity.objects.update_or_create(
-                    name=f"{t} {v}",
-                    super_type=EntitySuperType.get_types().get("OBSERVABLE"),
-                    type=EntityType.get_types("OBSERVABLE").get("DNS_RECORD"),
-                )
-                if created:
-                    dns_record.attributes = {"source_vendor": self.vendor()}
-                    dns_record.save()
+                dns_record = writer.entity(f"{t} {v}", observable, observable_types.get("DNS_RECORD"))
 
                 if t in ["A", "AAAA"]:
-                    ip_type = EntityType.get_types("OBSERVABLE").get("IPV4")
+                    ip_type = observable_types.get("IPV4")
                     if t == "AAAA":
-                        ip_type = EntityType.get_types("OBSERVABLE").get("IPV6")
-                    target_ip, created = Entity.objects.update_or_create(
-                        name=v,
-                        super_type=EntitySuperType.get_types().get("OBSERVABLE"),
-                        type=ip_type,
-                    )
-                    if created:
-                        target_ip.attributes = {"source_vendor": self.vendor()}
-                        target_ip.save()
-                    entities.append(target_ip)
-                    record_to_ip, created = EntityRelation.objects.update_or_create(
-                        name="points to", obj_from=dns_record, obj_to=target_ip
-                    )
-                    if created:
-                        record_to_ip.attributes = {"source_vendor": self.vendor()}
-                        record_to_ip.save()
-                    relations.append(record_to_ip)
-                    ip_to_domain, created = EntityRelation.objects.update_or_create(
-                        name="resolves", obj_from=target_ip, obj_to=root
-                    )
-                    if created:
-                        ip_to_domain.attributes = {"source_vendor": self.vendor()}
-                        ip_to_domain.save()
-                    relations.append(ip_to_domain)
+                        ip_type = observable_types.get("IPV6")
+                    target_ip = writer.entity(v, observable, ip_type)
+                    writer.relation("points to", dns_record, target_ip)
+                    writer.relation("resolves", target_ip, root)
                 else:
-                    relation, created = EntityRelation.objects.update_or_create(
-                        name="resolves", obj_from=dns_record, obj_to=root
-                    )
-                    if created:
-                        relation.attributes = {"source_vendor": self.vendor()}
-                        relation.save()
-                    relations.append(relation)
+                    writer.relation("resolves", dns_record, root)
 
         if "first_submission_date" in response and "last_submission_date" in response:
-            av_submissions, _ = Event.objects.update_or_create(
-                name="Submission on VT",
-                type=EntityType.get_types("EVENT").get("HIT"),
+            writer.event(
+                "Submission on VT",
+                EntityType.get_types("EVENT").get("HIT"),
                 first_seen=datetime.fromtimestamp(
                     response["first_submission_date"]
                 ).astimezone(pytz.utc),
@@ -228,16 +189,12 @@ class VirusTotal(AnalysisModule):
                     response["last_submission_date"]
                 ).astimezone(pytz.utc),
                 involved_entity=root,
-                defaults={
-                    "count": response["times_submitted"],
-                    "attributes": {"source_vendor": self.vendor()},
-                },
+                count=response["times_submitted"],
             )
-            events.append(av_submissions)
         if malicious > 0:
-            av_analysis, _ = Event.objects.update_or_create(
-                name="Analysis on VT",
-                type=EntityType.get_types("EVENT").get("AV_DETECTION"),
+            writer.event(
+                "Analysis on VT",
+                EntityType.get_types("EVENT").get("AV_DETECTION"),
                 first_seen=datetime.fromtimestamp(
                     response["last_analysis_date"]
                 ).astimezone(pytz.utc),
@@ -245,14 +202,10 @@ class VirusTotal(AnalysisModule):
                     response["last_analysis_date"]
                 ).astimezone(pytz.utc),
                 involved_entity=root,
-                defaults={"count": 1, "attributes": {"source_vendor": self.vendor()}},
+                count=1,
             )
-            events.append(av_analysis)
-        entities.append(root)
 
-        self.entities = list(set(entities))
-        self.relations = list(set(relations))
-        self.events = list(set(events))
+        self.entities, self.relations, self.events = writer.flush()
 
     def get_results(self) -> ([Entity], [EntityRelation], [Event]):
         return self.entities, self.relations, self.events